@@ -1,111 +1,82 @@
 # admin_clients.py
 
 import html
+import logging
+from typing import Optional
+from urllib.parse import quote
 from fastapi import APIRouter, Depends, Query, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, or_
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, lazyload, selectinload
 
 # Додано Settings
-from models import Order, OrderStatusHistory, Employee, Settings
-from templates import ADMIN_HTML_TEMPLATE, ADMIN_CLIENTS_LIST_BODY, ADMIN_CLIENT_DETAIL_BODY
+from models import Order, OrderStatusHistory, Employee, Settings, CustomerStats
+from template_engine import tpl
 from dependencies import get_db_session, check_credentials
+from reference_cache import get_cached_settings
+from pagination import Keyset, KeysetPage, render_pagination, approximate_row_count
+from search import customer_search, ranked, results_label
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.get("/admin/clients", response_class=HTMLResponse)
 async def admin_clients_list(
-    page: int = Query(1, ge=1),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
     q: str = Query(None, alias="search"),
     session: AsyncSession = Depends(get_db_session),
     username: str = Depends(check_credentials)
 ):
     """Відображає сторінку клієнтів з можливістю пошуку та пагінації."""
     # NEW: Отримуємо налаштування
-    settings = await session.get(Settings, 1) or Settings()
-    per_page = 20
-    offset = (page - 1) * per_page
-
-    # Підзапит для отримання останнього імені клієнта для кожного номера телефону
-    latest_name_subquery = (
-        select(
-            Order.phone_number,
-            Order.customer_name,
-            func.row_number().over(
-                partition_by=Order.phone_number,
-                order_by=Order.id.desc()
-            ).label("rn")
-        )
-        .where(Order.phone_number.isnot(None))
-        .subquery()
-    )
-
-    # Основний запит для агрегації даних про клієнтів
-    client_query = (
-        select(
-            Order.phone_number,
-            func.count(Order.id).label("order_count"),
-            func.sum(Order.total_price).label("total_spent"),
-            latest_name_subquery.c.customer_name.label("customer_name")
-        )
-        .join(latest_name_subquery, Order.phone_number == latest_name_subquery.c.phone_number)
-        .where(latest_name_subquery.c.rn == 1)
-        .group_by(Order.phone_number, latest_name_subquery.c.customer_name)
-        .order_by(func.count(Order.id).desc())
+    settings = await get_cached_settings(session)
+    keyset = Keyset(
+        [CustomerStats.order_count, CustomerStats.phone_number], lambda c: (c.order_count, c.phone_number),
+        per_page=20, after=after, before=before,
     )
 
+    # Агрегати клієнтів беруться з customer_stats (підтримується при кожному commit замовлень)
+    client_query = select(CustomerStats)
     if q:
-        client_query = client_query.where(
-            or_(
-                latest_name_subquery.c.customer_name.ilike(f"%{q}%"),
-                Order.phone_number.ilike(f"%{q}%")
-            )
-        )
-
-    total_res = await session.execute(select(func.count()).select_from(client_query.subquery()))
-    total = total_res.scalar_one()
-    pages = (total // per_page) + (1 if total % per_page > 0 else 0)
-
-    clients_res = await session.execute(client_query.limit(per_page).offset(offset))
-    clients = clients_res.mappings().all()
-
-    rows = "".join([f"""
-    <tr>
-        <td><a href="/admin/client/{c['phone_number']}">{html.escape(c['customer_name'])}</a></td>
-        <td>{html.escape(c['phone_number'])}</td>
-        <td>{c['order_count']}</td>
-        <td>{c['total_spent']} грн</td>
-        <td class="actions">
-            <a href="/admin/client/{c['phone_number']}" class="button-sm">Дивитись</a>
-        </td>
-    </tr>""" for c in clients])
-
-    # --- ВИПРАВЛЕННЯ Пагінації ---
-    links = []
-    for i in range(1, pages + 1):
-        search_part = f'&search={q}' if q else ''
-        class_part = 'active' if i == page else ''
-        links.append(f'<a href="/admin/clients?page={i}{search_part}" class="{class_part}">{i}</a>')
-    
-    pagination = f"<div class='pagination'>{' '.join(links)}</div>"
-    # --- КІНЕЦЬ ВИПРАВЛЕННЯ ---
-
-    body = ADMIN_CLIENTS_LIST_BODY.format(
-        search_query=q or '',
-        rows=rows or "<tr><td colspan='5'>Клієнтів не знайдено</td></tr>",
-        pagination=pagination if pages > 1 else ""
+        clients_res = await session.execute(ranked(
+            client_query, customer_search(session, q), CustomerStats.order_count.desc(), CustomerStats.phone_number.desc()
+        ))
+        page = KeysetPage(clients_res.scalars().all())
+    else:
+        clients_res = await session.execute(keyset.apply(client_query))
+        page = keyset.page(clients_res.scalars().all())
+    clients = page.rows
+
+    # Рядки генеруються ліниво і віддаються потоком разом зі сторінкою
+    rows = (tpl.ADMIN_CLIENT_ROW.render(
+        phone_link=quote(c.phone_number, safe=''),
+        customer_name=html.escape(c.customer_name or ''),
+        phone_number=html.escape(c.phone_number),
+        order_count=c.order_count,
+        total_spent=c.total_spent,
+    ) for c in clients) if clients else "<tr><td colspan='5'>Клієнтів не знайдено</td></tr>"
+
+    total_label = results_label(len(clients)) if q else f"Всього: ≈{await approximate_row_count(session, CustomerStats)}"
+    pagination = render_pagination("/admin/clients", page, total_label, search=q)
+
+    body = tpl.ADMIN_CLIENTS_LIST_BODY.iter_render(
+        search_query=html.escape(q or ''),
+        rows=rows,
+        pagination=pagination
     )
     
     active_classes = {key: "" for key in ["main_active", "products_active", "categories_active", "orders_active", "statuses_active", "employees_active", "settings_active", "reports_active", "menu_active", "tables_active", "design_active"]}
     active_classes["clients_active"] = "active"
 
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return StreamingResponse(tpl.ADMIN_HTML_TEMPLATE.iter_render(
         title="Клієнти", 
         body=body, 
         site_title=settings.site_title or "Назва", # <-- Використання site_title
         **active_classes
-    ))
+    ), media_type="text/html")
 
 
 @router.get("/admin/client/{phone_number}", response_class=HTMLResponse)
@@ -115,15 +86,18 @@ async def admin_client_detail(
     username: str = Depends(check_credentials)
 ):
     """Відображає детальну інформацію про клієнта та його історію замовлень."""
-    settings = await session.get(Settings, 1) or Settings()
-    
+    settings = await get_cached_settings(session)
+    stats = await session.get(CustomerStats, phone_number)
+
     orders_res = await session.execute(
         select(Order)
         .where(Order.phone_number == phone_number)
         .options(
             joinedload(Order.status),
-            joinedload(Order.completed_by_courier),
-            joinedload(Order.history).joinedload(OrderStatusHistory.status)
+            # Потрібне лише ім'я кур'єра - без selectin-завантаження його ролі
+            joinedload(Order.completed_by_courier).lazyload(Employee.role),
+            # Окремим запитом, щоб рядки замовлень не множилися на записи історії
+            selectinload(Order.history).joinedload(OrderStatusHistory.status)
         )
         .order_by(Order.id.desc())
     )
@@ -133,14 +107,20 @@ async def admin_client_detail(
     if not orders:
         raise HTTPException(status_code=404, detail="Клієнта з таким номером не знайдено")
 
-    # Деталі клієнта з останнього замовлення
-    latest_order = orders[0]
-    client_name = latest_order.customer_name
-    client_address = latest_order.address
-
-    # Загальна статистика
-    total_orders = len(orders)
-    total_spent = sum(o.total_price for o in orders)
+    if stats is not None:
+        # Деталі клієнта та загальна статистика - з агрегату
+        client_name = stats.customer_name or ""
+        client_address = stats.address
+        total_orders = stats.order_count
+        total_spent = stats.total_spent
+    else:
+        # Агрегату ще немає (замовлення внесено в БД напряму, відновлення з копії) - рахуємо
+        # з уже завантажених замовлень, як customer_stats: ім'я та адреса з останнього
+        logger.warning(f"Немає customer_stats для {phone_number}, статистику пораховано із замовлень")
+        client_name = orders[0].customer_name or ""
+        client_address = orders[0].address
+        total_orders = len(orders)
+        total_spent = sum(o.total_price or 0 for o in orders)
 
     order_rows = []
     for o in orders:
@@ -174,7 +154,7 @@ async def admin_client_detail(
         </tr>
         """)
 
-    body = ADMIN_CLIENT_DETAIL_BODY.format(
+    body = tpl.ADMIN_CLIENT_DETAIL_BODY.render(
         client_name=html.escape(client_name),
         phone_number=html.escape(phone_number),
         address=html.escape(client_address or "Не вказана"),
@@ -186,7 +166,7 @@ async def admin_client_detail(
     active_classes = {key: "" for key in ["main_active", "products_active", "categories_active", "orders_active", "statuses_active", "employees_active", "settings_active", "reports_active", "menu_active", "tables_active", "design_active"]}
     active_classes["clients_active"] = "active"
 
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title=f"Клієнт: {html.escape(client_name)}", 
         body=body, 
         site_title=settings.site_title or "Назва", # <-- Використання site_title
@@ -7,8 +7,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from models import Settings
-from templates import ADMIN_HTML_TEMPLATE, ADMIN_DESIGN_SETTINGS_BODY
+from template_engine import tpl
 from dependencies import get_db_session, check_credentials
+from reference_cache import get_cached_settings, invalidate_reference_cache
 
 router = APIRouter()
 
@@ -30,9 +31,7 @@ async def get_design_settings_page(
     username: str = Depends(check_credentials)
 ):
     """Відображає сторінку налаштувань дизайну, SEO та текстів."""
-    settings = await session.get(Settings, 1)
-    if not settings:
-        settings = Settings() # Provide default values if no settings exist
+    settings = await get_cached_settings(session)
 
     # --- Функція для генерації HTML <option> для <select> ---
     def get_font_options(font_list: list, selected_font: str, default_font: str) -> str:
@@ -46,7 +45,7 @@ async def get_design_settings_page(
         return options_html
     # -----------------------------------------------------
 
-    body = ADMIN_DESIGN_SETTINGS_BODY.format(
+    body = tpl.ADMIN_DESIGN_SETTINGS_BODY.render(
         site_title=settings.site_title or "Назва",
         seo_description=settings.seo_description or "",
         seo_keywords=settings.seo_keywords or "",
@@ -68,7 +67,7 @@ async def get_design_settings_page(
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active"]}
     active_classes["design_active"] = "active"
     
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Дизайн та SEO", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -114,5 +113,6 @@ async def save_design_settings(
     settings.telegram_welcome_message = telegram_welcome_message
 
     await session.commit()
+    invalidate_reference_cache()
     
     return RedirectResponse(url="/admin/design_settings?saved=true", status_code=303)
\ No newline at end of file
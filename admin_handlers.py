@@ -11,15 +11,17 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder, KeyboardButton
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from urllib.parse import quote_plus
 import re
 import os
 
-from models import Order, Product, Category, OrderStatus, Employee, Role, Settings, OrderStatusHistory
+from models import Order, Product, Category, Employee, Role, Settings
 # Ми залишаємо імпорт _generate_waiter_order_view, оскільки він використовується для перегляду замовлень "в закладі"
 from courier_handlers import _generate_waiter_order_view
-from notification_manager import notify_all_parties_on_status_change
+from order_transitions import transition_order_status
+from order_items import build_products_string, order_items_total, make_order_item
+from reference_cache import status_by_flag, role_ids_by_flag
 
 # Налаштування логування
 logger = logging.getLogger(__name__)
@@ -31,32 +33,10 @@ class AdminEditOrderStates(StatesGroup):
 
 # OperatorAuthStates видалено, бо авторизація тепер у courier_handlers.py
 
-def parse_products_string(products_str: str) -> dict[str, int]:
-    """Розбирає рядок 'Назва x Кількість, ...' на словник."""
-    if not products_str: return {}
-    products_dict = {}
-    for part in products_str.split(', '):
-        try:
-            name, quantity_str = part.rsplit(' x ', 1)
-            products_dict[name] = int(quantity_str)
-        except ValueError:
-            logging.warning(f"Не вдалося розібрати частину рядка продукту: {part}")
-    return products_dict
-
-def build_products_string(products_dict: dict[str, int]) -> str:
-    """Збирає словник назад у рядок 'Назва x Кількість, ...'."""
-    return ", ".join([f"{name} x {quantity}" for name, quantity in products_dict.items()])
-
-async def recalculate_order_total(products_dict: dict[str, int], session: AsyncSession) -> int:
-    """Перераховує загальну суму замовлення на основі оновленого складу."""
-    total = 0
-    if not products_dict: return 0
-    products_res = await session.execute(select(Product).where(Product.name.in_(list(products_dict.keys()))))
-    db_products = {p.name: p for p in products_res.scalars().all()}
-    for name, quantity in products_dict.items():
-        if product := db_products.get(name):
-            total += product.price * quantity
-    return total
+def sync_order_after_items_change(order: Order):
+    """Оновлює рядок products та суму після зміни позицій замовлення."""
+    order.products = build_products_string(order.items)
+    order.total_price = order_items_total(order.items)
 
 async def _generate_order_admin_view(order: Order, session: AsyncSession):
     """Генерує текст та клавіатуру для відображення замовлення в адмін-боті."""
@@ -76,10 +56,7 @@ async def _generate_order_admin_view(order: Order, session: AsyncSession):
                   f"<b>Статус:</b> {status_name}")
 
     kb_admin = InlineKeyboardBuilder()
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_operator == True).order_by(OrderStatus.id)
-    )
-    statuses = statuses_res.scalars().all()
+    statuses = await status_by_flag(session, "visible_to_operator")
     status_buttons = [
         InlineKeyboardButton(text=f"{'✅ ' if s.id == order.status_id else ''}{s.name}", callback_data=f"change_order_status_{order.id}_{s.id}")
         for s in statuses
@@ -104,25 +81,24 @@ async def _display_order_view(bot: Bot, chat_id: int, message_id: int, order_id:
 
 async def _display_edit_items_menu(bot: Bot, chat_id: int, message_id: int, order_id: int, session: AsyncSession):
     """Показує меню редагування складу замовлення."""
-    order = await session.get(Order, order_id)
+    order = await session.get(Order, order_id, options=[selectinload(Order.items)])
     if not order: return
-    products_dict = parse_products_string(order.products)
     text = f"<b>Склад замовлення #{order.id}</b> (Сума: {order.total_price} грн)\n\n"
     kb = InlineKeyboardBuilder()
-    if not products_dict:
+    if not order.items:
         text += "<i>Замовлення порожнє</i>"
     else:
-        product_names = list(products_dict.keys())
-        products_res = await session.execute(select(Product).where(Product.name.in_(product_names)))
-        db_products = {p.name: p for p in products_res.scalars().all()}
-        for name, quantity in products_dict.items():
-            if product := db_products.get(name):
-                kb.row(
-                    InlineKeyboardButton(text="➖", callback_data=f"admin_change_qnt_{order.id}_{product.id}_-1"),
-                    InlineKeyboardButton(text=f"{html_module.escape(name)}: {quantity}", callback_data="noop"),
-                    InlineKeyboardButton(text="➕", callback_data=f"admin_change_qnt_{order.id}_{product.id}_1"),
-                    InlineKeyboardButton(text="❌", callback_data=f"admin_delete_item_{order.id}_{product.id}")
-                )
+        for item in order.items:
+            if item.product_id is None:
+                # Товар видалено з каталогу - позицію можна лише переглянути
+                kb.row(InlineKeyboardButton(text=f"{html_module.escape(item.name)}: {item.quantity}", callback_data="noop"))
+                continue
+            kb.row(
+                InlineKeyboardButton(text="➖", callback_data=f"admin_change_qnt_{order.id}_{item.product_id}_-1"),
+                InlineKeyboardButton(text=f"{html_module.escape(item.name)}: {item.quantity}", callback_data="noop"),
+                InlineKeyboardButton(text="➕", callback_data=f"admin_change_qnt_{order.id}_{item.product_id}_1"),
+                InlineKeyboardButton(text="❌", callback_data=f"admin_delete_item_{order.id}_{item.product_id}")
+            )
     kb.row(InlineKeyboardButton(text="➕ Додати страву", callback_data=f"admin_add_item_start_{order_id}"))
     kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"edit_order_{order_id}"))
     await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, reply_markup=kb.as_markup())
@@ -179,45 +155,18 @@ def register_admin_handlers(dp: Dispatcher):
     
     @dp.callback_query(F.data.startswith("change_order_status_"))
     async def change_order_status_admin(callback: CallbackQuery, session: AsyncSession):
-        # Отримуємо екземпляр клієнтського бота для сповіщень
-        client_bot = dp.get("client_bot")
-        
         employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == callback.from_user.id))
         actor_info = f"Оператор: {employee.full_name}" if employee else f"Оператор (ID: {callback.from_user.id})"
         
         parts = callback.data.split("_")
         order_id, new_status_id = int(parts[3]), int(parts[4])
 
-        order = await session.get(Order, order_id, options=[joinedload(Order.status)]) # Додано завантаження статусу
-        if not order: return await callback.answer("Замовлення не знайдено!", show_alert=True)
-        if order.status_id == new_status_id: return await callback.answer("Статус вже встановлено.")
+        # Сповіщення всім сторонам відправить воркер черги
+        transition = await transition_order_status(session, order_id, new_status_id, actor_info, notify=True)
+        if not transition.ok: return await callback.answer(transition.error, show_alert=transition.current_status_id != new_status_id)
 
-        old_status = order.status
-        old_status_name = old_status.name if old_status else 'Невідомий'
-
-        order.status_id = new_status_id
-        
-        history_entry = OrderStatusHistory(
-            order_id=order.id,
-            status_id=new_status_id,
-            actor_info=actor_info
-        )
-        session.add(history_entry)
-        
-        await session.commit()
-        
-        # Оновлене сповіщення з передачею client_bot
-        await notify_all_parties_on_status_change(
-            order=order,
-            old_status_name=old_status_name,
-            actor_info=actor_info,
-            admin_bot=callback.bot,
-            client_bot=client_bot,
-            session=session
-        )
-        
         await _display_order_view(callback.bot, callback.message.chat.id, callback.message.message_id, order_id, session)
-        await callback.answer(f"Статус замовлення #{order.id} змінено.")
+        await callback.answer(f"Статус замовлення #{order_id} змінено.")
 
     @dp.callback_query(F.data.startswith("edit_order_"))
     async def show_edit_order_menu(callback: CallbackQuery, session: AsyncSession):
@@ -332,20 +281,18 @@ def register_admin_handlers(dp: Dispatcher):
     async def admin_modify_item(callback: CallbackQuery, session: AsyncSession):
         parts = callback.data.split("_")
         order_id, product_id = int(parts[3]), int(parts[4])
-        order = await session.get(Order, order_id)
-        product = await session.get(Product, product_id)
-        if not order or not product: return await callback.answer("Помилка!", show_alert=True)
-
-        products_dict = parse_products_string(order.products)
-        if "change_qnt" in callback.data:
-            new_quantity = products_dict.get(product.name, 0) + int(parts[5])
-            if new_quantity > 0: products_dict[product.name] = new_quantity
-            else: del products_dict[product.name]
-        elif "delete_item" in callback.data and product.name in products_dict:
-            del products_dict[product.name]
-
-        order.products = build_products_string(products_dict)
-        order.total_price = await recalculate_order_total(products_dict, session)
+        order = await session.get(Order, order_id, options=[selectinload(Order.items)])
+        if not order: return await callback.answer("Помилка!", show_alert=True)
+
+        item = next((i for i in order.items if i.product_id == product_id), None)
+        if item:
+            if "change_qnt" in callback.data:
+                item.quantity += int(parts[5])
+                if item.quantity <= 0: order.items.remove(item)
+            elif "delete_item" in callback.data:
+                order.items.remove(item)
+
+        sync_order_after_items_change(order)
         await session.commit()
         await _display_edit_items_menu(callback.bot, callback.message.chat.id, callback.message.message_id, order_id, session)
         await callback.answer()
@@ -386,13 +333,15 @@ def register_admin_handlers(dp: Dispatcher):
     @dp.callback_query(F.data.startswith("admin_add_prod_"))
     async def admin_add_to_order(callback: CallbackQuery, session: AsyncSession):
         order_id, product_id = map(int, callback.data.split("_")[3:])
-        order = await session.get(Order, order_id)
+        order = await session.get(Order, order_id, options=[selectinload(Order.items)])
         product = await session.get(Product, product_id)
         if not order or not product: return await callback.answer("Помилка!", show_alert=True)
-        products_dict = parse_products_string(order.products)
-        products_dict[product.name] = products_dict.get(product.name, 0) + 1
-        order.products = build_products_string(products_dict)
-        order.total_price = await recalculate_order_total(products_dict, session)
+        item = next((i for i in order.items if i.product_id == product.id), None)
+        if item:
+            item.quantity += 1
+        else:
+            order.items.append(make_order_item(product, 1))
+        sync_order_after_items_change(order)
         await session.commit()
         await _display_edit_items_menu(callback.bot, callback.message.chat.id, callback.message.message_id, order_id, session)
         await callback.answer(f"✅ {product.name} додано!")
@@ -401,8 +350,7 @@ def register_admin_handlers(dp: Dispatcher):
     async def select_courier_start(callback: CallbackQuery, session: AsyncSession):
         order_id = int(callback.data.split("_")[2])
         # Збираємо ID усіх ролей, які можуть бути кур'єрами
-        courier_roles_res = await session.execute(select(Role.id).where(Role.can_be_assigned == True))
-        courier_role_ids = courier_roles_res.scalars().all()
+        courier_role_ids = await role_ids_by_flag(session, "can_be_assigned")
         
         if not courier_role_ids:
             return await callback.answer("Помилка: Роль 'Кур'єр' не знайдена в системі.", show_alert=True)
@@ -461,8 +409,7 @@ def register_admin_handlers(dp: Dispatcher):
             if new_courier.telegram_user_id:
                 try:
                     kb_courier = InlineKeyboardBuilder()
-                    statuses_res = await session.execute(select(OrderStatus).where(OrderStatus.visible_to_courier == True).order_by(OrderStatus.id))
-                    statuses = statuses_res.scalars().all()
+                    statuses = await status_by_flag(session, "visible_to_courier")
                     kb_courier.row(*[InlineKeyboardButton(text=s.name, callback_data=f"courier_set_status_{order.id}_{s.id}") for s in statuses])
                     
                     if order.is_delivery and order.address:
@@ -0,0 +1,102 @@
+# admin_kds.py
+
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import async_session_maker
+from template_engine import tpl
+from dependencies import get_db_session, check_credentials
+from reference_cache import get_cached_settings
+from production_board import AREAS
+from order_transitions import mark_order_ready
+from kds import kds_hub
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+AREA_TITLES = {"kitchen": "🔪 Кухня", "bar": "🍹 Бар"}
+# Термін дії токена, вбудованого в сторінку екрана (екран на кухні працює цілу зміну)
+KDS_TOKEN_TTL = int(os.environ.get("KDS_TOKEN_TTL", str(24 * 3600)))
+
+# Ключ підпису токенів; без ADMIN_PASS - випадковий на процес (токени живуть до рестарту)
+_TOKEN_KEY = hashlib.sha256(f"kds:{os.environ.get('ADMIN_PASS') or secrets.token_hex(16)}".encode()).digest()
+
+
+def _sign(area: str, expires: int) -> str:
+    return hmac.new(_TOKEN_KEY, f"{area}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def make_kds_token(area: str) -> str:
+    expires = int(time.time()) + KDS_TOKEN_TTL
+    return f"{expires}.{_sign(area, expires)}"
+
+
+def verify_kds_token(area: str, token: str) -> bool:
+    try:
+        expires_str, signature = token.split(".", 1)
+        expires = int(expires_str)
+    except (AttributeError, ValueError):
+        return False
+    return expires > time.time() and hmac.compare_digest(signature, _sign(area, expires))
+
+
+def _check_area(area: str):
+    if area not in AREAS:
+        raise HTTPException(status_code=404, detail="Невідомий цех")
+
+
+@router.get("/admin/kds/{area}", response_class=HTMLResponse)
+async def kds_page(area: str, session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+    """Екран кухні/бару: замовлення оновлюються push-подіями без опитування."""
+    _check_area(area)
+    settings = await get_cached_settings(session)
+    return HTMLResponse(tpl.KDS_PAGE_HTML.render(
+        title=AREA_TITLES[area],
+        site_title=settings.site_title or "Назва",
+        ws_path=f"/ws/kds/{area}?token={make_kds_token(area)}",
+    ))
+
+
+@router.websocket("/ws/kds/{area}")
+async def kds_websocket(websocket: WebSocket, area: str, token: str = ""):
+    if area not in AREAS or not verify_kds_token(area, token):
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    kds_hub.connect(area, websocket)
+    try:
+        await kds_hub.send_snapshot(area, websocket)
+        while True:
+            message = await websocket.receive_json()
+            if message.get("action") != "ready":
+                continue
+            try:
+                order_id = int(message.get("order_id"))
+            except (TypeError, ValueError):
+                await websocket.send_json({"type": "error", "detail": "Невірний номер замовлення"})
+                continue
+
+            # Те саме, що кнопка chef_ready_ у боті: статус «Готовий до видачі» + сповіщення через чергу.
+            # Оновлення екранів розійдеться з commit через kds_hub.
+            async with async_session_maker() as session:
+                order, error = await mark_order_ready(session, order_id, f"Екран {AREA_TITLES[area]}")
+            if order:
+                await websocket.send_json({"type": "ready_ok", "order_id": order_id})
+            else:
+                await websocket.send_json({"type": "error", "detail": error})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Помилка з'єднання KDS ({area}): {e}", exc_info=True)
+    finally:
+        kds_hub.disconnect(area, websocket)
@@ -0,0 +1,112 @@
+# admin_metrics.py
+
+import html
+import os
+import secrets
+
+from fastapi import APIRouter, Depends, Query, Request, HTTPException
+from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse, PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import engine
+from template_engine import tpl
+from dependencies import get_db_session, check_credentials
+from pool_metrics import pool_snapshot
+from profiling import profile_stats
+from metrics import render_metrics
+from reference_cache import get_cached_settings
+
+router = APIRouter()
+
+# Якщо задано - /metrics вимагає заголовок "Authorization: Bearer <токен>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics(request: Request, session: AsyncSession = Depends(get_db_session)):
+    """Метрики у форматі Prometheus для scrape з кластера."""
+    if METRICS_TOKEN:
+        provided = request.headers.get("authorization", "")
+        if not secrets.compare_digest(provided.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            raise HTTPException(status_code=401, detail="Невірний токен метрик")
+    return PlainTextResponse(await render_metrics(session, engine), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/admin/metrics/db_pool", response_class=JSONResponse)
+async def admin_db_pool_metrics(username: str = Depends(check_credentials)):
+    """Стан пулу з'єднань з БД: зайняті/вільні з'єднання, overflow, очікування та найповільніші checkout."""
+    return JSONResponse(content=pool_snapshot(engine))
+
+
+@router.get("/admin/metrics/profiling", response_class=JSONResponse)
+async def admin_profiling_metrics(top: int = Query(20, ge=1, le=200), username: str = Depends(check_credentials)):
+    """Профілі обробників: час, кількість і час SQL, виклики Telegram, підозри на N+1, найповільніші запити."""
+    return JSONResponse(content=profile_stats.as_dict(top))
+
+
+@router.get("/admin/profiling", response_class=HTMLResponse)
+async def admin_profiling_page(
+    top: int = Query(20, ge=1, le=200),
+    session: AsyncSession = Depends(get_db_session),
+    username: str = Depends(check_credentials)
+):
+    settings = await get_cached_settings(session)
+    data = profile_stats.as_dict(top)
+
+    handler_rows = "".join(
+        f"<tr><td>{html.escape(h['name'])}</td><td>{h['count']}</td><td>{h['avg_ms']}</td><td>{h['max_ms']}</td>"
+        f"<td>{h['avg_sql_count']} (макс. {h['max_sql_count']})</td><td>{h['avg_sql_ms']}</td>"
+        f"<td>{h['avg_telegram_count']} / {h['avg_telegram_ms']} мс</td></tr>"
+        for h in data["handlers"]
+    ) or '<tr><td colspan="7">Даних ще немає.</td></tr>'
+
+    n_plus_one_rows = "".join(
+        f"<tr><td>{html.escape(h['name'])}</td><td>{h['n_plus_one_requests']} з {h['count']}</td>"
+        f"<td>{h['worst_repeat']['count']}×</td><td><code>{html.escape(h['worst_repeat']['statement'])}</code></td></tr>"
+        for h in data["n_plus_one"]
+    ) or '<tr><td colspan="4">Повторюваних запитів не виявлено.</td></tr>'
+
+    slowest_items = "".join(
+        f"<details><summary><b>{html.escape(s['name'])}</b> - {s['ms']} мс ({s['at']}), "
+        f"SQL: {s['sql_count']} / {s['sql_ms']} мс, Telegram: {s['telegram_count']} / {s['telegram_ms']} мс</summary>"
+        f"<table><tbody>"
+        + "".join(f"<tr><td>{st['ms']}</td><td><code>{html.escape(st['sql'])}</code></td></tr>" for st in s["statements"])
+        + "</tbody></table></details>"
+        for s in data["slowest"]
+    ) or "<p>Даних ще немає.</p>"
+
+    body = f"""
+    <div class="card">
+        <p>Статистика з {data['since']}. Поріг повільного обробника: {data['slow_request_ms']:.0f} мс,
+        N+1 - однаковий SQL щонайменше {data['n_plus_one_threshold']} разів за запит.</p>
+        <a href="/admin/profiling/reset" class="button secondary">Скинути статистику</a>
+        <a href="/admin/metrics/profiling?top={top}" class="button secondary">JSON</a>
+    </div>
+    <div class="card">
+        <h2>Обробники за сумарним часом (мс)</h2>
+        <table><thead><tr><th>Обробник</th><th>Викликів</th><th>Середній</th><th>Макс.</th><th>SQL-запитів</th><th>Час SQL</th><th>Telegram</th></tr></thead>
+        <tbody>{handler_rows}</tbody></table>
+    </div>
+    <div class="card">
+        <h2>Підозри на N+1</h2>
+        <table><thead><tr><th>Обробник</th><th>Запитів з повторами</th><th>Найбільше повторів</th><th>SQL</th></tr></thead>
+        <tbody>{n_plus_one_rows}</tbody></table>
+    </div>
+    <div class="card">
+        <h2>Найповільніші запити</h2>
+        {slowest_items}
+    </div>
+    """
+    active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
+        title="Профілювання",
+        body=body,
+        site_title=settings.site_title or "Назва",
+        **active_classes
+    ))
+
+
+@router.get("/admin/profiling/reset")
+async def admin_profiling_reset(username: str = Depends(check_credentials)):
+    profile_stats.reset()
+    return RedirectResponse(url="/admin/profiling", status_code=303)
@@ -0,0 +1,182 @@
+# admin_reports.py
+
+import html
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi.responses import HTMLResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from models import Employee
+from template_engine import tpl
+from dependencies import get_db_session, check_credentials
+from reference_cache import get_cached_settings
+from report_rollups import (
+    rollup_totals, rollup_by_day,
+    DIM_TOTAL, DIM_ORDER_TYPE, DIM_COURIER, DIM_WAITER, DIM_PRODUCT, DIM_AREA,
+)
+
+router = APIRouter()
+
+ORDER_TYPE_LABELS = {"delivery": "🚚 Доставка", "pickup": "🏃 Самовивіз", "in_house": "🍽️ У закладі"}
+AREA_LABELS = {"kitchen": "🍳 Кухня", "bar": "🍹 Бар"}
+
+
+def _period(date_from_str: Optional[str], date_to_str: Optional[str]) -> Tuple[date, date]:
+    """Період звіту; за замовчуванням останні 7 днів включно з сьогодні."""
+    try:
+        date_to = datetime.strptime(date_to_str, "%Y-%m-%d").date() if date_to_str else date.today()
+        date_from = datetime.strptime(date_from_str, "%Y-%m-%d").date() if date_from_str else date_to - timedelta(days=6)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Невірний формат дати")
+    return date_from, date_to
+
+
+async def _render_report(session: AsyncSession, title: str, report_url: str, date_from: date, date_to: date,
+                         header: list, rows_html: str, colspan: int, summary: str = "") -> HTMLResponse:
+    settings = await get_cached_settings(session)
+    body = tpl.ADMIN_REPORTS_BODY.render(
+        report_url=report_url,
+        report_title=title,
+        date_from=date_from.strftime("%Y-%m-%d"),
+        date_to=date_to.strftime("%Y-%m-%d"),
+        date_from_formatted=date_from.strftime("%d.%m.%Y"),
+        date_to_formatted=date_to.strftime("%d.%m.%Y"),
+        summary=summary,
+        header_cells="".join(f"<th>{h}</th>" for h in header),
+        report_rows=rows_html or f'<tr><td colspan="{colspan}">Немає даних за вибраний період.</td></tr>',
+    )
+    active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "settings_active", "design_active"]}
+    active_classes["reports_active"] = "active"
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
+        title=title,
+        body=body,
+        site_title=settings.site_title or "Назва",
+        **active_classes
+    ))
+
+
+@router.get("/admin/reports", response_class=HTMLResponse)
+async def admin_reports_menu(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+    settings = await get_cached_settings(session)
+    body = """
+    <div class="card">
+        <h2>Доступні звіти</h2>
+        <ul>
+            <li><a href="/admin/reports/revenue">Виручка по днях і типах замовлень</a></li>
+            <li><a href="/admin/reports/products">Продажі страв і цехів</a></li>
+            <li><a href="/admin/reports/couriers">Звіт по замовленнях кур'єрів</a></li>
+            <li><a href="/admin/reports/waiters">Звіт по замовленнях офіціантів</a></li>
+        </ul>
+    </div>
+    """
+    active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "settings_active", "design_active"]}
+    active_classes["reports_active"] = "active"
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
+        title="Звіти",
+        body=body,
+        site_title=settings.site_title or "Назва",
+        **active_classes
+    ))
+
+
+async def _staff_report(session: AsyncSession, dimension: str, title: str, report_url: str, name_header: str,
+                        date_from_str: Optional[str], date_to_str: Optional[str]) -> HTMLResponse:
+    date_from, date_to = _period(date_from_str, date_to_str)
+    totals = await rollup_totals(session, dimension, date_from, date_to)
+
+    employee_ids = [int(row.key) for row in totals if row.key.isdigit()]
+    names = {}
+    if employee_ids:
+        employees_res = await session.execute(select(Employee.id, Employee.full_name).where(Employee.id.in_(employee_ids)))
+        names = {str(e.id): e.full_name for e in employees_res.all()}
+
+    rows = sorted(totals, key=lambda r: r.orders, reverse=True)
+    rows_html = "".join(
+        f'<tr><td>{html.escape(names.get(r.key, f"#{r.key}"))}</td><td>{r.orders}</td><td>{r.revenue} грн</td></tr>'
+        for r in rows
+    )
+    return await _render_report(
+        session, title, report_url, date_from, date_to,
+        [name_header, "Кількість виконаних замовлень", "Сума"], rows_html, 3,
+    )
+
+
+@router.get("/admin/reports/couriers", response_class=HTMLResponse)
+async def report_couriers(
+    date_from_str: str = Query(None, alias="date_from"),
+    date_to_str: str = Query(None, alias="date_to"),
+    session: AsyncSession = Depends(get_db_session),
+    username: str = Depends(check_credentials)
+):
+    return await _staff_report(session, DIM_COURIER, "Звіт по кур'єрах", "/admin/reports/couriers", "Ім'я кур'єра", date_from_str, date_to_str)
+
+
+@router.get("/admin/reports/waiters", response_class=HTMLResponse)
+async def report_waiters(
+    date_from_str: str = Query(None, alias="date_from"),
+    date_to_str: str = Query(None, alias="date_to"),
+    session: AsyncSession = Depends(get_db_session),
+    username: str = Depends(check_credentials)
+):
+    return await _staff_report(session, DIM_WAITER, "Звіт по офіціантах", "/admin/reports/waiters", "Ім'я офіціанта", date_from_str, date_to_str)
+
+
+@router.get("/admin/reports/revenue", response_class=HTMLResponse)
+async def report_revenue(
+    date_from_str: str = Query(None, alias="date_from"),
+    date_to_str: str = Query(None, alias="date_to"),
+    session: AsyncSession = Depends(get_db_session),
+    username: str = Depends(check_credentials)
+):
+    """Виручка по днях + розбивка за типом замовлення (лише виконані замовлення)."""
+    date_from, date_to = _period(date_from_str, date_to_str)
+    days = await rollup_by_day(session, DIM_TOTAL, date_from, date_to)
+    by_type = await rollup_totals(session, DIM_ORDER_TYPE, date_from, date_to)
+
+    total_orders = sum(d.orders for d in days)
+    total_revenue = sum(d.revenue for d in days)
+    avg_check = round(total_revenue / total_orders) if total_orders else 0
+    type_items = "".join(
+        f"<li>{ORDER_TYPE_LABELS.get(t.key, html.escape(t.key))}: {t.orders} замовл., {t.revenue} грн</li>" for t in by_type
+    )
+    summary = (
+        f"<p><b>Замовлень:</b> {total_orders} &nbsp; <b>Виручка:</b> {total_revenue} грн &nbsp; <b>Середній чек:</b> {avg_check} грн</p>"
+        f"<ul>{type_items}</ul>"
+    )
+    rows_html = "".join(
+        f'<tr><td>{d.day.strftime("%d.%m.%Y")}</td><td>{d.orders}</td><td>{d.revenue} грн</td>'
+        f'<td>{round(d.revenue / d.orders) if d.orders else 0} грн</td></tr>'
+        for d in days if d.orders
+    )
+    return await _render_report(
+        session, "Виручка", "/admin/reports/revenue", date_from, date_to,
+        ["Дата", "Замовлень", "Виручка", "Середній чек"], rows_html, 4, summary,
+    )
+
+
+@router.get("/admin/reports/products", response_class=HTMLResponse)
+async def report_products(
+    date_from_str: str = Query(None, alias="date_from"),
+    date_to_str: str = Query(None, alias="date_to"),
+    session: AsyncSession = Depends(get_db_session),
+    username: str = Depends(check_credentials)
+):
+    """Продажі страв (кількість, у скількох замовленнях, сума) + підсумки по цехах."""
+    date_from, date_to = _period(date_from_str, date_to_str)
+    products = await rollup_totals(session, DIM_PRODUCT, date_from, date_to)
+    areas = await rollup_totals(session, DIM_AREA, date_from, date_to)
+
+    area_items = "".join(
+        f"<li>{AREA_LABELS.get(a.key, html.escape(a.key))}: {a.quantity} шт., {a.revenue} грн</li>" for a in areas
+    )
+    rows_html = "".join(
+        f'<tr><td>{html.escape(p.key)}</td><td>{p.quantity}</td><td>{p.orders}</td><td>{p.revenue} грн</td></tr>'
+        for p in products
+    )
+    return await _render_report(
+        session, "Продажі страв", "/admin/reports/products", date_from, date_to,
+        ["Страва", "Продано, шт.", "У замовленнях", "Сума"], rows_html, 4, f"<ul>{area_items}</ul>" if area_items else "",
+    )
@@ -1,19 +1,20 @@
 # admin_tables.py
 
 import html
-import qrcode
-import io
 import json
+import os
 from fastapi import APIRouter, Depends, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload, selectinload
 from typing import List, Optional # <--- Додано List, Optional
 
 from models import Table, Employee, Role, Settings # <-- NEW: Import Settings
-from templates import ADMIN_HTML_TEMPLATE, ADMIN_TABLES_BODY
+from template_engine import tpl
 from dependencies import get_db_session, check_credentials
+from reference_cache import get_cached_settings, role_ids_by_flag
+from qr_cache import get_qr_png, qr_file_path, discard_table_qr
 
 router = APIRouter()
 
@@ -25,7 +26,7 @@ async def admin_tables_list(
 ):
     """Відображає сторінку управління столиками."""
     # NEW: Отримуємо налаштування
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await get_cached_settings(session)
     
     tables_res = await session.execute(
         select(Table).options(
@@ -36,8 +37,7 @@ async def admin_tables_list(
     tables = tables_res.scalars().all()
 
     # Отримуємо ID всіх ролей, які можуть обслуговувати столики
-    waiter_roles_res = await session.execute(select(Role.id).where(Role.can_serve_tables == True))
-    waiter_role_ids = waiter_roles_res.scalars().all()
+    waiter_role_ids = await role_ids_by_flag(session, "can_serve_tables")
 
     waiters_on_shift = []
     if waiter_role_ids:
@@ -75,14 +75,14 @@ async def admin_tables_list(
         </tr>
         """)
 
-    body = ADMIN_TABLES_BODY.format(rows="".join(rows) or "<tr><td colspan='5'>Столиків ще не додано.</td></tr>")
+    body = tpl.ADMIN_TABLES_BODY.render(rows="".join(rows) or "<tr><td colspan='5'>Столиків ще не додано.</td></tr>")
 
     # NEW: Додано "design_active"
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["tables_active"] = "active"
 
     # ЗМІНЕНО: Заголовок став більш загальним
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Столики", 
         body=body, 
         site_title=settings.site_title or "Назва", # <-- NEW
@@ -111,8 +111,10 @@ async def delete_table(
     """Видаляє столик."""
     table = await session.get(Table, table_id)
     if table:
+        access_token = table.access_token
         await session.delete(table)
         await session.commit()
+        discard_table_qr(access_token)
     return RedirectResponse(url="/admin/tables", status_code=303)
 
 # ПОВНІСТЮ ОНОВЛЕНИЙ ЕНДПОІНТ
@@ -140,8 +142,7 @@ async def assign_waiter_to_table(
 
     if waiter_ids:
         # Отримуємо ID ролей офіціантів
-        waiter_roles_res = await session.execute(select(Role.id).where(Role.can_serve_tables == True))
-        waiter_role_ids = waiter_roles_res.scalars().all()
+        waiter_role_ids = await role_ids_by_flag(session, "can_serve_tables")
 
         if waiter_role_ids:
             # Завантажуємо об'єкти Employee, які є офіціантами
@@ -163,16 +164,17 @@ async def assign_waiter_to_table(
 
 # --- Ендпоінт тепер приймає access_token ---
 @router.get("/qr/{access_token}")
-async def get_qr_code(request: Request, access_token: str):
-    """Генерує та повертає QR-код для столика."""
+async def get_qr_code(request: Request, access_token: str, session: AsyncSession = Depends(get_db_session)):
+    """
+    Повертає QR-код для столика (з кешу; генерується лише при першому зверненні).
+    Код залежить від адреси, з якої відкрито адмінку, тому кешується окремо для кожної.
+    """
     base_url = str(request.base_url)
-
-    # --- URL тепер використовує access_token ---
-    url = f"{base_url}menu/table/{access_token}"
-
-    img = qrcode.make(url)
-    buf = io.BytesIO()
-    img.save(buf, 'PNG')
-    buf.seek(0)
-
-    return StreamingResponse(buf, media_type="image/png")
\ No newline at end of file
+    path = qr_file_path(access_token, base_url)
+    # Перевірка столика лише на промаху кешу - щоб на диск не потрапляли коди для довільних токенів
+    if not os.path.exists(path):
+        table_id = await session.scalar(select(Table.id).where(Table.access_token == access_token))
+        if table_id is None:
+            raise HTTPException(status_code=404, detail="Столик не знайдено")
+    png = await get_qr_png(access_token, base_url)
+    return Response(content=png, media_type="image/png", headers={"Cache-Control": "public, max-age=86400"})
\ No newline at end of file
@@ -0,0 +1,98 @@
+# bench_templates.py
+"""
+Порівняння часу рендеру сторінок: str.format на кожен запит (старий спосіб)
+проти попередньо скомпільованих шаблонів template_engine.
+
+Запуск: python bench_templates.py [кількість_повторів]
+"""
+import html
+import sys
+import timeit
+
+import templates
+from template_engine import tpl
+
+ACTIVE_KEYS = [
+    "main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active",
+    "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active",
+]
+
+
+def _sample_orders(count: int):
+    return [
+        {
+            "id": i, "customer_name": f"Клієнт {i}", "phone_number": f"+38050{i:07d}", "total_price": 100 + i,
+            "status_name": "Новий", "products": "Піца Маргарита x 1, Кола x 2, Салат Цезар x 1",
+        }
+        for i in range(count)
+    ]
+
+
+def _page_values(body):
+    values = {key: "" for key in ACTIVE_KEYS}
+    values.update(title="Замовлення", body=body, site_title="Назва")
+    return values
+
+
+def _old_orders_page(orders):
+    rows = "".join([f"""
+    <tr>
+        <td><a href="/admin/order/manage/{o['id']}" title="Керувати замовленням">#{o['id']}</a></td>
+        <td>{html.escape(o['customer_name'])}</td>
+        <td>{html.escape(o['phone_number'])}</td>
+        <td>{o['total_price']} грн</td>
+        <td><span class='status'>{o['status_name']}</span></td>
+        <td>{html.escape(o['products'][:50])}</td>
+        <td class='actions'>
+            <a href='/admin/order/manage/{o['id']}' class='button-sm' title="Керувати статусом та кур'єром">⚙️ Керувати</a>
+            <a href='/admin/order/edit/{o['id']}' class='button-sm' title="Редагувати склад замовлення">✏️ Редагувати</a>
+        </td>
+    </tr>""" for o in orders])
+    body = templates.ADMIN_ORDERS_BODY.format(search_query="", rows=rows, pagination="")
+    return templates.ADMIN_HTML_TEMPLATE.format(**_page_values(body))
+
+
+def _new_orders_page(orders):
+    rows = (tpl.ADMIN_ORDER_ROW.render(
+        order_id=o["id"],
+        customer_name=html.escape(o["customer_name"]),
+        phone_number=html.escape(o["phone_number"]),
+        total_price=o["total_price"],
+        status_name=o["status_name"],
+        products=html.escape(o["products"][:50]),
+    ) for o in orders)
+    body = tpl.ADMIN_ORDERS_BODY.iter_render(search_query="", rows=rows, pagination="")
+    return "".join(tpl.ADMIN_HTML_TEMPLATE.iter_render(**_page_values(body)))
+
+
+def _storefront_values(template_name):
+    return {name: "x" for name in getattr(tpl, template_name).field_names}
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    cases = []
+
+    for count in (15, 500):
+        orders = _sample_orders(count)
+        cases.append((f"admin_orders ({count} рядків)", lambda o=orders: _old_orders_page(o), lambda o=orders: _new_orders_page(o)))
+
+    layout_values = _page_values("<p>Вміст сторінки</p>" * 50)
+    cases.append(("ADMIN_HTML_TEMPLATE", lambda: templates.ADMIN_HTML_TEMPLATE.format(**layout_values), lambda: tpl.ADMIN_HTML_TEMPLATE.render(**layout_values)))
+
+    for name in ("WEB_ORDER_HTML", "IN_HOUSE_MENU_HTML_TEMPLATE"):
+        values = _storefront_values(name)
+        source = getattr(templates, name)
+        compiled = getattr(tpl, name)
+        cases.append((name, lambda s=source, v=values: s.format(**v), lambda c=compiled, v=values: c.render(**v)))
+
+    print(f"{'Сторінка':<32}{'str.format, мкс':>18}{'compiled, мкс':>18}{'прискорення':>14}")
+    for title, old, new in cases:
+        assert old() == new(), f"Результат рендеру відрізняється: {title}"
+        old_us = timeit.timeit(old, number=number) / number * 1e6
+        new_us = timeit.timeit(new, number=number) / number * 1e6
+        print(f"{title:<32}{old_us:>18.1f}{new_us:>18.1f}{old_us / new_us:>13.1f}x")
+
+
+if __name__ == "__main__":
+    main()
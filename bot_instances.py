@@ -1,6 +1,68 @@
 # bot_instances.py
+import logging
+import os
+
 from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.enums import ParseMode
+
+from profiling import TelegramTimingMiddleware
+from metrics import TelegramMetricsMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Розмір пулу keep-alive з'єднань до api.telegram.org для кожного бота
+BOT_HTTP_POOL_SIZE = int(os.environ.get("BOT_HTTP_POOL_SIZE", "100"))
 
-# Эти переменные будут инициализированы при старте в main.py
+# Ці змінні ініціалізуються один раз при старті (lifespan у main.py)
+# і використовуються всіма роутерами та воркерами.
 bot: Bot | None = None
-admin_bot: Bot | None = None
\ No newline at end of file
+admin_bot: Bot | None = None
+
+
+def _create_bot(token: str) -> Bot:
+    # Одна aiohttp-сесія на бота: TLS-з'єднання перевикористовуються між запитами
+    session = AiohttpSession(limit=BOT_HTTP_POOL_SIZE)
+    session.middleware(TelegramTimingMiddleware())
+    session.middleware(TelegramMetricsMiddleware())
+    return Bot(
+        token=token,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+
+
+def init_bots() -> tuple[Bot | None, Bot | None]:
+    """Створює клієнтського та адмін-бота з токенів оточення (повторний виклик нічого не змінює)."""
+    global bot, admin_bot
+    client_token = os.environ.get('CLIENT_BOT_TOKEN')
+    admin_token = os.environ.get('ADMIN_BOT_TOKEN')
+
+    if bot is None and client_token:
+        bot = _create_bot(client_token)
+    if admin_bot is None and admin_token:
+        admin_bot = _create_bot(admin_token)
+    if not admin_token:
+        logger.warning("ADMIN_BOT_TOKEN не встановлено: сповіщення персоналу вимкнені.")
+    return bot, admin_bot
+
+
+def get_client_bot() -> Bot | None:
+    return bot
+
+
+def get_admin_bot() -> Bot | None:
+    return admin_bot
+
+
+async def close_bots():
+    """Закриває HTTP-сесії ботів при зупинці застосунку."""
+    global bot, admin_bot
+    for instance in (bot, admin_bot):
+        if instance is not None:
+            try:
+                await instance.session.close()
+            except Exception as e:
+                logger.error(f"Не вдалося закрити сесію бота: {e}")
+    bot, admin_bot = None, None
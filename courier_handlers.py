@@ -10,15 +10,22 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.filters import CommandStart
 from aiogram.exceptions import TelegramBadRequest
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 from typing import Dict, Any, Optional, List
 from urllib.parse import quote_plus
 import re 
 import os
 
-from models import Employee, Order, OrderStatus, Settings, OrderStatusHistory, Table, Category, Product
-from notification_manager import notify_new_order_to_staff, notify_all_parties_on_status_change
+from models import Employee, Order, Settings, Table, Category, Product
+from order_ingestion import place_order, OrderRequest, OrderValidationError
+from reference_cache import (
+    final_status_ids, status_by_flag, status_by_name,
+    STATUS_PROCESSING
+)
+from db_indexes import open_orders_filter
+from production_board import load_production_board, ProductionTicket
+from order_transitions import mark_order_ready, transition_order_status
 
 logger = logging.getLogger(__name__)
 
@@ -70,52 +77,45 @@ def get_operator_keyboard(employee: Employee): return get_staff_keyboard(employe
 def get_waiter_keyboard(employee: Employee): return get_staff_keyboard(employee)
 
 
-# --- ДОПОМІЖНА ФУНКЦІЯ: Отримання відфільтрованого тексту чека ---
-async def _get_filtered_order_text(session: AsyncSession, order: Order, area: str) -> str:
-    """
-    Повертає текст складу замовлення, залишаючи ТІЛЬКИ товари для вказаного цеху.
-    Якщо товарів для цього цеху немає, повертає порожній рядок.
-    """
-    if not order.products:
-        return ""
-
-    # 1. Розбираємо рядок продуктів
-    items_map = {}
-    for part in order.products.split(", "):
-        if " x " in part:
-            try:
-                name, qty = part.rsplit(" x ", 1)
-                items_map[name.strip()] = qty
-            except ValueError: continue
-
-    if not items_map:
-        return ""
-
-    # 2. Отримуємо інформацію про товари з БД
-    names = list(items_map.keys())
-    products_res = await session.execute(select(Product).where(Product.name.in_(names)))
-    db_products = products_res.scalars().all()
-
-    filtered_lines = []
-    for product in db_products:
-        # Перевіряємо, чи належить продукт до потрібного цеху
-        # Якщо area='kitchen', беремо все, що НЕ 'bar' (за замовчуванням kitchen)
-        # Якщо area='bar', беремо тільки 'bar'
-        is_target = False
-        if area == 'bar' and product.preparation_area == 'bar':
-            is_target = True
-        elif area == 'kitchen' and product.preparation_area != 'bar':
-            is_target = True
-            
-        if is_target:
-            qty = items_map.get(product.name)
-            if qty:
-                filtered_lines.append(f"- {html_module.escape(product.name)} x {qty}")
+# --- ЕКРАНИ ЦЕХІВ: спільний рендер для кухні та бару ---
+PRODUCTION_SCREENS = {
+    "kitchen": {"title": "🔪 <b>Замовлення на кухні:</b>", "button": "✅ Видача"},
+    "bar": {"title": "🍹 <b>Замовлення на барі:</b>", "button": "✅ Готово"},
+}
 
-    if not filtered_lines:
-        return ""
-        
-    return "\n".join(filtered_lines)
+
+def _production_screen(area: str, tickets: List[ProductionTicket]):
+    """Текст і клавіатура екрана цеху з уже завантажених квитків (без звернень до БД)."""
+    screen = PRODUCTION_SCREENS[area]
+    parts = [screen["title"] + "\n\n"]
+    kb = InlineKeyboardBuilder()
+    for ticket in tickets:
+        products_text = "\n".join(f"- {html_module.escape(name)} x {quantity}" for name, quantity in ticket.items)
+        created = ticket.created_at.strftime('%H:%M') if ticket.created_at else ''
+        parts.append(f"═════════════════\n"
+                     f"<b>№{ticket.order_id}</b> ({html_module.escape(ticket.table_info)})\n"
+                     f"Час: {created}\n"
+                     f"{products_text}\n\n")
+        kb.row(InlineKeyboardButton(text=f"{screen['button']} #{ticket.order_id}", callback_data=f"chef_ready_{ticket.order_id}"))
+
+    if not tickets:
+        parts.append("Наразі активних замовлень немає.")
+    kb.adjust(1)
+    return "".join(parts), kb.as_markup()
+
+
+async def _send_production_screen(message_or_callback: Message | CallbackQuery, session: AsyncSession, area: str):
+    # Один запит на всі активні замовлення цеху разом з позиціями (без запиту на кожне замовлення)
+    board = await load_production_board(session, areas=(area,))
+    text, markup = _production_screen(area, board[area])
+    message = message_or_callback.message if isinstance(message_or_callback, CallbackQuery) else message_or_callback
+    try:
+        if isinstance(message_or_callback, CallbackQuery):
+            await message.edit_text(text, reply_markup=markup)
+            await message_or_callback.answer()
+        else:
+            await message.answer(text, reply_markup=markup)
+    except TelegramBadRequest: pass
 
 
 # --- ЕКРАН ПОВАРА (Тільки 'kitchen') ---
@@ -130,50 +130,7 @@ async def show_chef_orders(message_or_callback: Message | CallbackQuery, session
     if not employee.is_on_shift:
          return await message.answer("🔴 Ви не на зміні.")
 
-    kitchen_statuses_res = await session.execute(select(OrderStatus.id).where(OrderStatus.visible_to_chef == True))
-    kitchen_status_ids = kitchen_statuses_res.scalars().all()
-
-    orders_res = await session.execute(
-        select(Order).options(joinedload(Order.status), joinedload(Order.table)).where(
-            Order.status_id.in_(kitchen_status_ids)
-        ).order_by(Order.id.asc())
-    )
-    all_orders = orders_res.scalars().all()
-
-    text = "🔪 <b>Замовлення на кухні:</b>\n\n"
-    count = 0
-    
-    kb = InlineKeyboardBuilder()
-    for order in all_orders:
-        # Фільтруємо текст: показуємо тільки їжу
-        products_text = await _get_filtered_order_text(session, order, 'kitchen')
-        
-        # Якщо у замовленні немає їжі (тільки бар), пропускаємо його для повара
-        if not products_text:
-            continue
-            
-        count += 1
-        table_info = order.table.name if order.table else ('Доставка' if order.is_delivery else 'Самовивіз')
-        
-        text += (f"═════════════════\n"
-                 f"<b>№{order.id}</b> ({table_info})\n"
-                 f"Час: {order.created_at.strftime('%H:%M')}\n"
-                 f"{products_text}\n\n")
-        
-        kb.row(InlineKeyboardButton(text=f"✅ Видача #{order.id}", callback_data=f"chef_ready_{order.id}"))
-    
-    if count == 0:
-        text += "Наразі активних замовлень немає."
-        
-    kb.adjust(1)
-    
-    try:
-        if isinstance(message_or_callback, CallbackQuery):
-            await message.edit_text(text, reply_markup=kb.as_markup())
-            await message_or_callback.answer()
-        else:
-            await message.answer(text, reply_markup=kb.as_markup())
-    except TelegramBadRequest: pass
+    await _send_production_screen(message_or_callback, session, "kitchen")
 
 
 # --- ЕКРАН БАРМЕНА (Тільки 'bar') ---
@@ -188,50 +145,7 @@ async def show_bartender_orders(message_or_callback: Message | CallbackQuery, se
     if not employee.is_on_shift:
          return await message.answer("🔴 Ви не на зміні.")
 
-    bar_statuses_res = await session.execute(select(OrderStatus.id).where(OrderStatus.visible_to_bartender == True))
-    bar_status_ids = bar_statuses_res.scalars().all()
-
-    orders_res = await session.execute(
-        select(Order).options(joinedload(Order.status), joinedload(Order.table)).where(
-            Order.status_id.in_(bar_status_ids)
-        ).order_by(Order.id.asc())
-    )
-    all_orders = orders_res.scalars().all()
-
-    text = "🍹 <b>Замовлення на барі:</b>\n\n"
-    count = 0
-    
-    kb = InlineKeyboardBuilder()
-    for order in all_orders:
-        # Фільтруємо текст: показуємо тільки напої
-        products_text = await _get_filtered_order_text(session, order, 'bar')
-        
-        # Якщо немає напоїв, пропускаємо
-        if not products_text:
-            continue
-            
-        count += 1
-        table_info = order.table.name if order.table else ('Доставка' if order.is_delivery else 'Самовивіз')
-        
-        text += (f"═════════════════\n"
-                 f"<b>№{order.id}</b> ({table_info})\n"
-                 f"Час: {order.created_at.strftime('%H:%M')}\n"
-                 f"{products_text}\n\n")
-        
-        kb.row(InlineKeyboardButton(text=f"✅ Готово #{order.id}", callback_data=f"chef_ready_{order.id}"))
-    
-    if count == 0:
-        text += "Наразі активних замовлень немає."
-
-    kb.adjust(1)
-    
-    try:
-        if isinstance(message_or_callback, CallbackQuery):
-            await message.edit_text(text, reply_markup=kb.as_markup())
-            await message_or_callback.answer()
-        else:
-            await message.answer(text, reply_markup=kb.as_markup())
-    except TelegramBadRequest: pass
+    await _send_production_screen(message_or_callback, session, "bar")
 
 
 async def show_courier_orders(message_or_callback: Message | CallbackQuery, session: AsyncSession, **kwargs: Dict[str, Any]):
@@ -243,15 +157,12 @@ async def show_courier_orders(message_or_callback: Message | CallbackQuery, sess
     if not employee or not employee.role.can_be_assigned:
          return await message.answer("❌ У вас немає прав кур'єра.")
 
-    final_statuses_res = await session.execute(
-        select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True))
-    )
-    final_status_ids = final_statuses_res.scalars().all()
+    final_ids = await final_status_ids(session)
 
     orders_res = await session.execute(
         select(Order).options(joinedload(Order.status)).where(
             Order.courier_id == employee.id,
-            Order.status_id.not_in(final_status_ids)
+            open_orders_filter(final_ids)
         ).order_by(Order.id.desc())
     )
     orders = orders_res.scalars().all()
@@ -357,10 +268,7 @@ async def _generate_waiter_order_view(order: Order, session: AsyncSession):
     if not order.accepted_by_waiter_id:
         kb.row(InlineKeyboardButton(text="✅ Прийняти це замовлення", callback_data=f"waiter_accept_order_{order.id}"))
 
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_waiter == True).order_by(OrderStatus.id)
-    )
-    statuses = statuses_res.scalars().all()
+    statuses = await status_by_flag(session, "visible_to_waiter")
     status_buttons = [
         InlineKeyboardButton(text=f"{'✅ ' if s.id == order.status_id else ''}{s.name}", callback_data=f"staff_set_status_{order.id}_{s.id}")
         for s in statuses
@@ -494,8 +402,8 @@ def register_courier_handlers(dp_admin: Dispatcher):
                 f"Сума: {order.total_price} грн\n\n")
         
         kb = InlineKeyboardBuilder()
-        statuses_res = await session.execute(select(OrderStatus).where(OrderStatus.visible_to_courier == True).order_by(OrderStatus.id))
-        status_buttons = [InlineKeyboardButton(text=status.name, callback_data=f"staff_set_status_{order.id}_{status.id}") for status in statuses_res.scalars().all()]
+        courier_statuses = await status_by_flag(session, "visible_to_courier")
+        status_buttons = [InlineKeyboardButton(text=status.name, callback_data=f"staff_set_status_{order.id}_{status.id}") for status in courier_statuses]
         kb.row(*status_buttons)
         
         if order.is_delivery and order.address:
@@ -514,37 +422,15 @@ def register_courier_handlers(dp_admin: Dispatcher):
     # --- ЛОГІКА ВИДАЧІ (СПІЛЬНА ДЛЯ КУХНІ ТА БАРУ) ---
     @dp_admin.callback_query(F.data.startswith("chef_ready_"))
     async def chef_ready_for_issuance(callback: CallbackQuery, session: AsyncSession):
-        client_bot = dp_admin.get("client_bot")
         employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == callback.from_user.id).options(joinedload(Employee.role)))
         order_id = int(callback.data.split("_")[-1])
-        
-        order = await session.get(Order, order_id, options=[joinedload(Order.status), joinedload(Order.table), joinedload(Order.accepted_by_waiter)])
-        if not order: return await callback.answer("Замовлення не знайдено.")
-
-        ready_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "Готовий до видачі").limit(1))
-        if not ready_status: return await callback.answer("Статус 'Готовий до видачі' не налаштовано.", show_alert=True)
-        
-        old_status_name = order.status.name
         actor_info = f"{employee.role.name if employee else 'Кухня/Бар'}: {employee.full_name if employee else 'Невідомий'}"
-        
-        # Логіка: якщо замовлення ВЖЕ готове (наприклад, кухня віддала, а тепер бар), ми просто сповіщаємо офіціанта
-        # що є "Додаткова видача", не змінюючи статус (бо він вже "Готовий")
-        
-        if order.status_id != ready_status.id:
-            # Змінюємо статус на Готовий, якщо він ще не такий
-            order.status_id = ready_status.id
-            session.add(OrderStatusHistory(order_id=order.id, status_id=ready_status.id, actor_info=actor_info))
-            await session.commit()
-        
-        # У будь-якому випадку викликаємо сповіщення, щоб офіціант знав, що ЦЯ частина готова
-        await notify_all_parties_on_status_change(
-            order=order, 
-            old_status_name=old_status_name, # Може співпадати з новим, це ок
-            actor_info=actor_info,
-            admin_bot=callback.bot,
-            client_bot=client_bot,
-            session=session
-        )
+
+        # Якщо замовлення ВЖЕ готове (наприклад, кухня віддала, а тепер бар), статус не змінюється,
+        # але офіціант все одно отримує сповіщення, що ЦЯ частина готова
+        order, error = await mark_order_ready(session, order_id, actor_info)
+        if not order:
+            return await callback.answer(error, show_alert=True)
 
         products_formatted = html_module.escape(order.products or '').replace(", ", "\n")
         # Оновлюємо повідомлення для повара/бармена, що він виконав роботу
@@ -557,32 +443,16 @@ def register_courier_handlers(dp_admin: Dispatcher):
 
     @dp_admin.callback_query(F.data.startswith("staff_set_status_"))
     async def staff_set_status(callback: CallbackQuery, session: AsyncSession, **kwargs: Dict[str, Any]):
-        client_bot = dp_admin.get("client_bot") # Додано client_bot
         employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == callback.from_user.id).options(joinedload(Employee.role)))
         actor_info = f"{employee.role.name}: {employee.full_name}" if employee else f"Співробітник (ID: {callback.from_user.id})"
         
         order_id, new_status_id = map(int, callback.data.split("_")[3:])
-        order = await session.get(Order, order_id, options=[joinedload(Order.table)])
-        if not order: return await callback.answer("Замовлення не знайдено.")
-        
-        new_status = await session.get(OrderStatus, new_status_id)
-        old_status_name = order.status.name if order.status else "Невідомий"
-        
-        order.status_id = new_status.id
-        session.add(OrderStatusHistory(order_id=order.id, status_id=new_status.id, actor_info=actor_info))
-        await session.commit()
-        
-        # Викликаємо сповіщення
-        await notify_all_parties_on_status_change(
-            order=order,
-            old_status_name=old_status_name,
-            actor_info=actor_info,
-            admin_bot=callback.bot,
-            client_bot=client_bot,
-            session=session
-        )
+        # Сповіщення ставиться в чергу разом зі зміною статусу
+        transition = await transition_order_status(session, order_id, new_status_id, actor_info, notify=True)
+        if not transition.ok: return await callback.answer(transition.error, show_alert=transition.current_status_id != new_status_id)
+        order = transition.order
 
-        await callback.answer(f"Статус змінено: {new_status.name}")
+        await callback.answer(f"Статус змінено: {transition.new_status_name}")
         
         if order.order_type == "in_house":
             await manage_in_house_order_handler(callback, session, order_id=order.id)
@@ -601,10 +471,9 @@ def register_courier_handlers(dp_admin: Dispatcher):
         table = await session.get(Table, table_id)
         if not table: return await callback.answer("Столик не знайдено!", show_alert=True)
 
-        final_statuses_res = await session.execute(select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)))
-        final_statuses = final_statuses_res.scalars().all()
+        final_statuses = await final_status_ids(session)
         
-        active_orders_res = await session.execute(select(Order).where(Order.table_id == table_id, Order.status_id.not_in(final_statuses)).options(joinedload(Order.status)))
+        active_orders_res = await session.execute(select(Order).where(Order.table_id == table_id, open_orders_filter(final_statuses)).options(joinedload(Order.status)))
         active_orders = active_orders_res.scalars().all()
 
         text = f"<b>Столик: {html_module.escape(table.name)}</b>\n\nАктивні замовлення:\n"
@@ -649,18 +518,21 @@ def register_courier_handlers(dp_admin: Dispatcher):
         order_id = int(callback.data.split("_")[-1])
         employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == callback.from_user.id))
         
-        order = await session.get(Order, order_id, options=[joinedload(Order.status)])
-        if order.accepted_by_waiter_id:
-            return await callback.answer("Вже прийнято іншим.", show_alert=True)
+        if not employee: return await callback.answer("Співробітника не знайдено.", show_alert=True)
 
-        order.accepted_by_waiter_id = employee.id
-        # Спробуємо перевести в статус "В обробці"
-        processing_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "В обробці").limit(1))
-        if processing_status:
-            order.status_id = processing_status.id
-            session.add(OrderStatusHistory(order_id=order.id, status_id=processing_status.id, actor_info=f"Офіціант: {employee.full_name}"))
+        # Спробуємо перевести в статус "В обробці"; умова на accepted_by_waiter_id
+        # не дає двом офіціантам прийняти одне замовлення одночасно
+        processing_status = await status_by_name(session, STATUS_PROCESSING)
+        transition = await transition_order_status(
+            session, order_id, processing_status.id if processing_status else None, f"Офіціант: {employee.full_name}",
+            values={"accepted_by_waiter_id": employee.id},
+            conditions=[Order.accepted_by_waiter_id.is_(None)],
+            conflict_error="Вже прийнято іншим.",
+        )
+        if not transition.ok:
+            return await callback.answer(transition.error, show_alert=True)
+        order = transition.order
 
-        await session.commit()
         await callback.answer(f"Замовлення #{order.id} прийнято!")
         await manage_in_house_order_handler(callback, session, order_id=order.id)
 
@@ -786,33 +658,21 @@ def register_courier_handlers(dp_admin: Dispatcher):
         table_name = data.get("table_name")
         
         employee = await session.scalar(select(Employee).where(Employee.telegram_user_id == callback.from_user.id))
-        
-        total_price = sum(item['price'] * item['quantity'] for item in cart.values())
-        products_str = ", ".join([f"{item['name']} x {item['quantity']}" for item in cart.values()])
-
-        new_status = await session.scalar(select(OrderStatus).where(OrderStatus.name == "Новий").limit(1))
-        status_id = new_status.id if new_status else 1
-
-        order = Order(
-            customer_name=f"Стіл: {table_name}", phone_number=f"table_{table_id}",
-            products=products_str, total_price=total_price, is_delivery=False,
-            delivery_time="In House", order_type="in_house", table_id=table_id,
-            status_id=status_id, accepted_by_waiter_id=employee.id
-        )
-        session.add(order)
-        await session.commit()
-        
-        # --- ВАЖЛИВО: Перезавантажуємо статус для перевірки requires_kitchen_notify ---
-        await session.refresh(order, ['status'])
-        
-        session.add(OrderStatusHistory(order_id=order.id, status_id=order.status_id, actor_info=f"Офіціант: {employee.full_name}"))
-        await session.commit()
-        
-        await callback.answer(f"Замовлення #{order.id} створено!")
-        
-        admin_bot = dp_admin.get("bot_instance")
-        if admin_bot:
-            await notify_new_order_to_staff(admin_bot, order, session)
+        if not employee:
+            return await callback.answer("Співробітника не знайдено.", show_alert=True)
+
+        try:
+            placed = await place_order(session, OrderRequest(
+                lines=[{"product_id": prod_id, "quantity": item["quantity"]} for prod_id, item in cart.items()],
+                actor_info=f"Офіціант: {employee.full_name}",
+                customer_name=f"Стіл: {table_name}", phone_number=f"table_{table_id}",
+                is_delivery=False, delivery_time="In House", order_type="in_house",
+                table_id=table_id, accepted_by_waiter_id=employee.id,
+            ))
+        except OrderValidationError as e:
+            return await callback.answer(str(e), show_alert=True)
+
+        await callback.answer(f"Замовлення #{placed.order_id} створено!")
 
         # ЛОГІЧНИЙ ПЕРЕХІД: Повертаємось до списку замовлень
         await state.clear()
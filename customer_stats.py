@@ -0,0 +1,228 @@
+# customer_stats.py
+import logging
+from typing import Iterable, Optional
+
+import sqlalchemy as sa
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from models import Order, CustomerStats
+
+logger = logging.getLogger(__name__)
+
+_INFO_KEY = "customer_stats_phones"
+_NEW_ORDERS_KEY = "customer_stats_new_orders"
+# Поля замовлення, від яких залежить агрегат; зміна інших (статус, кур'єр) його не чіпає
+_AGGREGATE_FIELDS = ("phone_number", "total_price", "customer_name", "address", "created_at")
+# Скільки номерів перераховувати одним запитом (обмеження кількості параметрів IN)
+RECOMPUTE_CHUNK = 500
+
+
+def _aggregate_select(phones: Optional[Iterable[str]] = None, order_ids: Optional[Iterable[int]] = None):
+    """
+    SELECT рядків customer_stats з orders (для всіх номерів або лише для заданих).
+    order_ids обмежує вибірку цими замовленнями - тоді це приріст, а не повний агрегат.
+    """
+    base_filter = Order.phone_number.isnot(None)
+    if phones is not None:
+        base_filter = Order.phone_number.in_(list(phones))
+    if order_ids is not None:
+        base_filter = sa.and_(base_filter, Order.id.in_(list(order_ids)))
+
+    totals = (
+        select(
+            Order.phone_number.label("phone_number"),
+            func.count(Order.id).label("order_count"),
+            func.coalesce(func.sum(Order.total_price), 0).label("total_spent"),
+            func.min(Order.created_at).label("first_order_at"),
+            func.max(Order.created_at).label("last_order_at"),
+        )
+        .where(base_filter)
+        .group_by(Order.phone_number)
+        .subquery()
+    )
+    latest = (
+        select(
+            Order.phone_number.label("phone_number"),
+            Order.customer_name.label("customer_name"),
+            Order.address.label("address"),
+            Order.id.label("order_id"),
+            func.row_number().over(partition_by=Order.phone_number, order_by=Order.id.desc()).label("rn"),
+        )
+        .where(base_filter)
+        .subquery()
+    )
+    return (
+        select(
+            totals.c.phone_number, latest.c.customer_name, latest.c.address,
+            totals.c.order_count, totals.c.total_spent,
+            totals.c.first_order_at, totals.c.last_order_at, latest.c.order_id,
+        )
+        .join(latest, latest.c.phone_number == totals.c.phone_number)
+        .where(latest.c.rn == 1)
+    )
+
+
+_COLUMNS = [
+    "phone_number", "customer_name", "address", "order_count", "total_spent",
+    "first_order_at", "last_order_at", "last_order_id",
+]
+
+
+def _dialect_insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def _upsert(dialect_name: str, phones):
+    table = CustomerStats.__table__
+    insert = _dialect_insert(dialect_name)
+    if insert is None:
+        return None
+    stmt = insert(table).from_select(_COLUMNS, _aggregate_select(phones))
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.phone_number],
+        set_={name: stmt.excluded[name] for name in _COLUMNS if name != "phone_number"},
+    )
+
+
+def _delta_upsert(dialect_name: str, order_ids):
+    """Додає нові замовлення до агрегатів: лічильники збільшуються, «останнє» - за id замовлення."""
+    table = CustomerStats.__table__
+    insert = _dialect_insert(dialect_name)
+    if insert is None:
+        return None
+    stmt = insert(table).from_select(_COLUMNS, _aggregate_select(order_ids=order_ids))
+    new = stmt.excluded
+    is_newer = new.last_order_id > func.coalesce(table.c.last_order_id, 0)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.phone_number],
+        set_={
+            "order_count": table.c.order_count + new.order_count,
+            "total_spent": table.c.total_spent + new.total_spent,
+            "first_order_at": sa.case((table.c.first_order_at <= new.first_order_at, table.c.first_order_at), else_=new.first_order_at),
+            "last_order_at": sa.case((table.c.last_order_at >= new.last_order_at, table.c.last_order_at), else_=new.last_order_at),
+            "customer_name": sa.case((is_newer, new.customer_name), else_=table.c.customer_name),
+            "address": sa.case((is_newer, new.address), else_=table.c.address),
+            "last_order_id": sa.case((is_newer, new.last_order_id), else_=table.c.last_order_id),
+        },
+    )
+
+
+def _apply_new_orders(connection, order_ids: set):
+    """
+    Нові замовлення додаються до агрегатів одним upsert з приростом - без перерахунку
+    всієї історії номера (QR-замовлення мають спільний псевдономер столика).
+    """
+    order_ids = sorted(order_ids)
+    for start in range(0, len(order_ids), RECOMPUTE_CHUNK):
+        chunk = order_ids[start:start + RECOMPUTE_CHUNK]
+        if connection.dialect.name == "postgresql":
+            # Спільний замок: прирости не чекають один одного, але повний перерахунок
+            # того ж номера (ексклюзивний замок) не затре незафіксований приріст
+            connection.execute(
+                sa.text(
+                    "SELECT pg_advisory_xact_lock_shared(hashtext(p)) FROM ("
+                    "SELECT DISTINCT phone_number AS p FROM orders "
+                    "WHERE id = ANY(CAST(:ids AS integer[])) AND phone_number IS NOT NULL"
+                    ") AS phones ORDER BY p"
+                ),
+                {"ids": chunk},
+            )
+        upsert = _delta_upsert(connection.dialect.name, chunk)
+        if upsert is None:
+            phones = connection.execute(
+                select(Order.phone_number).where(Order.id.in_(chunk), Order.phone_number.isnot(None)).distinct()
+            ).scalars().all()
+            _recompute(connection, set(phones))
+            continue
+        connection.execute(upsert)
+
+
+def _recompute(connection, phones: set):
+    """Перераховує агрегати для номерів у поточній транзакції."""
+    phones = sorted(phones)
+    table = CustomerStats.__table__
+    dialect_name = connection.dialect.name
+    for start in range(0, len(phones), RECOMPUTE_CHUNK):
+        chunk = phones[start:start + RECOMPUTE_CHUNK]
+        if dialect_name == "postgresql":
+            # Паралельні транзакції по тому ж номеру перераховують агрегат по черзі,
+            # кожна бачить вже зафіксовані замовлення попередньої (READ COMMITTED)
+            connection.execute(
+                sa.text("SELECT pg_advisory_xact_lock(hashtext(p)) FROM unnest(CAST(:phones AS text[])) AS p ORDER BY p"),
+                {"phones": chunk},
+            )
+        upsert = _upsert(dialect_name, chunk)
+        if upsert is None:
+            connection.execute(sa.delete(table).where(table.c.phone_number.in_(chunk)))
+            connection.execute(sa.insert(table).from_select(_COLUMNS, _aggregate_select(chunk)))
+            continue
+        connection.execute(upsert)
+        # Номери, за якими більше немає замовлень
+        connection.execute(
+            sa.delete(table).where(
+                table.c.phone_number.in_(chunk),
+                ~table.c.phone_number.in_(select(Order.phone_number).where(Order.phone_number.in_(chunk))),
+            )
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_phones(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, Order) and obj.phone_number:
+            session.info.setdefault(_NEW_ORDERS_KEY, set()).add(obj.id)
+
+    for obj in (*session.dirty, *session.deleted):
+        if not isinstance(obj, Order):
+            continue
+        attrs = sa.inspect(obj).attrs
+        if obj not in session.deleted and not any(attrs[name].history.has_changes() for name in _AGGREGATE_FIELDS):
+            continue
+        # Редагування і видалення - повний перерахунок номера
+        phones = session.info.setdefault(_INFO_KEY, set())
+        if obj.phone_number:
+            phones.add(obj.phone_number)
+        # Номер змінено - старий агрегат теж перераховується
+        for old_phone in attrs.phone_number.history.deleted or ():
+            if old_phone:
+                phones.add(old_phone)
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_changed_phones(session):
+    # before_commit спрацьовує до фінального flush - скидаємо зміни, щоб побачити всі замовлення
+    session.flush()
+    new_order_ids = session.info.pop(_NEW_ORDERS_KEY, None)
+    phones = session.info.pop(_INFO_KEY, None)
+    if new_order_ids:
+        _apply_new_orders(session.connection(), new_order_ids)
+    if phones:
+        # Після приросту: повний перерахунок перекриває його для відредагованих номерів
+        _recompute(session.connection(), phones)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_phones(session):
+    session.info.pop(_INFO_KEY, None)
+    session.info.pop(_NEW_ORDERS_KEY, None)
+
+
+async def rebuild_customer_stats(session_maker, only_if_empty: bool = False):
+    """Повне перебудування агрегатів (міграція або після масових змін в orders)."""
+    async with session_maker() as session:
+        if only_if_empty:
+            has_stats = await session.scalar(select(CustomerStats.phone_number).limit(1))
+            has_orders = await session.scalar(select(Order.id).where(Order.phone_number.isnot(None)).limit(1))
+            if has_stats is not None or has_orders is None:
+                return
+        await session.execute(sa.delete(CustomerStats.__table__))
+        await session.execute(sa.insert(CustomerStats.__table__).from_select(_COLUMNS, _aggregate_select()))
+        await session.commit()
+        logger.info("Агрегати клієнтів (customer_stats) перебудовано.")
@@ -0,0 +1,175 @@
+# db_indexes.py
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from models import Order, OrderStatus
+
+logger = logging.getLogger(__name__)
+
+# Префікс часткових індексів «відкритих» (не фінальних) замовлень.
+# Набір фінальних статусів редагується в адмінці, тому предикат індексу
+# будується з поточних статусів, а хеш набору входить в ім'я індексу.
+OPEN_INDEX_PREFIX = "ix_orders_open_"
+
+# (суфікс, колонки) - шляхи доступу до активних замовлень
+_OPEN_INDEXES = [
+    ("table", "table_id"),       # історія столика, рахунок, show_waiter_table_orders
+    ("courier", "courier_id"),   # show_courier_orders, перевірка перед видаленням кур'єра
+]
+
+# Частковий індекс замовлень на екранах цехів (production_board.py): предикат -
+# статуси, видимі кухні або бару, так само з хешем набору в імені
+BOARD_INDEX_PREFIX = "ix_orders_board_"
+BOARD_STATUS_FLAGS = ("visible_to_chef", "visible_to_bartender")
+
+
+def open_orders_filter(final_ids: Iterable[int]):
+    """
+    Умова «замовлення не у фінальному статусі». Id підставляються літералами
+    у відсортованому порядку - так предикат запиту збігається з предикатом
+    часткових індексів (планувальник не може довести це для bind-параметрів).
+    """
+    return Order.status_id.not_in(
+        sa.bindparam("open_final_ids", sorted(final_ids), expanding=True, literal_execute=True)
+    )
+
+
+def board_orders_filter(board_ids: Iterable[int]):
+    """
+    Умова «замовлення на екранах цехів» (статуси з BOARD_STATUS_FLAGS), літералами
+    у відсортованому порядку - як предикат індексу ix_orders_board_*.
+    """
+    return Order.status_id.in_(
+        sa.bindparam("board_status_ids", sorted(board_ids), expanding=True, literal_execute=True)
+    )
+
+
+def _open_predicate(final_ids: List[int]) -> str:
+    if not final_ids:
+        return ""
+    return f" WHERE status_id NOT IN ({', '.join(str(i) for i in sorted(final_ids))})"
+
+
+def _ids_suffix(ids: List[int]) -> str:
+    return hashlib.sha1(",".join(str(i) for i in sorted(ids)).encode()).hexdigest()[:8]
+
+
+def _existing_indexes(connection) -> List[str]:
+    return [ix["name"] for ix in sa.inspect(connection).get_indexes(Order.__tablename__) if ix["name"]]
+
+
+def _invalid_indexes(connection) -> List[str]:
+    """Індекси PostgreSQL, що лишились невалідними після перерваної CONCURRENTLY-побудови."""
+    res = connection.execute(sa.text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE NOT i.indisvalid AND i.indrelid = CAST(:table AS regclass)"
+    ), {"table": Order.__tablename__})
+    return [row[0] for row in res]
+
+
+def _execute_ddl(connection, sql: str, concurrently: bool):
+    if not concurrently:
+        connection.execute(sa.text(sql))
+        return
+    try:
+        connection.execute(sa.text(sql))
+    except sa.exc.DBAPIError as e:
+        # Паралельний воркер будує той самий індекс - наступна синхронізація доробить
+        logger.warning(f"Не вдалося виконати «{sql}»: {e}")
+
+
+def _status_ids(connection, condition) -> List[int]:
+    return [row[0] for row in connection.execute(sa.select(OrderStatus.id).where(condition))]
+
+
+def _wanted_indexes(connection) -> Dict[str, str]:
+    """{ім'я: DDL} часткових індексів для поточних статусів."""
+    final_ids = _status_ids(
+        connection, sa.or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True)
+    )
+    suffix = _ids_suffix(final_ids)
+    wanted = {
+        f"{OPEN_INDEX_PREFIX}{name}_{suffix}":
+            f"ON {Order.__tablename__} ({column}, id){_open_predicate(final_ids)}"
+        for name, column in _OPEN_INDEXES
+    }
+    board_ids = _status_ids(connection, sa.or_(*(getattr(OrderStatus, flag) == True for flag in BOARD_STATUS_FLAGS)))
+    if board_ids:
+        board_list = ", ".join(str(i) for i in sorted(board_ids))
+        wanted[f"{BOARD_INDEX_PREFIX}{_ids_suffix(board_ids)}"] = (
+            f"ON {Order.__tablename__} (id) WHERE status_id IN ({board_list})"
+        )
+    return wanted
+
+
+def _sync_indexes(connection):
+    """
+    На PostgreSQL (з'єднання в autocommit) індекси будуються і видаляються CONCURRENTLY -
+    без SHARE-замка, що блокував би вставку замовлень і зміну статусів на весь час побудови.
+    Новий індекс створюється раніше, ніж видаляється застарілий.
+    """
+    concurrently = connection.dialect.name == "postgresql"
+    keyword = " CONCURRENTLY" if concurrently else ""
+    if concurrently:
+        for name in _invalid_indexes(connection):
+            _execute_ddl(connection, f"DROP INDEX CONCURRENTLY IF EXISTS {name}", concurrently)
+    existing = set(_existing_indexes(connection))
+
+    # Звичайні індекси з models.py: create_all не додає їх до вже існуючої таблиці
+    for index in Order.__table__.indexes:
+        if index.name in existing:
+            continue
+        ddl = str(sa.schema.CreateIndex(index, if_not_exists=True).compile(dialect=connection.dialect))
+        _execute_ddl(connection, ddl.replace(" INDEX ", f" INDEX{keyword} ", 1), concurrently)
+
+    wanted = _wanted_indexes(connection)
+    for name, definition in wanted.items():
+        if name not in existing:
+            _execute_ddl(connection, f"CREATE INDEX{keyword} IF NOT EXISTS {name} {definition}", concurrently)
+    managed = {name for name in existing if name.startswith((OPEN_INDEX_PREFIX, BOARD_INDEX_PREFIX))}
+    for stale in managed - set(wanted):
+        _execute_ddl(connection, f"DROP INDEX{keyword} IF EXISTS {stale}", concurrently)
+        logger.info(f"Видалено застарілий частковий індекс {stale}")
+
+
+async def ensure_order_indexes(engine: AsyncEngine):
+    """Створює індекси гарячих фільтрів orders; викликається при старті та після зміни статусів."""
+    if engine.dialect.name == "postgresql":
+        # CONCURRENTLY не працює всередині транзакції
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.run_sync(_sync_indexes)
+        return
+    async with engine.begin() as conn:
+        await conn.run_sync(_sync_indexes)
+
+
+_sync_task: Optional[asyncio.Task] = None
+_sync_pending = False
+
+
+async def _run_scheduled_syncs(engine: AsyncEngine):
+    global _sync_pending
+    while _sync_pending:
+        _sync_pending = False
+        try:
+            await ensure_order_indexes(engine)
+        except Exception as e:
+            logger.error(f"Помилка синхронізації індексів замовлень: {e}", exc_info=True)
+
+
+def schedule_order_index_sync(engine: AsyncEngine):
+    """
+    Синхронізація індексів у фоні після зміни статусів в адмінці: побудова на великій
+    таблиці не тримає HTTP-запит. Повторні виклики під час синхронізації зливаються в одну наступну.
+    """
+    global _sync_task, _sync_pending
+    _sync_pending = True
+    if _sync_task is None or _sync_task.done():
+        _sync_task = asyncio.create_task(_run_scheduled_syncs(engine))
+    return _sync_task
@@ -0,0 +1,101 @@
+# http_cache.py
+import hashlib
+import os
+import secrets
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import MenuItem, Order, OrderItem, OrderStatusHistory, Table
+from menu_cache import get_menu_version
+from reference_cache import get_reference_version
+
+# max-age для публічних сторінок (0 - браузер/CDN щоразу перевіряє ETag)
+PUBLIC_MAX_AGE = int(os.environ.get("HTTP_CACHE_MAX_AGE", "0"))
+
+# Версії лічильників живуть у пам'яті процесу, тому ETag містить мітку процесу:
+# ETag з іншого процесу/після перезапуску ніколи не дасть хибного 304.
+_process_nonce = secrets.token_hex(4)
+
+# Сторінки меню сайту (MenuItem)
+_pages_version = 0
+# Замовлення та столики (історія на сторінці QR-меню)
+_orders_version = 0
+
+_PAGES_CLASSES = (MenuItem,)
+_ORDERS_CLASSES = (Order, OrderItem, OrderStatusHistory, Table)
+
+
+def get_pages_version() -> int:
+    return _pages_version
+
+
+def get_orders_version() -> int:
+    return _orders_version
+
+
+def bump_orders_version() -> int:
+    """Для змін замовлень через bulk UPDATE/DELETE, які не проходять через flush ORM."""
+    global _orders_version
+    _orders_version += 1
+    return _orders_version
+
+
+@event.listens_for(Session, "after_flush")
+def _track_public_changes(session, flush_context):
+    changed = session.info.setdefault("http_cache_changes", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, _PAGES_CLASSES):
+            changed.add("pages")
+        elif isinstance(obj, _ORDERS_CLASSES):
+            changed.add("orders")
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    global _pages_version, _orders_version
+    changed = session.info.pop("http_cache_changes", None)
+    if not changed:
+        return
+    if "pages" in changed:
+        _pages_version += 1
+    if "orders" in changed:
+        _orders_version += 1
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("http_cache_changes", None)
+
+
+def make_etag(*parts) -> str:
+    """Сильний ETag з версій даних, від яких залежить відповідь."""
+    raw = ":".join(str(p) for p in (_process_nonce, *parts))
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def public_cache_control() -> str:
+    return f"public, max-age={PUBLIC_MAX_AGE}" if PUBLIC_MAX_AGE > 0 else "public, no-cache"
+
+
+def cache_headers(etag: str, cache_control: Optional[str] = None) -> dict:
+    return {"ETag": etag, "Cache-Control": cache_control or public_cache_control()}
+
+
+def not_modified(request: Request, etag: str, cache_control: Optional[str] = None) -> Optional[Response]:
+    """Повертає 304, якщо клієнт уже має актуальну версію (If-None-Match), інакше None."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    if etag in candidates or f"W/{etag}" in candidates or "*" in candidates:
+        return Response(status_code=304, headers=cache_headers(etag, cache_control))
+    return None
+
+
+def storefront_etag(*parts) -> str:
+    """ETag для сторінок, що залежать від меню та налаштувань."""
+    return make_etag(get_menu_version(), get_reference_version(), *parts)
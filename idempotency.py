@@ -0,0 +1,153 @@
+# idempotency.py
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from models import IdempotencyKey
+from order_ingestion import OrderRequest, place_order
+from metrics import order_replays
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# Скільки зберігати ключ: повтори з нестабільного мобільного зв'язку приходять за секунди-хвилини
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# Розмір LRU у пам'яті: повтор у тому ж процесі відповідається без звернення до БД
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_PURGE_INTERVAL = int(os.environ.get("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+
+_KEY_RE = re.compile(r"^[A-Za-z0-9_.:-]{8,64}$")
+
+
+class _RecentKeys:
+    """LRU ключ -> (id замовлення, час створення)."""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[int]:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        order_id, created = entry
+        if time.time() - created > IDEMPOTENCY_TTL_SECONDS:
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return order_id
+
+    def put(self, key: str, order_id: int, created: float = None):
+        self._items[key] = (order_id, created if created is not None else time.time())
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+_recent = _RecentKeys(IDEMPOTENCY_CACHE_SIZE)
+
+
+def get_idempotency_key(request: Request, scope: str) -> Optional[str]:
+    """Ключ із заголовка Idempotency-Key з префіксом ендпоінту; None - клієнт ключ не передав."""
+    raw = request.headers.get(IDEMPOTENCY_HEADER)
+    if raw is None:
+        return None
+    if not _KEY_RE.match(raw):
+        raise HTTPException(status_code=400, detail="Невірний ключ ідемпотентності")
+    return f"{scope}:{raw}"
+
+
+async def _stored_order_id(session: AsyncSession, key: str) -> Optional[int]:
+    """Пошук за первинним ключем; прострочений рядок видаляється, щоб ключ можна було використати знову."""
+    row = (await session.execute(
+        select(IdempotencyKey.order_id, IdempotencyKey.created_at).where(IdempotencyKey.key == key)
+    )).first()
+    if row is None:
+        return None
+    if row.created_at < datetime.now() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS) or row.order_id is None:
+        await session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+        return None
+    _recent.put(key, row.order_id, row.created_at.timestamp())
+    return row.order_id
+
+
+async def replayed_order_id(session: AsyncSession, key: Optional[str], endpoint: str) -> Optional[int]:
+    """
+    Id замовлення, вже створеного з цим ключем (з LRU або одним пошуком за первинним ключем).
+    Обробники викликають це до лімітів запитів: повтор не витрачає токен і не отримує 429.
+    """
+    if not key:
+        return None
+    order_id = _recent.get(key)
+    if order_id is not None:
+        order_replays.inc(endpoint=endpoint, source="memory")
+        return order_id
+    order_id = await _stored_order_id(session, key)
+    if order_id is not None:
+        order_replays.inc(endpoint=endpoint, source="db")
+    return order_id
+
+
+async def place_order_once(session: AsyncSession, key: Optional[str], order_request: OrderRequest,
+                           endpoint: str, replay_checked: bool = False) -> Tuple[int, bool]:
+    """
+    Оформлює замовлення не більше одного разу на ключ. Повертає (id замовлення, чи це повтор).
+    Повтор відповідається з LRU або одним пошуком за первинним ключем - таблиці замовлень
+    не зачіпаються. Два одночасні запити з одним ключем розводить первинний ключ:
+    commit другого відкочується разом з його замовленням.
+    replay_checked: обробник уже викликав replayed_order_id і повтору не знайшов.
+    """
+    if not key:
+        placed = await place_order(session, order_request)
+        return placed.order_id, False
+
+    if not replay_checked:
+        order_id = await replayed_order_id(session, key, endpoint)
+        if order_id is not None:
+            return order_id, True
+
+    order_request.idempotency_key = key
+    try:
+        placed = await place_order(session, order_request)
+    except IntegrityError:
+        await session.rollback()
+        order_id = await _stored_order_id(session, key)
+        if order_id is None:
+            raise
+        order_replays.inc(endpoint=endpoint, source="concurrent")
+        logger.info(f"Паралельний повтор оформлення ({endpoint}) з ключем {key}: замовлення #{order_id}")
+        return order_id, True
+
+    _recent.put(key, placed.order_id)
+    return placed.order_id, False
+
+
+async def purge_expired_keys(session_maker) -> int:
+    cutoff = datetime.now() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+    async with session_maker() as session:
+        result = await session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+        await session.commit()
+    return result.rowcount or 0
+
+
+async def run_idempotency_purger(session_maker):
+    """Фонове видалення прострочених ключів. Запускається з lifespan у main.py."""
+    while True:
+        try:
+            purged = await purge_expired_keys(session_maker)
+            if purged:
+                logger.info(f"Видалено прострочених ключів ідемпотентності: {purged}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Помилка очищення ключів ідемпотентності: {e}", exc_info=True)
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
@@ -4,38 +4,40 @@ import html as html_module
 import json
 import logging
 import os
+from typing import List, Tuple
 from fastapi import APIRouter, Depends, HTTPException, Request, Body
 from fastapi.responses import HTMLResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_
+from sqlalchemy import select, func
 from sqlalchemy.orm import joinedload, selectinload
-from aiogram import Bot, html as aiogram_html
-from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from urllib.parse import quote_plus as url_quote_plus
 
-from models import Table, Product, Category, Order, Settings, Employee, OrderStatusHistory, OrderStatus
+from models import Table, Product, Category, Order, Settings, Employee, async_session_maker
 from dependencies import get_db_session
-from templates import IN_HOUSE_MENU_HTML_TEMPLATE
-# --- НОВИЙ ІМПОРТ: Для розподілу на кухню/бар ---
-from notification_manager import distribute_order_to_production
+from bot_instances import get_admin_bot
+from menu_cache import get_menu_snapshot
+from reference_cache import get_cached_settings, final_status_ids
+from db_indexes import open_orders_filter
+from order_ingestion import OrderRequest, OrderValidationError
+from idempotency import place_order_once, get_idempotency_key, replayed_order_id
+from template_engine import tpl
+from http_cache import storefront_etag, not_modified, cache_headers, get_orders_version
+from outbox import NEW_IN_HOUSE_ORDER, STAFF_MESSAGE, enqueue_notification, wake_outbox_worker
+from rate_limit import check_rate_limits, client_ip, call_coalescer, CALL_COALESCE_WINDOW
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Сторінка столика містить історію його замовлень - не для спільних кешів (CDN/nginx)
+TABLE_PAGE_CACHE_CONTROL = "private, no-cache"
 
-async def get_admin_bot(session: AsyncSession) -> Bot | None:
-    """Допоміжна функція для отримання екземпляра адмін-бота."""
-    admin_bot_token = os.environ.get('ADMIN_BOT_TOKEN')
-    
-    if admin_bot_token:
-        from aiogram.enums import ParseMode
-        from aiogram.client.default import DefaultBotProperties
-        return Bot(token=admin_bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    return None
 
 @router.get("/menu/table/{access_token}", response_class=HTMLResponse)
 async def get_in_house_menu(access_token: str, request: Request, session: AsyncSession = Depends(get_db_session)):
     """Відображає сторінку меню для конкретного столика з історією замовлень."""
+    etag = storefront_etag("table", access_token, get_orders_version())
+    if (cached := not_modified(request, etag, TABLE_PAGE_CACHE_CONTROL)) is not None:
+        return cached
 
     table_res = await session.execute(
         select(Table).where(Table.access_token == access_token)
@@ -45,34 +47,19 @@ async def get_in_house_menu(access_token: str, request: Request, session: AsyncS
     if not table:
         raise HTTPException(status_code=404, detail="Столик не знайдено.")
 
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await get_cached_settings(session)
     logo_html = f'<img src="/{settings.logo_url}" alt="Логотип" class="header-logo">' if settings and settings.logo_url else ''
 
-    # Отримуємо меню, яке показується в ресторані
-    categories_res = await session.execute(
-        select(Category)
-        .where(Category.show_in_restaurant == True)
-        .order_by(Category.sort_order, Category.name)
-    )
-    products_res = await session.execute(
-        select(Product)
-        .join(Category)
-        .where(Product.is_active == True, Category.show_in_restaurant == True)
-    )
-
-    categories = [{"id": c.id, "name": c.name} for c in categories_res.scalars().all()]
-    products = [{"id": p.id, "name": p.name, "description": p.description, "price": p.price, "image_url": p.image_url, "category_id": p.category_id} for p in products_res.scalars().all()]
+    # Отримуємо меню, яке показується в ресторані (зі знімка в пам'яті)
+    menu_snapshot = await get_menu_snapshot(session)
 
     # --- НОВЕ: Отримуємо історію неоплачених замовлень для цього столика ---
     # Вважаємо "неоплаченими" всі, де статус не є фінальним (успіх або відміна)
-    final_statuses_res = await session.execute(
-        select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True))
-    )
-    final_status_ids = final_statuses_res.scalars().all()
+    final_ids = await final_status_ids(session)
 
     active_orders_res = await session.execute(
         select(Order)
-        .where(Order.table_id == table.id, Order.status_id.not_in(final_status_ids))
+        .where(Order.table_id == table.id, open_orders_filter(final_ids))
         .options(joinedload(Order.status))
         .order_by(Order.id.desc())
     )
@@ -93,7 +80,7 @@ async def get_in_house_menu(access_token: str, request: Request, session: AsyncS
         })
 
     # Передаємо дані меню та історії в шаблон через JSON
-    menu_data = json.dumps({"categories": categories, "products": products})
+    menu_data = menu_snapshot.restaurant_json
     history_data = json.dumps(history_list) # Передаємо історію як JSON
 
     # --- Design variables ---
@@ -105,7 +92,7 @@ async def get_in_house_menu(access_token: str, request: Request, session: AsyncS
     font_family_serif_val = settings.font_family_serif or "Playfair Display"
     # ---------------------------------------
 
-    return HTMLResponse(content=IN_HOUSE_MENU_HTML_TEMPLATE.format(
+    return HTMLResponse(content=tpl.IN_HOUSE_MENU_HTML_TEMPLATE.render(
         table_name=html_module.escape(table.name),
         table_id=table.id,
         logo_html=logo_html,
@@ -122,201 +109,120 @@ async def get_in_house_menu(access_token: str, request: Request, session: AsyncS
         font_family_serif_val=font_family_serif_val,
         font_family_sans_encoded=url_quote_plus(font_family_sans_val),
         font_family_serif_encoded=url_quote_plus(font_family_serif_val)
-    ))
+    ), headers=cache_headers(etag, TABLE_PAGE_CACHE_CONTROL))
+
+def _table_call_recipients(table: Table) -> Tuple[List[int], str]:
+    """Чати офіціантів столика на зміні; якщо таких немає - адмін-чат з приміткою."""
+    target_chat_ids = {w.telegram_user_id for w in table.assigned_waiters if w.telegram_user_id and w.is_on_shift}
+    if target_chat_ids:
+        return list(target_chat_ids), ""
+    admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
+    if admin_chat_id_str:
+        try:
+            return [int(admin_chat_id_str)], "\n<i>Офіціанта не призначено або він не на зміні.</i>"
+        except ValueError:
+            logger.warning(f"Некоректний admin_chat_id: {admin_chat_id_str}")
+    return [], ""
+
+
+async def _send_table_call(session: AsyncSession, action: str, table: Table, message_text: str, label: str) -> bool:
+    """
+    Ставить виклик зі столика в чергу сповіщень (відправляє воркер outbox.py).
+    Повтори за CALL_COALESCE_WINDOW не надсилаються одразу, а після закриття вікна
+    зводяться в одне сповіщення з лічильником.
+    Повертає False, якщо це повтор (сповіщення вже надіслано).
+    """
+    admin_bot = get_admin_bot()
+    if not admin_bot:
+        raise HTTPException(status_code=500, detail="Сервіс сповіщень недоступний.")
+
+    chat_ids, note = _table_call_recipients(table)
+    if not chat_ids:
+        logger.error(f"Не вдалося знайти отримувача ({label}) зі столика {table.id}")
+        raise HTTPException(status_code=503, detail="Не вдалося знайти отримувача для сповіщення.")
+    message_text += note
+
+    async def send(text: str, send_session: AsyncSession):
+        enqueue_notification(send_session, STAFF_MESSAGE, payload={"chat_ids": chat_ids, "text": text, "label": label})
+        await send_session.commit()
+        wake_outbox_worker()
+
+    async def send_repeat(count: int):
+        # Викликається після закриття вікна, коли сесія запиту вже закрита
+        async with async_session_maker() as repeat_session:
+            await send(f"{message_text}\n🔁 <b>Гість натиснув {count}× за {CALL_COALESCE_WINDOW:.0f} с</b>", repeat_session)
+
+    if not call_coalescer.hit(action, table.id, send_repeat):
+        return False
+    await send(message_text, session)
+    return True
+
 
 @router.post("/api/menu/table/{table_id}/call_waiter", response_class=JSONResponse)
-async def call_waiter(table_id: int, session: AsyncSession = Depends(get_db_session)):
+async def call_waiter(table_id: int, request: Request, session: AsyncSession = Depends(get_db_session)):
     """Обробляє виклик офіціанта зі столика."""
+    check_rate_limits(("table_ip", client_ip(request)), ("table_call", table_id))
     table = await session.get(Table, table_id, options=[selectinload(Table.assigned_waiters)])
     if not table: raise HTTPException(status_code=404, detail="Столик не знайдено.")
 
-    waiters = table.assigned_waiters
     message_text = f"❗️ <b>Виклик зі столика: {html_module.escape(table.name)}</b>"
-    
-    admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
-
-    admin_bot = await get_admin_bot(session)
-    if not admin_bot:
-        raise HTTPException(status_code=500, detail="Сервіс сповіщень недоступний.")
-
-    try:
-        target_chat_ids = set()
-        for w in waiters:
-            if w.telegram_user_id and w.is_on_shift:
-                target_chat_ids.add(w.telegram_user_id)
-
-        if not target_chat_ids:
-            if admin_chat_id_str:
-                try:
-                    target_chat_ids.add(int(admin_chat_id_str))
-                    message_text += "\n<i>Офіціанта не призначено або він не на зміні.</i>"
-                except ValueError:
-                     logger.warning(f"Некоректний admin_chat_id: {admin_chat_id_str}")
-
-        if target_chat_ids:
-            for chat_id in target_chat_ids:
-                try:
-                    await admin_bot.send_message(chat_id, message_text)
-                except Exception as e:
-                    logger.error(f"Не вдалося надіслати виклик офіціанта в чат {chat_id}: {e}")
-            return JSONResponse(content={"message": "Офіціанта сповіщено. Будь ласка, зачекайте."})
-        else:
-            logger.error(f"Не вдалося знайти отримувача для виклику офіціанта зі столика {table_id}")
-            raise HTTPException(status_code=503, detail="Не вдалося знайти отримувача для сповіщення.")
-    finally:
-        await admin_bot.session.close()
+    if await _send_table_call(session, "call_waiter", table, message_text, "виклик офіціанта"):
+        return JSONResponse(content={"message": "Офіціанта сповіщено. Будь ласка, зачекайте."})
+    return JSONResponse(content={"message": "Офіціанта вже сповіщено. Будь ласка, зачекайте."})
 
 @router.post("/api/menu/table/{table_id}/request_bill", response_class=JSONResponse)
-async def request_bill(table_id: int, session: AsyncSession = Depends(get_db_session)):
+async def request_bill(table_id: int, request: Request, session: AsyncSession = Depends(get_db_session)):
     """Обробляє запит на рахунок зі столика."""
+    check_rate_limits(("table_ip", client_ip(request)), ("table_call", table_id))
     table = await session.get(Table, table_id, options=[selectinload(Table.assigned_waiters)])
     if not table: raise HTTPException(status_code=404, detail="Столик не знайдено.")
 
     # Рахуємо загальну суму активних замовлень для повідомлення офіціанту
-    final_statuses_res = await session.execute(
-        select(OrderStatus.id).where(or_(OrderStatus.is_completed_status == True, OrderStatus.is_cancelled_status == True))
-    )
-    final_status_ids = final_statuses_res.scalars().all()
+    final_ids = await final_status_ids(session)
 
-    active_orders_res = await session.execute(
-        select(Order).where(Order.table_id == table.id, Order.status_id.not_in(final_status_ids))
+    # Потрібна лише сума - без завантаження самих замовлень
+    total_bill = await session.scalar(
+        select(func.coalesce(func.sum(Order.total_price), 0)).where(Order.table_id == table.id, open_orders_filter(final_ids))
     )
-    active_orders = active_orders_res.scalars().all()
-    total_bill = sum(o.total_price for o in active_orders)
 
-    waiters = table.assigned_waiters
     message_text = (f"💰 <b>Запит на розрахунок зі столика: {html_module.escape(table.name)}</b>\n"
                     f"Загальна сума (поточна): <b>{total_bill} грн</b>")
-
-    admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
-
-    admin_bot = await get_admin_bot(session)
-    if not admin_bot:
-        raise HTTPException(status_code=500, detail="Сервіс сповіщень недоступний.")
-
-    try:
-        target_chat_ids = set()
-        for w in waiters:
-            if w.telegram_user_id and w.is_on_shift:
-                target_chat_ids.add(w.telegram_user_id)
-
-        if not target_chat_ids:
-            if admin_chat_id_str:
-                try:
-                    target_chat_ids.add(int(admin_chat_id_str))
-                    message_text += "\n<i>Офіціанта не призначено або він не на зміні.</i>"
-                except ValueError:
-                     logger.warning(f"Некоректний admin_chat_id: {admin_chat_id_str}")
-
-        if target_chat_ids:
-            for chat_id in target_chat_ids:
-                try:
-                    await admin_bot.send_message(chat_id, message_text)
-                except Exception as e:
-                    logger.error(f"Не вдалося надіслати запит на рахунок в чат {chat_id}: {e}")
-            return JSONResponse(content={"message": "Запит надіслано. Офіціант незабаром підійде з рахунком."})
-        else:
-            logger.error(f"Не вдалося знайти отримувача для запиту на рахунок зі столика {table_id}")
-            raise HTTPException(status_code=503, detail="Не вдалося знайти отримувача для сповіщення.")
-    finally:
-        await admin_bot.session.close()
+    if await _send_table_call(session, "request_bill", table, message_text, "запит на рахунок"):
+        return JSONResponse(content={"message": "Запит надіслано. Офіціант незабаром підійде з рахунком."})
+    return JSONResponse(content={"message": "Запит уже надіслано. Офіціант незабаром підійде з рахунком."})
 
 @router.post("/api/menu/table/{table_id}/place_order", response_class=JSONResponse)
-async def place_in_house_order(table_id: int, items: list = Body(...), session: AsyncSession = Depends(get_db_session)):
+async def place_in_house_order(table_id: int, request: Request, items: list = Body(...), session: AsyncSession = Depends(get_db_session)):
     """Обробляє нове замовлення зі столика."""
-    table = await session.get(Table, table_id, options=[selectinload(Table.assigned_waiters)])
+    # Повтор POST з тим самим Idempotency-Key (нестабільний зв'язок на терасі) не створює друге
+    # замовлення і не витрачає ліміт - гість отримує відповідь на перший запит, а не 429
+    idempotency_key = get_idempotency_key(request, f"table:{table_id}")
+    order_id = await replayed_order_id(session, idempotency_key, endpoint="table")
+    if order_id is not None:
+        return _order_accepted(order_id, replayed=True)
+
+    check_rate_limits(("table_ip", client_ip(request)), ("table_order", table_id))
+    table = await session.get(Table, table_id)
     if not table: raise HTTPException(status_code=404, detail="Столик не знайдено.")
     if not items: raise HTTPException(status_code=400, detail="Замовлення порожнє.")
 
-    total_price = sum(item.get('price', 0) * item.get('quantity', 0) for item in items)
-    products_str = ", ".join([f"{item['name']} x {item['quantity']}" for item in items])
-
-    # --- ОТРИМУЄМО СТАТУС ЗА ЗАМОВЧУВАННЯМ (Новий - ID 1) ---
-    new_status = await session.get(OrderStatus, 1)
-    if not new_status:
-        # Fallback, якщо статусу з ID 1 немає (малоймовірно)
-        new_status = OrderStatus(id=1, name="Новий", requires_kitchen_notify=True)
-
-    order = Order(
-        customer_name=f"Стіл: {table.name}", phone_number=f"table_{table.id}",
-        address=None, products=products_str, total_price=total_price,
-        is_delivery=False, delivery_time="In House", order_type="in_house",
-        table_id=table.id, status_id=new_status.id
-    )
-    session.add(order)
-    await session.commit()
-    await session.refresh(order)
-    # Завантажуємо статус в об'єкт замовлення, щоб переконатися, що він доступний
-    await session.refresh(order, ['status'])
-
-    history_entry = OrderStatusHistory(
-        order_id=order.id, status_id=order.status_id,
-        actor_info=f"Гість за столиком {table.name}"
-    )
-    session.add(history_entry)
-    await session.commit()
-
-    order_details_text = (f"📝 <b>Нове замовлення зі столика: {aiogram_html.bold(table.name)} (ID: #{order.id})</b>\n\n"
-                          f"<b>Склад:</b>\n- " + aiogram_html.quote(products_str.replace(", ", "\n- ")) +
-                          f"\n\n<b>Сума:</b> {total_price} грн")
-
-    admin_bot = await get_admin_bot(session)
-    if not admin_bot:
-        logger.error(f"Замовлення #{order.id} створено, але адмін-бот недоступний для сповіщення.")
-        return JSONResponse(content={"message": "Замовлення прийнято! Очікуйте.", "order_id": order.id})
-
-    kb_waiter = InlineKeyboardBuilder()
-    kb_waiter.row(InlineKeyboardButton(text="✅ Прийняти замовлення", callback_data=f"waiter_accept_order_{order.id}"))
-
-    kb_admin = InlineKeyboardBuilder()
-    kb_admin.row(InlineKeyboardButton(text="⚙️ Керувати (Адмін)", callback_data=f"waiter_manage_order_{order.id}"))
-
-
     try:
-        # 1. Розсилка офіціантам (персонально для цього столика)
-        waiters = table.assigned_waiters
-        admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
-        admin_chat_id = None
-        if admin_chat_id_str:
-            try: admin_chat_id = int(admin_chat_id_str)
-            except ValueError: pass
-
-        waiter_chat_ids = set()
-        for w in waiters:
-            if w.telegram_user_id and w.is_on_shift:
-                waiter_chat_ids.add(w.telegram_user_id)
-
-        if waiter_chat_ids:
-            for chat_id in waiter_chat_ids:
-                try:
-                    await admin_bot.send_message(chat_id, order_details_text, reply_markup=kb_waiter.as_markup())
-                except Exception as e:
-                    logger.error(f"Не вдалося надіслати нове замовлення офіціанту {chat_id}: {e}")
-
-            if admin_chat_id and admin_chat_id not in waiter_chat_ids:
-                try:
-                    await admin_bot.send_message(admin_chat_id, "✅ " + order_details_text, reply_markup=kb_admin.as_markup())
-                except Exception as e: pass
-        else:
-            if admin_chat_id:
-                await admin_bot.send_message(
-                    admin_chat_id,
-                    f"❗️ <b>Замовлення з вільного столика {aiogram_html.bold(table.name)} (ID: #{order.id})!</b>\n\n" + order_details_text,
-                    reply_markup=kb_admin.as_markup()
-                )
-
-        # 2. --- НОВЕ: Розподіл на Кухню та Бар (ВИПРАВЛЕНО) ---
-        # Перевіряємо, чи статус замовлення вимагає відправки на виробництво
-        if order.status.requires_kitchen_notify:
-            try:
-                await distribute_order_to_production(admin_bot, order, session)
-                logger.info(f"Замовлення #{order.id} відправлено на виробництво (статус вимагає цього).")
-            except Exception as e:
-                logger.error(f"Помилка при розподілі замовлення #{order.id} на кухню/бар: {e}")
-        else:
-            logger.info(f"Замовлення #{order.id} НЕ відправлено на виробництво (налаштування статусу).")
-            
-        return JSONResponse(content={"message": "Замовлення прийнято! Офіціант незабаром його підтвердить.", "order_id": order.id})
-
-    finally:
-        await admin_bot.session.close()
\ No newline at end of file
+        order_id, replayed = await place_order_once(session, idempotency_key, OrderRequest(
+            lines=items,
+            actor_info=f"Гість за столиком {table.name}",
+            customer_name=f"Стіл: {table.name}", phone_number=f"table_{table.id}",
+            is_delivery=False, delivery_time="In House", order_type="in_house", table_id=table.id,
+            # Сповіщення офіціантам/кухні зберігається в тому ж commit і відправляється воркером черги
+            notification=NEW_IN_HOUSE_ORDER,
+        ), endpoint="table", replay_checked=True)
+    except OrderValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return _order_accepted(order_id, replayed)
+
+
+def _order_accepted(order_id: int, replayed: bool) -> JSONResponse:
+    return JSONResponse(
+        content={"message": "Замовлення прийнято! Офіціант незабаром його підтвердить.", "order_id": order_id},
+        headers={"Idempotent-Replayed": "true"} if replayed else None,
+    )
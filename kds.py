@@ -0,0 +1,156 @@
+# kds.py
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Set
+
+from fastapi import WebSocket
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Order, OrderItem, async_session_maker
+from production_board import AREAS, ProductionTicket, load_production_board
+
+logger = logging.getLogger(__name__)
+
+# Скільки чекати на повільний екран, перш ніж відключити його (щоб не гальмувати решту)
+KDS_SEND_TIMEOUT = float(os.environ.get("KDS_SEND_TIMEOUT", "5"))
+
+_CHANGED_KEY = "kds_changed_orders"
+
+# Причини оновлення квитка; при кількох змінах в одному commit лишається найважливіша
+REASON_NEW = "new"
+REASON_STATUS = "status"
+REASON_ITEMS = "items"
+_REASON_PRIORITY = {REASON_NEW: 3, REASON_STATUS: 2, REASON_ITEMS: 1}
+
+
+def ticket_payload(ticket: ProductionTicket, reason: str = "") -> Dict[str, Any]:
+    return {
+        "order_id": ticket.order_id,
+        "created_at": ticket.created_at.isoformat(timespec="seconds") if ticket.created_at else None,
+        "table": ticket.table_info,
+        "items": [{"name": name, "quantity": quantity} for name, quantity in ticket.items],
+        "reason": reason,
+    }
+
+
+def _merge_reasons(target: Dict[int, str], changes: Dict[int, str]):
+    for order_id, reason in changes.items():
+        current = target.get(order_id)
+        if current is None or _REASON_PRIORITY[reason] > _REASON_PRIORITY[current]:
+            target[order_id] = reason
+
+
+class KdsHub:
+    """
+    Розсилка подій екранам кухні/бару. На кожен commit зі зміною замовлень
+    дошка довантажується один раз, і для кожного цеху серіалізується одне
+    повідомлення, яке отримують усі підключені екрани цього цеху.
+    """
+    def __init__(self):
+        self._subscribers: Dict[str, Set[WebSocket]] = {area: set() for area in AREAS}
+        self._pending: Dict[int, str] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def has_subscribers(self) -> bool:
+        return any(self._subscribers.values())
+
+    def connect(self, area: str, websocket: WebSocket):
+        self._subscribers[area].add(websocket)
+
+    def disconnect(self, area: str, websocket: WebSocket):
+        self._subscribers[area].discard(websocket)
+
+    async def _send(self, area: str, websocket: WebSocket, message: str):
+        try:
+            await asyncio.wait_for(websocket.send_text(message), KDS_SEND_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Екран KDS ({area}) відключено: {e}")
+            self.disconnect(area, websocket)
+
+    async def broadcast(self, area: str, payload: Dict[str, Any]):
+        sockets = list(self._subscribers[area])
+        if not sockets:
+            return
+        message = json.dumps(payload, ensure_ascii=False)
+        await asyncio.gather(*(self._send(area, ws, message) for ws in sockets))
+
+    def schedule_refresh(self, changes: Dict[int, str]):
+        """Викликається після commit; зміни кількох commit в одному циклі подій об'єднуються."""
+        _merge_reasons(self._pending, changes)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self):
+        while self._pending:
+            changes, self._pending = self._pending, {}
+            areas = [area for area in AREAS if self._subscribers[area]]
+            if not areas:
+                return
+            try:
+                async with async_session_maker() as session:
+                    board = await load_production_board(session, areas=areas, order_ids=list(changes))
+            except Exception as e:
+                logger.error(f"KDS: не вдалося завантажити змінені замовлення: {e}")
+                continue
+            for area in areas:
+                present = {t.order_id: t for t in board[area]}
+                await self.broadcast(area, {
+                    "type": "update",
+                    "tickets": [ticket_payload(t, changes[t.order_id]) for t in present.values()],
+                    # Замовлення, що вийшли з екрана цеху (готове, скасоване, без позицій цеху)
+                    "removed": [order_id for order_id in changes if order_id not in present],
+                })
+
+    async def send_snapshot(self, area: str, websocket: WebSocket):
+        async with async_session_maker() as session:
+            board = await load_production_board(session, areas=(area,))
+        await websocket.send_text(json.dumps(
+            {"type": "snapshot", "tickets": [ticket_payload(t) for t in board[area]]}, ensure_ascii=False
+        ))
+
+
+kds_hub = KdsHub()
+
+
+def record_kds_change(session, order_id: int, reason: str):
+    """Для змін замовлень через UPDATE поза flush ORM (order_transitions.py)."""
+    if kds_hub.has_subscribers():
+        _merge_reasons(session.info.setdefault(_CHANGED_KEY, {}), {order_id: reason})
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_kds_changes(session, flush_context):
+    if not kds_hub.has_subscribers():
+        return
+    changes: Dict[int, str] = {}
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Order) and obj.id is not None:
+            if obj in session.new:
+                changes[obj.id] = REASON_NEW
+            elif obj in session.deleted or sa.inspect(obj).attrs.status_id.history.deleted:
+                changes[obj.id] = REASON_STATUS
+        elif isinstance(obj, OrderItem) and obj.order_id is not None:
+            changes.setdefault(obj.order_id, REASON_ITEMS)
+    if changes:
+        _merge_reasons(session.info.setdefault(_CHANGED_KEY, {}), changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_kds_changes(session):
+    changes = session.info.pop(_CHANGED_KEY, None)
+    if not changes:
+        return
+    try:
+        kds_hub.schedule_refresh(changes)
+    except RuntimeError:
+        # commit поза циклом подій (скрипти) - екранів тут немає
+        pass
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_kds_changes(session):
+    session.info.pop(_CHANGED_KEY, None)
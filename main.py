@@ -13,12 +13,13 @@ from typing import Dict, Any, Generator, Optional, List
 from datetime import date, datetime, timedelta
 import html
 import json
+import dataclasses
 from dotenv import load_dotenv  # <-- --- Завантаження .env ---
 from urllib.parse import quote_plus as url_quote_plus
 
 # --- FastAPI & Uvicorn ---
 from fastapi import FastAPI, Form, Request, Depends, HTTPException, status, Query, File, UploadFile, Body
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 
@@ -34,22 +35,19 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 # --- SQLAlchemy ---
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.exc import IntegrityError
 import sqlalchemy as sa
 from sqlalchemy import func, and_
 
 # --- Локальні імпорти ---
-from templates import (
-    ADMIN_HTML_TEMPLATE, WEB_ORDER_HTML, ADMIN_EMPLOYEE_BODY, 
-    ADMIN_ROLES_BODY, ADMIN_REPORTS_BODY, ADMIN_ORDER_FORM_BODY, 
-    ADMIN_SETTINGS_BODY, ADMIN_MENU_BODY, ADMIN_ORDER_MANAGE_BODY, 
-    ADMIN_TABLES_BODY
-)
+from templates import ADMIN_ORDER_FORM_BODY
+from template_engine import tpl
 from models import *
-from admin_handlers import register_admin_handlers, parse_products_string
+from admin_handlers import register_admin_handlers
 from courier_handlers import register_courier_handlers
-from notification_manager import notify_new_order_to_staff
+from outbox import run_outbox_worker
+import bot_instances
 from admin_clients import router as clients_router
 from dependencies import get_db_session, check_credentials
 # --- НОВІ ІМПОРТИ ---
@@ -57,6 +55,23 @@ from admin_order_management import router as admin_order_router
 from admin_tables import router as admin_tables_router
 from in_house_menu import router as in_house_menu_router
 from admin_design_settings import router as admin_design_router # <-- NEW
+from admin_metrics import router as admin_metrics_router
+from admin_reports import router as admin_reports_router
+from admin_kds import router as admin_kds_router
+from pagination import Keyset, KeysetPage, render_pagination, approximate_row_count
+from search import ensure_search_indexes, order_search, product_search, ranked, results_label
+from menu_cache import get_menu_snapshot, bump_menu_version, get_menu_version
+from http_cache import make_etag, storefront_etag, not_modified, cache_headers, get_pages_version
+from reference_cache import invalidate_reference_cache, get_cached_settings, SettingsRef, final_status_ids
+from db_indexes import ensure_order_indexes, open_orders_filter, schedule_order_index_sync
+from customer_stats import rebuild_customer_stats
+from report_rollups import rebuild_report_rollups, schedule_rollup_rebuild
+from profiling import RequestProfilingMiddleware, UpdateProfilingMiddleware
+from metrics import HttpMetricsMiddleware, HandlerMetricsMiddleware
+from order_items import replace_order_items, backfill_order_items
+from order_ingestion import place_order, build_order_items, lines_from_products_str, OrderRequest, OrderValidationError
+from idempotency import place_order_once, get_idempotency_key, replayed_order_id, run_idempotency_purger
+from rate_limit import check_rate_limits, client_ip
 # -----------------------------------------------
 
 # --- КОНФІГУРАЦІЯ ---
@@ -122,7 +137,7 @@ async def command_start_handler(message: Message, state: FSMContext, session: As
     await state.clear()
     
     # --- MODIFIED: Fetch settings to get custom welcome message ---
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await get_cached_settings(session)
     
     default_welcome = f"Шановний {{user_name}}, ласкаво просимо! 👋\n\nМи раді вас бачити. Оберіть опцію:"
     welcome_template = settings.telegram_welcome_message or default_welcome
@@ -173,7 +188,7 @@ async def back_to_start_menu(callback: CallbackQuery, state: FSMContext, session
         logging.warning(f"Не вдалося видалити повідомлення в back_to_start_menu: {e}")
 
     # --- MODIFIED: Use the same logic as command_start_handler ---
-    settings = await session.get(Settings, 1) or Settings()
+    settings = await get_cached_settings(session)
     default_welcome = f"Шановний {{user_name}}, ласкаво просимо! 👋\n\nМи раді вас бачити. Оберіть опцію:"
     welcome_template = settings.telegram_welcome_message or default_welcome
     try:
@@ -227,13 +242,9 @@ async def show_menu(message_or_callback: Message | CallbackQuery, session: Async
     message = message_or_callback.message if is_callback else message_or_callback
 
     keyboard = InlineKeyboardBuilder()
-    # Додано .where(Category.show_on_delivery_site == True)
-    categories_result = await session.execute(
-        sa.select(Category)
-        .where(Category.show_on_delivery_site == True)
-        .order_by(Category.sort_order, Category.name)
-    )
-    categories = categories_result.scalars().all()
+    # Категорії для доставки беремо зі знімка меню (без запиту до БД)
+    snapshot = await get_menu_snapshot(session)
+    categories = snapshot.delivery_categories
 
     if not categories:
         text = "Шановний клієнте, меню поки що порожнє. Зачекайте на оновлення!"
@@ -242,7 +253,7 @@ async def show_menu(message_or_callback: Message | CallbackQuery, session: Async
         return
 
     for category in categories:
-        keyboard.add(InlineKeyboardButton(text=category.name, callback_data=f"show_category_{category.id}_1"))
+        keyboard.add(InlineKeyboardButton(text=category["name"], callback_data=f"show_category_{category['id']}_1"))
     keyboard.add(InlineKeyboardButton(text="⬅️ Головне меню", callback_data="start_menu"))
     keyboard.adjust(1)
 
@@ -270,26 +281,24 @@ async def show_category_paginated(callback: CallbackQuery, session: AsyncSession
     category_id = int(parts[2])
     page = int(parts[3]) if len(parts) > 3 else 1
 
-    category = await session.get(Category, category_id)
+    snapshot = await get_menu_snapshot(session)
+    category = snapshot.categories_by_id.get(category_id)
     if not category:
         await callback.answer("Категорію не знайдено!", show_alert=True)
         return
 
+    # Активні страви категорії вже відсортовані за назвою у знімку меню
     offset = (page - 1) * PRODUCTS_PER_PAGE
-    query_total = sa.select(sa.func.count(Product.id)).where(Product.category_id == category_id, Product.is_active == True)
-    query_products = sa.select(Product).where(Product.category_id == category_id, Product.is_active == True).order_by(Product.name).offset(offset).limit(PRODUCTS_PER_PAGE)
-
-    total_products_res = await session.execute(query_total)
-    total_products = total_products_res.scalar_one_or_none() or 0 # Ensure total is not None
+    category_products = snapshot.products_by_category.get(category_id, [])
+    total_products = len(category_products)
 
     total_pages = (total_products + PRODUCTS_PER_PAGE - 1) // PRODUCTS_PER_PAGE
 
-    products_result = await session.execute(query_products)
-    products_on_page = products_result.scalars().all()
+    products_on_page = category_products[offset:offset + PRODUCTS_PER_PAGE]
 
     keyboard = InlineKeyboardBuilder()
     for product in products_on_page:
-        keyboard.add(InlineKeyboardButton(text=f"{product.name} - {product.price} грн", callback_data=f"show_product_{product.id}"))
+        keyboard.add(InlineKeyboardButton(text=f"{product['name']} - {product['price']} грн", callback_data=f"show_product_{product['id']}"))
 
     nav_buttons = []
     if page > 1:
@@ -304,7 +313,7 @@ async def show_category_paginated(callback: CallbackQuery, session: AsyncSession
     keyboard.row(InlineKeyboardButton(text="Меню категорій", callback_data="menu"))
     keyboard.adjust(1)
 
-    text = f"<b>{html.escape(category.name)}</b> (Сторінка {page}):"
+    text = f"<b>{html.escape(category['name'])}</b> (Сторінка {page}):"
 
     try:
         await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
@@ -477,10 +486,15 @@ async def start_checkout(callback: CallbackQuery, state: FSMContext, session: As
 
     total_price = sum(item.product.price * item.quantity for item in cart_items if item.product)
     products_str = [f"{item.product.name} x {item.quantity}" for item in cart_items if item.product]
+    cart_lines = [
+        {"product_id": item.product.id, "name": item.product.name, "price": item.product.price, "quantity": item.quantity}
+        for item in cart_items if item.product
+    ]
 
     await state.update_data(
         total_price=total_price,
         products=", ".join(products_str),
+        items=cart_lines,
         user_id=user_id,
         username=callback.from_user.username,
         order_type='delivery' # За замовчуванням
@@ -615,34 +629,23 @@ async def process_specific_time(message: Message, state: FSMContext, session: As
 
 async def finalize_order(message: Message, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
-    user_id = data.get('user_id')
-    admin_bot = dp_admin.get("bot_instance")
-    
-    order = Order(
-        user_id=data['user_id'], username=data.get('username'), products=data['products'],
-        total_price=data['total_price'], customer_name=data['customer_name'],
-        phone_number=data['phone_number'], address=data.get('address'),
-        is_delivery=data.get('is_delivery', True),
-        delivery_time=data.get('delivery_time', 'Якнайшвидше'),
-        order_type=data.get('order_type', 'delivery')
-    )
-    session.add(order)
-
-    if user_id:
-        customer = await session.get(Customer, user_id)
-        if not customer:
-            customer = Customer(user_id=user_id)
-            session.add(customer)
-        customer.name, customer.phone_number = data['customer_name'], data['phone_number']
-        if 'address' in data and data['address'] is not None:
-            customer.address = data.get('address')
-        await session.execute(sa.delete(CartItem).where(CartItem.user_id == user_id))
-
-    await session.commit()
-    await session.refresh(order)
+    # Стан FSM, збережений до появи позицій замовлення, містить лише рядок products
+    lines = data.get('items') or await lines_from_products_str(session, data.get('products', ''))
 
-    if admin_bot:
-        await notify_new_order_to_staff(admin_bot, order, session)
+    try:
+        await place_order(session, OrderRequest(
+            lines=lines,
+            actor_info=f"Клієнт (Telegram): {data['customer_name']}",
+            customer_name=data['customer_name'], phone_number=data['phone_number'],
+            address=data.get('address'), is_delivery=data.get('is_delivery', True),
+            delivery_time=data.get('delivery_time', 'Якнайшвидше'),
+            order_type=data.get('order_type', 'delivery'),
+            user_id=data.get('user_id'), username=data.get('username'),
+        ))
+    except OrderValidationError as e:
+        await state.clear()
+        await message.answer(f"Шановний клієнте, не вдалося оформити замовлення. {e}")
+        return
 
     await message.answer("Шановний клієнте, ваше замовлення оформлено! Дякуємо за вибір. Смачного!")
 
@@ -650,6 +653,29 @@ async def finalize_order(message: Message, state: FSMContext, session: AsyncSess
     await command_start_handler(message, state, session)
 
 # --- Функція start_bot ---
+def setup_dispatchers(client_dp: Dispatcher, admin_dp: Dispatcher, bot: Bot, admin_bot: Bot):
+    """Реєструє обробники, дані та middleware диспетчерів (без polling; також використовується bench_load.py)."""
+    admin_dp["client_bot"] = bot
+    admin_dp["bot_instance"] = admin_bot
+    client_dp["admin_bot_instance"] = admin_bot
+    client_dp["session_factory"] = async_session_maker
+    admin_dp["session_factory"] = async_session_maker
+
+    # Реєструємо динамічний обробник меню (вимагає сесії)
+    client_dp.message.register(handle_dynamic_menu_item, F.text)
+
+    register_admin_handlers(admin_dp)
+    register_courier_handlers(admin_dp)
+
+    for bot_label, dispatcher in (("client", client_dp), ("admin", admin_dp)):
+        for observer in (dispatcher.callback_query, dispatcher.message):
+            observer.middleware(HandlerMetricsMiddleware(bot_label))
+            observer.middleware(UpdateProfilingMiddleware())
+    client_dp.callback_query.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+    client_dp.message.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+    admin_dp.callback_query.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+    admin_dp.message.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+
 async def start_bot(client_dp: Dispatcher, admin_dp: Dispatcher):
     try:
         # Читаємо токени напряму з змінних оточення
@@ -660,25 +686,9 @@ async def start_bot(client_dp: Dispatcher, admin_dp: Dispatcher):
             logging.warning("Токени CLIENT_BOT_TOKEN або ADMIN_BOT_TOKEN не встановлені в .env! Боти не будуть запущені.")
             return
 
-        bot = Bot(token=client_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-        admin_bot = Bot(token=admin_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-
-        admin_dp["client_bot"] = bot
-        admin_dp["bot_instance"] = admin_bot
-        client_dp["admin_bot_instance"] = admin_bot
-        client_dp["session_factory"] = async_session_maker
-        admin_dp["session_factory"] = async_session_maker
-
-        # Реєструємо динамічний обробник меню (вимагає сесії)
-        client_dp.message.register(handle_dynamic_menu_item, F.text)
-
-        register_admin_handlers(admin_dp)
-        register_courier_handlers(admin_dp)
-
-        client_dp.callback_query.middleware(DbSessionMiddleware(session_pool=async_session_maker))
-        client_dp.message.middleware(DbSessionMiddleware(session_pool=async_session_maker))
-        admin_dp.callback_query.middleware(DbSessionMiddleware(session_pool=async_session_maker))
-        admin_dp.message.middleware(DbSessionMiddleware(session_pool=async_session_maker))
+        # Спільні екземпляри з реєстру (одна HTTP-сесія на бота для всього застосунку)
+        bot, admin_bot = bot_instances.init_bots()
+        setup_dispatchers(client_dp, admin_dp, bot, admin_bot)
 
         await bot.delete_webhook(drop_pending_updates=True)
         await admin_bot.delete_webhook(drop_pending_updates=True)
@@ -698,16 +708,39 @@ async def lifespan(app: FastAPI):
     os.makedirs("static/images", exist_ok=True)
     os.makedirs("static/favicons", exist_ok=True)
     await create_db_tables()
+    await ensure_search_indexes(engine)
+    await ensure_order_indexes(engine)
+    await backfill_order_items(async_session_maker)
+    await rebuild_customer_stats(async_session_maker, only_if_empty=True)
+    await rebuild_report_rollups(async_session_maker, only_if_empty=True)
+    bot_instances.init_bots()
     bot_task = asyncio.create_task(start_bot(dp, dp_admin))
+    outbox_task = asyncio.create_task(run_outbox_worker(
+        async_session_maker, lambda: (bot_instances.get_admin_bot(), bot_instances.get_client_bot())
+    ))
+    idempotency_task = asyncio.create_task(run_idempotency_purger(async_session_maker))
     yield
     logging.info("Зупинка...")
+    idempotency_task.cancel()
+    outbox_task.cancel()
     bot_task.cancel()
     try:
         await bot_task
     except asyncio.CancelledError:
         logging.info("Завдання бота успішно скасовано.")
+    try:
+        await outbox_task
+    except asyncio.CancelledError:
+        logging.info("Воркер черги сповіщень зупинено.")
+    try:
+        await idempotency_task
+    except asyncio.CancelledError:
+        logging.info("Очищення ключів ідемпотентності зупинено.")
+    await bot_instances.close_bots()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestProfilingMiddleware)
+app.add_middleware(HttpMetricsMiddleware)
 os.makedirs("static", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -717,6 +750,9 @@ app.include_router(clients_router)
 app.include_router(admin_order_router)
 app.include_router(admin_tables_router) # Для адмінки столиків
 app.include_router(admin_design_router) # <-- NEW ROUTER FOR DESIGN
+app.include_router(admin_metrics_router)
+app.include_router(admin_reports_router)
+app.include_router(admin_kds_router)
 # ------------------------------------
 
 class DbSessionMiddleware:
@@ -728,7 +764,12 @@ class DbSessionMiddleware:
 
 # --- FastAPI ендпоінти ---
 @app.get("/", response_class=HTMLResponse)
-async def get_web_ordering_page(session: AsyncSession = Depends(get_db_session)):
+async def get_web_ordering_page(request: Request, session: AsyncSession = Depends(get_db_session)):
+    # ETag будується з лічильників у пам'яті - 304 віддається без звернення до БД
+    etag = storefront_etag("index", get_pages_version())
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+
     settings = await get_settings(session)
     logo_html = f'<img src="/{settings.logo_url}" alt="Логотип" class="header-logo">' if settings.logo_url else ''
 
@@ -750,7 +791,7 @@ async def get_web_ordering_page(session: AsyncSession = Depends(get_db_session))
     font_family_serif_val = settings.font_family_serif or "Playfair Display"
     # ---------------------------------------
 
-    return HTMLResponse(content=WEB_ORDER_HTML.format(
+    return HTMLResponse(content=tpl.WEB_ORDER_HTML.render(
         logo_html=logo_html,
         menu_links_html=menu_links_html,
         site_title=html.escape(site_title),
@@ -763,76 +804,75 @@ async def get_web_ordering_page(session: AsyncSession = Depends(get_db_session))
         font_family_serif_val=font_family_serif_val,
         font_family_sans_encoded=url_quote_plus(font_family_sans_val),
         font_family_serif_encoded=url_quote_plus(font_family_serif_val)
-    ))
+    ), headers=cache_headers(etag))
 
 
 @app.get("/api/page/{item_id}", response_class=JSONResponse)
-async def get_menu_page_content(item_id: int, session: AsyncSession = Depends(get_db_session)):
+async def get_menu_page_content(item_id: int, request: Request, session: AsyncSession = Depends(get_db_session)):
+    etag = make_etag("page", item_id, get_pages_version())
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+
     menu_item = await session.get(MenuItem, item_id)
     if not menu_item or not menu_item.show_on_website:
         raise HTTPException(status_code=404, detail="Сторінку не знайдено")
-    return {"title": menu_item.title, "content": menu_item.content}
+    return JSONResponse(content={"title": menu_item.title, "content": menu_item.content}, headers=cache_headers(etag))
 
 # --- Функція /api/menu ---
 @app.get("/api/menu")
-async def get_menu_data(session: AsyncSession = Depends(get_db_session)):
-    # Додано .where(Category.show_on_delivery_site == True)
-    categories_res = await session.execute(
-        sa.select(Category)
-        .where(Category.show_on_delivery_site == True)
-        .order_by(Category.sort_order, Category.name)
-    )
-    # Додано join и фільтрація
-    products_res = await session.execute(
-        sa.select(Product)
-        .join(Category, Product.category_id == Category.id)
-        .where(Product.is_active == True, Category.show_on_delivery_site == True)
-    )
-
-    categories = [{"id": c.id, "name": c.name} for c in categories_res.scalars().all()]
-    products = [{"id": p.id, "name": p.name, "description": p.description, "price": p.price, "image_url": p.image_url, "category_id": p.category_id} for p in products_res.scalars().all()]
-
-    return {"categories": categories, "products": products}
+async def get_menu_data(request: Request, session: AsyncSession = Depends(get_db_session)):
+    etag = make_etag("menu", get_menu_version())
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+
+    # Меню для доставки (show_on_delivery_site) береться зі знімка в пам'яті
+    snapshot = await get_menu_snapshot(session)
+    # Версія знімка може бути новішою за ту, що була на момент перевірки
+    etag = make_etag("menu", snapshot.version)
+    return Response(content=snapshot.delivery_json, media_type="application/json", headers=cache_headers(etag))
 # --- КІНЕЦЬ /api/menu ---
 
 @app.get("/api/customer_info/{phone_number}")
 async def get_customer_info(phone_number: str, session: AsyncSession = Depends(get_db_session)):
-    result = await session.execute(
-        sa.select(Order).where(Order.phone_number == phone_number).order_by(Order.id.desc()).limit(1)
-    )
-    last_order = result.scalars().first()
-    if last_order:
-        return {"customer_name": last_order.customer_name, "phone_number": last_order.phone_number, "address": last_order.address}
+    stats = await session.get(CustomerStats, phone_number)
+    if stats:
+        return {"customer_name": stats.customer_name, "phone_number": stats.phone_number, "address": stats.address}
     raise HTTPException(status_code=404, detail="Клієнта не знайдено")
 
 @app.post("/api/place_order")
-async def place_web_order(order_data: dict = Body(...), session: AsyncSession = Depends(get_db_session)):
+async def place_web_order(request: Request, order_data: dict = Body(...), session: AsyncSession = Depends(get_db_session)):
+    # Повтор POST з тим самим Idempotency-Key повертає вже створене замовлення, не витрачаючи ліміт
+    idempotency_key = get_idempotency_key(request, "web")
+    order_id = await replayed_order_id(session, idempotency_key, endpoint="web")
+    if order_id is not None:
+        return _web_order_placed(order_id, replayed=True)
+
+    check_rate_limits(("ip", client_ip(request)))
     items = order_data.get("items", [])
     if not items:
         raise HTTPException(status_code=400, detail="Кошик порожній")
 
-    total_price = sum(item['price'] * item['quantity'] for item in items)
-    products_str = ", ".join([f"{item['name']} x {item['quantity']}" for item in items])
-
     is_delivery = order_data.get('is_delivery', True)
-    address = order_data.get('address') if is_delivery else None
-    order_type = 'delivery' if is_delivery else 'pickup'
-
-    order = Order(
-        customer_name=order_data.get('customer_name'), phone_number=order_data.get('phone_number'),
-        address=address, products=products_str, total_price=total_price,
-        is_delivery=is_delivery, delivery_time=order_data.get('delivery_time', "Якнайшвидше"),
-        order_type=order_type
+    try:
+        order_id, replayed = await place_order_once(session, idempotency_key, OrderRequest(
+            lines=items,
+            actor_info="Клієнт (сайт)",
+            customer_name=order_data.get('customer_name'), phone_number=order_data.get('phone_number'),
+            address=order_data.get('address'), is_delivery=is_delivery,
+            delivery_time=order_data.get('delivery_time', "Якнайшвидше"),
+            order_type='delivery' if is_delivery else 'pickup',
+        ), endpoint="web", replay_checked=True)
+    except OrderValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return _web_order_placed(order_id, replayed)
+
+
+def _web_order_placed(order_id: int, replayed: bool) -> JSONResponse:
+    return JSONResponse(
+        content={"message": "Замовлення успішно розміщено", "order_id": order_id},
+        headers={"Idempotent-Replayed": "true"} if replayed else None,
     )
-    session.add(order)
-    await session.commit()
-    await session.refresh(order)
-
-    admin_bot = dp_admin.get("bot_instance")
-    if admin_bot:
-        await notify_new_order_to_staff(admin_bot, order, session)
-
-    return JSONResponse(content={"message": "Замовлення успішно розміщено", "order_id": order.id})
 
 # --- ВЕБ АДМІН-ПАНЕЛЬ ---
 @app.get("/admin", response_class=HTMLResponse)
@@ -856,7 +896,7 @@ async def admin_dashboard(session: AsyncSession = Depends(get_db_session), usern
     active_classes = {key: "" for key in ["orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["main_active"] = "active"
 
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Головна панель", 
         body=body, 
         site_title=settings.site_title or "Назва", # <-- NEW: Pass title
@@ -865,21 +905,19 @@ async def admin_dashboard(session: AsyncSession = Depends(get_db_session), usern
 
 # --- Функція admin_products ---
 @app.get("/admin/products", response_class=HTMLResponse)
-async def admin_products(page: int = Query(1, ge=1), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+async def admin_products(after: Optional[str] = Query(None), before: Optional[str] = Query(None), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     settings = await get_settings(session)
-    per_page = 10
-    offset = (page - 1) * per_page
+    keyset = Keyset([Product.id], lambda p: (p.id,), per_page=10, after=after, before=before)
 
-    query = sa.select(Product).options(joinedload(Product.category)).order_by(Product.id.desc())
+    query = sa.select(Product).options(joinedload(Product.category))
     if q:
-        query = query.where(Product.name.ilike(f"%{q}%"))
-
-    total_res = await session.execute(sa.select(sa.func.count()).select_from(query.subquery()))
-    total = total_res.scalar_one_or_none() or 0
-    products_res = await session.execute(query.limit(per_page).offset(offset))
-    products = products_res.scalars().all()
-
-    pages = (total // per_page) + (1 if total % per_page > 0 else 0)
+        # Пошук: найрелевантніші збіги (індекс pg_trgm) без пагінації
+        products_res = await session.execute(ranked(query, product_search(session, q), Product.id.desc()))
+        page = KeysetPage(products_res.scalars().all())
+    else:
+        products_res = await session.execute(keyset.apply(query))
+        page = keyset.page(products_res.scalars().all())
+    products = page.rows
 
     product_rows = "".join([f"""
     <tr>
@@ -898,13 +936,9 @@ async def admin_products(page: int = Query(1, ge=1), q: str = Query(None, alias=
     categories_res = await session.execute(sa.select(Category))
     category_options = "".join([f'<option value="{c.id}">{html.escape(c.name)}</option>' for c in categories_res.scalars().all()])
     
-    links_products = []
-    for i in range(1, pages + 1):
-        search_part = f'&search={q}' if q else ''
-        class_part = 'active' if i == page else ''
-        links_products.append(f'<a href="/admin/products?page={i}{search_part}" class="{class_part}">{i}</a>')
-    
-    pagination = f"<div class='pagination'>{' '.join(links_products)}</div>"
+    # Загальна кількість - приблизна і лише без пошуку (точний count по всій таблиці не рахуємо)
+    total_label = results_label(len(products)) if q else f"Всього: ≈{await approximate_row_count(session, Product)}"
+    pagination = render_pagination("/admin/products", page, total_label, search=q)
     
     body = f"""
     <div class="card"><h2>📝 Додати нову страву</h2><form action="/admin/add_product" method="post" enctype="multipart/form-data">
@@ -923,18 +957,18 @@ async def admin_products(page: int = Query(1, ge=1), q: str = Query(None, alias=
     <div class="card">
         <h2>🛍️ Список страв</h2>
         <form action="/admin/products" method="get" class="search-form">
-            <input type="text" name="search" placeholder="Пошук за назвою..." value="{q or ''}">
+            <input type="text" name="search" placeholder="Пошук за назвою..." value="{html.escape(q or '')}">
             <button type="submit">🔍 Знайти</button>
         </form>
         <table><thead><tr><th>ID</th><th>Назва</th><th>Ціна</th><th>Категорія</th><th>Цех</th><th>Статус</th><th>Дії</th></tr></thead><tbody>
         {product_rows or "<tr><td colspan='7'>Немає страв</td></tr>"}
-        </tbody></table>{pagination if pages > 1 else ''}
+        </tbody></table>{pagination}
     </div>"""
 
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["products_active"] = "active"
 
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Управління стравами", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -974,6 +1008,7 @@ async def add_product(
         preparation_area=preparation_area # <-- SAVE FIELD
     ))
     await session.commit()
+    bump_menu_version()
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @app.get("/admin/edit_product/{product_id}", response_class=HTMLResponse)
@@ -1019,7 +1054,7 @@ async def get_edit_product_form(product_id: int, session: AsyncSession = Depends
     """
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["products_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Редагування страви", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1065,6 +1100,7 @@ async def edit_product(
             logging.error(f"Не вдалося зберегти нове зображення {path}: {e}")
 
     await session.commit()
+    bump_menu_version()
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @app.get("/admin/product/toggle_active/{product_id}")
@@ -1073,6 +1109,7 @@ async def toggle_product_active(product_id: int, session: AsyncSession = Depends
     if product:
         product.is_active = not product.is_active
         await session.commit()
+        bump_menu_version()
     return RedirectResponse(url="/admin/products", status_code=303)
 
 @app.get("/admin/delete_product/{product_id}")
@@ -1082,6 +1119,7 @@ async def delete_product(product_id: int, session: AsyncSession = Depends(get_db
         image_to_delete = product.image_url
         await session.delete(product)
         await session.commit()
+        bump_menu_version()
         if image_to_delete and os.path.exists(image_to_delete):
             try:
                 os.remove(image_to_delete)
@@ -1152,7 +1190,7 @@ async def admin_categories(session: AsyncSession = Depends(get_db_session), user
 
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["categories_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Категорії", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1176,6 +1214,7 @@ async def add_category(name: str = Form(...),
         show_in_restaurant=show_in_restaurant
     ))
     await session.commit()
+    bump_menu_version()
     return RedirectResponse(url="/admin/categories", status_code=303)
 # --- КІНЕЦЬ add_category ---
 
@@ -1197,6 +1236,7 @@ async def edit_category(cat_id: int,
         elif field in ["show_on_delivery_site", "show_in_restaurant"]:
             setattr(category, field, value.lower() == 'true')
         await session.commit()
+        bump_menu_version()
     return RedirectResponse(url="/admin/categories", status_code=303)
 # --- КІНЕЦЬ edit_category ---
 
@@ -1213,6 +1253,7 @@ async def delete_category(cat_id: int, session: AsyncSession = Depends(get_db_se
 
         await session.delete(category)
         await session.commit()
+        bump_menu_version()
     return RedirectResponse(url="/admin/categories", status_code=303)
 
 
@@ -1240,7 +1281,7 @@ async def admin_menu_items(edit_id: Optional[int] = None, session: AsyncSession
     </tr>
     """ for item in menu_items])
 
-    body = ADMIN_MENU_BODY.format(
+    body = tpl.ADMIN_MENU_BODY.render(
         rows=rows or "<tr><td colspan='6'>Немає пунктів меню</td></tr>",
         form_action=f"/admin/menu/edit/{edit_id}" if item_to_edit else "/admin/menu/add",
         form_title="Редагування пункту" if item_to_edit else "Додати новий пункт",
@@ -1253,7 +1294,7 @@ async def admin_menu_items(edit_id: Optional[int] = None, session: AsyncSession
     )
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["menu_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Сторінки меню", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1295,70 +1336,45 @@ async def delete_menu_item(item_id: int, session: AsyncSession = Depends(get_db_
 
 # --- ОНОВЛЕНИЙ РОУТ ДЛЯ ЗАМОВЛЕНЬ ---
 @app.get("/admin/orders", response_class=HTMLResponse)
-async def admin_orders(page: int = Query(1, ge=1), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
+async def admin_orders(after: Optional[str] = Query(None), before: Optional[str] = Query(None), q: str = Query(None, alias="search"), session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     settings = await get_settings(session)
-    per_page = 15
-    offset = (page - 1) * per_page
-    query = sa.select(Order).options(joinedload(Order.status)).order_by(Order.id.desc())
+    keyset = Keyset([Order.id], lambda o: (o.id,), per_page=15, after=after, before=before)
+    query = sa.select(Order).options(joinedload(Order.status))
     if q:
-        search_term = q.replace('#', '')
-        if search_term.isdigit():
-             query = query.where(sa.or_(Order.id == int(search_term), Order.customer_name.ilike(f"%{q}%"), Order.phone_number.ilike(f"%{q}%")))
-        else:
-             query = query.where(sa.or_(Order.customer_name.ilike(f"%{q}%"), Order.phone_number.ilike(f"%{q}%")))
-
-
-    total_res = await session.execute(sa.select(sa.func.count()).select_from(query.subquery()))
-    total = total_res.scalar_one_or_none() or 0
-    orders_res = await session.execute(query.limit(per_page).offset(offset))
-    orders = orders_res.scalars().all()
-    pages = (total // per_page) + (1 if total % per_page > 0 else 0)
-
-
-    rows = "".join([f"""
-    <tr>
-        <td><a href="/admin/order/manage/{o.id}" title="Керувати замовленням">#{o.id}</a></td>
-        <td>{html.escape(o.customer_name or '')}</td>
-        <td>{html.escape(o.phone_number or '')}</td>
-        <td>{o.total_price} грн</td>
-        <td><span class='status'>{o.status.name if o.status else '-'}</span></td>
-        <td>{html.escape(o.products[:50] + '...' if o.products and len(o.products) > 50 else o.products or '')}</td>
-        <td class='actions'>
-            <a href='/admin/order/manage/{o.id}' class='button-sm' title="Керувати статусом та кур'єром">⚙️ Керувати</a>
-            <a href='/admin/order/edit/{o.id}' class='button-sm' title="Редагувати склад замовлення">✏️ Редагувати</a>
-        </td>
-    </tr>""" for o in orders])
-
-    links_orders = []
-    for i in range(1, pages + 1):
-        search_part = f'&search={q}' if q else ''
-        class_part = 'active' if i == page else ''
-        links_orders.append(f'<a href="/admin/orders?page={i}{search_part}" class="{class_part}">{i}</a>')
-    
-    pagination = f"<div class='pagination'>{' '.join(links_orders)}</div>"
-
-    body = f"""
-    <div class="card">
-        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 1.5rem;">
-            <h2>📋 Список замовлень</h2>
-            <a href="/admin/order/new" class="button"><i class="fa-solid fa-plus"></i> Створити замовлення</a>
-        </div>
-        <form action="/admin/orders" method="get" class="search-form">
-            <input type="text" name="search" placeholder="Пошук за ID, іменем, телефоном..." value="{q or ''}">
-            <button type="submit">🔍 Знайти</button>
-        </form>
-        <table><thead><tr><th>ID</th><th>Клієнт</th><th>Телефон</th><th>Сума</th><th>Статус</th><th>Склад</th><th>Дії</th></tr></thead><tbody>
-        {rows or "<tr><td colspan='7'>Немає замовлень</td></tr>"}
-        </tbody></table>{pagination if pages > 1 else ''}
-    </div>"""
+        # Пошук за #id, іменем або телефоном у будь-якому форматі, за релевантністю
+        orders_res = await session.execute(ranked(query, order_search(session, q), Order.id.desc()))
+        page = KeysetPage(orders_res.scalars().all())
+    else:
+        orders_res = await session.execute(keyset.apply(query))
+        page = keyset.page(orders_res.scalars().all())
+    orders = page.rows
+
+    # Рядки генеруються ліниво і віддаються потоком разом зі сторінкою
+    rows = (tpl.ADMIN_ORDER_ROW.render(
+        order_id=o.id,
+        customer_name=html.escape(o.customer_name or ''),
+        phone_number=html.escape(o.phone_number or ''),
+        total_price=o.total_price,
+        status_name=o.status.name if o.status else '-',
+        products=html.escape(o.products[:50] + '...' if o.products and len(o.products) > 50 else o.products or ''),
+    ) for o in orders) if orders else "<tr><td colspan='7'>Немає замовлень</td></tr>"
+
+    total_label = results_label(len(orders)) if q else f"Всього: ≈{await approximate_row_count(session, Order)}"
+    pagination = render_pagination("/admin/orders", page, total_label, search=q)
+
+    body = tpl.ADMIN_ORDERS_BODY.iter_render(
+        search_query=html.escape(q or ''),
+        rows=rows,
+        pagination=pagination
+    )
     active_classes = {key: "" for key in ["main_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["orders_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return StreamingResponse(tpl.ADMIN_HTML_TEMPLATE.iter_render(
         title="Замовлення", 
         body=body, 
         site_title=settings.site_title or "Назва",
         **active_classes
-    ))
+    ), media_type="text/html")
 # ----------------------------------------
 
 @app.get("/admin/statuses", response_class=HTMLResponse)
@@ -1474,7 +1490,7 @@ async def admin_statuses(error: Optional[str] = None, session: AsyncSession = De
     """
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["statuses_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Статуси замовлень", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1510,6 +1526,10 @@ async def add_status(
     )
     session.add(new_status)
     await session.commit()
+    invalidate_reference_cache()
+    if (new_status.is_completed_status or new_status.is_cancelled_status
+            or new_status.visible_to_chef or new_status.visible_to_bartender):
+        schedule_order_index_sync(engine)
     return RedirectResponse(url="/admin/statuses", status_code=303)
 
 @app.post("/admin/edit_status/{status_id}")
@@ -1538,6 +1558,13 @@ async def edit_status(
         setattr(status_to_edit, field, value.lower() == 'true')
 
     await session.commit()
+    invalidate_reference_cache()
+    if field == "is_completed_status":
+        # Змінився набір виконаних статусів - зведення звітів перераховуються з нуля у фоні
+        schedule_rollup_rebuild(async_session_maker)
+    if field in ("is_completed_status", "is_cancelled_status", "visible_to_chef", "visible_to_bartender"):
+        # Предикати часткових індексів залежать від фінальних статусів і статусів екранів цехів
+        schedule_order_index_sync(engine)
     return RedirectResponse(url="/admin/statuses", status_code=303)
 
 
@@ -1548,6 +1575,8 @@ async def delete_status(status_id: int, session: AsyncSession = Depends(get_db_s
         try:
             await session.delete(status_to_delete)
             await session.commit()
+            invalidate_reference_cache()
+            schedule_order_index_sync(engine)
         except IntegrityError: # Catch the specific database error
             logging.warning(f"Attempted to delete status {status_id} which is in use.")
             return RedirectResponse(url="/admin/statuses?error=in_use", status_code=303) # Redirect with error flag
@@ -1621,7 +1650,7 @@ async def admin_roles(session: AsyncSession = Depends(get_db_session), username:
     """
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["employees_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Ролі співробітників", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1645,6 +1674,7 @@ async def add_role(name: str = Form(...),
                     can_receive_bar_orders=bool(can_receive_bar_orders)) # <--- SAVE NEW FIELD
     session.add(new_role)
     await session.commit()
+    invalidate_reference_cache()
     return RedirectResponse(url="/admin/roles", status_code=303)
 
 
@@ -1686,7 +1716,7 @@ async def get_edit_role_form(role_id: int, session: AsyncSession = Depends(get_d
     </div>"""
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["employees_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Редагування ролі", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1704,6 +1734,7 @@ async def edit_role(role_id: int, name: str = Form(...), can_manage_orders: Opti
         role.can_receive_kitchen_orders = bool(can_receive_kitchen_orders)
         role.can_receive_bar_orders = bool(can_receive_bar_orders) # <--- SAVE NEW FIELD
         await session.commit()
+        invalidate_reference_cache()
     return RedirectResponse(url="/admin/roles", status_code=303)
 
 
@@ -1722,6 +1753,7 @@ async def delete_role(role_id: int, session: AsyncSession = Depends(get_db_sessi
 
             await session.delete(role)
             await session.commit()
+            invalidate_reference_cache()
         except IntegrityError: # Fallback, though the check above should prevent this
             logging.error(f"IntegrityError deleting role {role_id}, likely still in use.")
             raise HTTPException(status_code=400, detail="Неможливо видалити роль, оскільки до неї прив'язані співробітники.")
@@ -1758,10 +1790,10 @@ async def admin_employees(session: AsyncSession = Depends(get_db_session), usern
     if not rows:
         rows = '<tr><td colspan="7">Немає співробітників</td></tr>'
 
-    body = ADMIN_EMPLOYEE_BODY.format(role_options=role_options, rows=rows)
+    body = tpl.ADMIN_EMPLOYEE_BODY.render(role_options=role_options, rows=rows)
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["employees_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Співробітники", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1809,7 +1841,7 @@ async def get_edit_employee_form(employee_id: int, session: AsyncSession = Depen
     </div>"""
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["employees_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Редагування співробітника", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1842,7 +1874,7 @@ async def delete_employee(employee_id: int, session: AsyncSession = Depends(get_
     if employee:
         # Prevent deleting if assigned to orders or tables? (Optional check)
         # Check active orders assigned (courier)
-        active_orders_count_res = await session.execute(sa.select(func.count(Order.id)).where(Order.courier_id == employee_id, Order.status.has(OrderStatus.is_completed_status == False), Order.status.has(OrderStatus.is_cancelled_status == False) ))
+        active_orders_count_res = await session.execute(sa.select(func.count(Order.id)).where(Order.courier_id == employee_id, open_orders_filter(await final_status_ids(session))))
         active_orders_count = active_orders_count_res.scalar_one_or_none() or 0
 
         # Check assigned tables (waiter) - need to load relationship
@@ -1859,99 +1891,13 @@ async def delete_employee(employee_id: int, session: AsyncSession = Depends(get_
     return RedirectResponse(url="/admin/employees", status_code=303)
 
 
-@app.get("/admin/reports", response_class=HTMLResponse)
-async def admin_reports_menu(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)): # Added session
-    settings = await get_settings(session)
-    body = """
-    <div class="card">
-        <h2>Доступні звіти</h2>
-        <ul>
-            <li><a href="/admin/reports/couriers">Звіт по замовленнях кур'єрів</a></li>
-            </ul>
-    </div>
-    """
-    active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "settings_active", "design_active"]}
-    active_classes["reports_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
-        title="Звіти", 
-        body=body, 
-        site_title=settings.site_title or "Назва",
-        **active_classes
-    ))
-
-@app.get("/admin/reports/couriers", response_class=HTMLResponse)
-async def report_couriers(
-    date_from_str: str = Query(None, alias="date_from"),
-    date_to_str: str = Query(None, alias="date_to"),
-    session: AsyncSession = Depends(get_db_session),
-    username: str = Depends(check_credentials)
-):
-    settings = await get_settings(session)
-    report_data = []
-    # Default date range to last 7 days including today
-    date_to = datetime.strptime(date_to_str, "%Y-%m-%d").date() if date_to_str else date.today()
-    date_from = datetime.strptime(date_from_str, "%Y-%m-%d").date() if date_from_str else date_to - timedelta(days=6) # 6 days before + today = 7 days
-
-
-    completed_status_res = await session.execute(
-        sa.select(OrderStatus.id).where(OrderStatus.is_completed_status == True) # Select all completed statuses
-    )
-    completed_status_ids = completed_status_res.scalars().all()
-
-    if completed_status_ids:
-        # Ensure dates are inclusive by adding one day to date_to for the comparison
-        date_to_inclusive = date_to + timedelta(days=1)
-        report_query = (
-            sa.select(
-                Employee.full_name,
-                func.count(Order.id).label("completed_orders")
-            )
-            .join(Employee, Order.completed_by_courier_id == Employee.id) # Use completed_by_courier_id
-            .where(
-                and_(
-                    Order.created_at >= date_from, # Use >= for start date
-                    Order.created_at < date_to_inclusive, # Use < for end date + 1 day
-                    Order.status_id.in_(completed_status_ids) # Check against all completed statuses
-                )
-            )
-            .group_by(Employee.full_name)
-            .order_by(func.count(Order.id).desc())
-        )
-        result = await session.execute(report_query)
-        report_data = result.all() # Fetch all results
-
-    report_rows = "".join([f'<tr><td>{html.escape(row.full_name)}</td><td>{row.completed_orders}</td></tr>' for row in report_data])
-    if not report_data and (date_from_str or date_to_str): # Show message only if dates were selected
-        report_rows = '<tr><td colspan="2">Немає даних за вибраний період.</td></tr>'
-    elif not report_data:
-         report_rows = '<tr><td colspan="2">Оберіть період та сформуйте звіт (за замовчуванням останні 7 днів).</td></tr>'
-
-
-    body = ADMIN_REPORTS_BODY.format(
-        date_from=date_from.strftime("%Y-%m-%d"),
-        date_to=date_to.strftime("%Y-%m-%d"),
-        date_from_formatted=date_from.strftime("%d.%m.%Y"),
-        date_to_formatted=date_to.strftime("%d.%m.%Y"),
-        report_rows=report_rows
-    )
-    active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "settings_active", "design_active"]}
-    active_classes["reports_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
-        title="Звіт по кур'єрах", 
-        body=body, 
-        site_title=settings.site_title or "Назва",
-        **active_classes
-    ))
-
-
-
 @app.get("/admin/settings", response_class=HTMLResponse)
 async def admin_settings(session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     settings = await get_settings(session)
 
     current_logo_html = f'<p>Поточне лого: <img src="/{settings.logo_url}" class="table-img"></p>' if settings.logo_url else '<p>Логотип не завантажено.</p>'
 
-    body = ADMIN_SETTINGS_BODY.format(
+    body = tpl.ADMIN_SETTINGS_BODY.render(
         client_bot_token="", # os.environ.get('CLIENT_BOT_TOKEN') - НЕ ПОКАЗУВАТИ В HTML!
         admin_bot_token="", # os.environ.get('ADMIN_BOT_TOKEN') - НЕ ПОКАЗУВАТИ В HTML!
         admin_chat_id="",   # os.environ.get('ADMIN_CHAT_ID') - НЕ ПОКАЗУВАТИ В HTML!
@@ -1960,7 +1906,7 @@ async def admin_settings(session: AsyncSession = Depends(get_db_session), userna
     )
     active_classes = {key: "" for key in ["main_active", "orders_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "design_active"]}
     active_classes["settings_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Налаштування", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -1974,7 +1920,7 @@ async def save_admin_settings(session: AsyncSession = Depends(get_db_session), u
                                apple_touch_icon: UploadFile = File(None), favicon_32x32: UploadFile = File(None),
                                favicon_16x16: UploadFile = File(None), favicon_ico: UploadFile = File(None),
                                site_webmanifest: UploadFile = File(None)):
-    settings = await get_settings(session)
+    settings = await _get_or_create_settings(session)
     
     if logo_file and logo_file.filename:
         if settings.logo_url and os.path.exists(settings.logo_url):
@@ -2016,12 +1962,22 @@ async def save_admin_settings(session: AsyncSession = Depends(get_db_session), u
                 logging.error(f"Не вдалося зберегти favicon {filename}: {e}")
 
     await session.commit()
+    invalidate_reference_cache()
     return RedirectResponse(url="/admin/settings?saved=true", status_code=303)
 # --- КІНЕЦЬ save_admin_settings ---
 
 
 # --- Функція get_settings оновлена ---
-async def get_settings(session: AsyncSession) -> Settings:
+async def get_settings(session: AsyncSession) -> SettingsRef:
+    """Налаштування для відображення (з кешу довідників, без запиту до БД)."""
+    settings = await get_cached_settings(session)
+    if not settings.telegram_welcome_message:
+        settings = dataclasses.replace(settings, telegram_welcome_message=f"Шановний {{user_name}}, ласкаво просимо! 👋\n\nМи раді вас бачити. Оберіть опцію:")
+    return settings
+
+
+async def _get_or_create_settings(session: AsyncSession) -> Settings:
+    """ORM-об'єкт налаштувань для змін; створює рядок, якщо його ще немає."""
     settings = await session.get(Settings, 1) # Use get() for primary key lookup
     if not settings:
         settings = Settings(id=1) # Initialize with ID
@@ -2034,11 +1990,6 @@ async def get_settings(session: AsyncSession) -> Settings:
             logging.error(f"Не вдалося створити початкові налаштування: {e}")
             await session.rollback()
             return Settings(id=1) # Return an empty settings object
-    
-    # NEW: Populate default welcome message if empty
-    if not settings.telegram_welcome_message:
-        settings.telegram_welcome_message = f"Шановний {{user_name}}, ласкаво просимо! 👋\n\nМи раді вас бачити. Оберіть опцію:"
-
     return settings
 # --- КІНЕЦЬ get_settings ---
 
@@ -2082,7 +2033,7 @@ async def get_add_order_form(session: AsyncSession = Depends(get_db_session), us
     body = ADMIN_ORDER_FORM_BODY + script_data_injection
     active_classes = {key: "" for key in ["main_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["orders_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title="Нове замовлення", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -2092,17 +2043,13 @@ async def get_add_order_form(session: AsyncSession = Depends(get_db_session), us
 @app.get("/admin/order/edit/{order_id}", response_class=HTMLResponse)
 async def get_edit_order_form(order_id: int, session: AsyncSession = Depends(get_db_session), username: str = Depends(check_credentials)):
     settings = await get_settings(session)
-    order = await session.get(Order, order_id)
+    order = await session.get(Order, order_id, options=[selectinload(Order.items)])
     if not order: raise HTTPException(404, "Замовлення не знайдено")
 
-    products_dict = parse_products_string(order.products)
     initial_items = {}
-    if products_dict:
-        products_res = await session.execute(sa.select(Product).where(Product.name.in_(list(products_dict.keys()))))
-        db_products_map = {p.name: p for p in products_res.scalars().all()}
-        for name, quantity in products_dict.items():
-            if p := db_products_map.get(name):
-                initial_items[p.id] = {"name": p.name, "price": p.price, "quantity": quantity}
+    for item in order.items:
+        if item.product_id is not None:
+            initial_items[item.product_id] = {"name": item.name, "price": item.price, "quantity": item.quantity}
 
     initial_data = {
         "items": initial_items,
@@ -2135,7 +2082,7 @@ async def get_edit_order_form(order_id: int, session: AsyncSession = Depends(get
     body = ADMIN_ORDER_FORM_BODY + script_injection
     active_classes = {key: "" for key in ["main_active", "clients_active", "tables_active", "products_active", "categories_active", "menu_active", "employees_active", "statuses_active", "reports_active", "settings_active", "design_active"]}
     active_classes["orders_active"] = "active"
-    return HTMLResponse(ADMIN_HTML_TEMPLATE.format(
+    return HTMLResponse(tpl.ADMIN_HTML_TEMPLATE.render(
         title=f"Редагування замовлення #{order.id}", 
         body=body, 
         site_title=settings.site_title or "Назва",
@@ -2146,82 +2093,38 @@ async def get_edit_order_form(order_id: int, session: AsyncSession = Depends(get
 async def _process_and_save_order(order: Order, data: dict, session: AsyncSession):
     """
     Обробляє та зберігає дані замовлення, отримані з веб-інтерфейсу адміністратора.
+    Нове замовлення оформлюється через place_order; існуюче - оновлюється на місці.
     """
-    is_new_order = order.id is None
-    actor_info = "Адміністративна панель"
+    is_delivery = data.get("delivery_type") == "delivery"
+    # Позиції з форми: {"<product_id>": {"quantity": N}}
+    lines = [
+        {"product_id": pid, "quantity": item_data.get("quantity", 0)}
+        for pid, item_data in data.get("items", {}).items() if str(pid).isdigit()
+    ]
+
+    if order.id is None:
+        await place_order(session, OrderRequest(
+            lines=lines,
+            actor_info="Адміністративна панель",
+            customer_name=data.get("customer_name"), phone_number=data.get("phone_number"),
+            address=data.get("address"), is_delivery=is_delivery,
+            order_type="delivery" if is_delivery else "pickup",
+            allow_inactive=True,
+        ))
+        return
 
     order.customer_name = data.get("customer_name")
     order.phone_number = data.get("phone_number")
-    order.is_delivery = data.get("delivery_type") == "delivery"
-    order.address = data.get("address") if order.is_delivery else None
-    order.order_type = "delivery" if order.is_delivery else "pickup"
-
-
-    items_from_js = data.get("items", {})
-
-    if not items_from_js:
-        order.products = ""
-        order.total_price = 0
-    else:
-        valid_product_ids = [int(pid) for pid in items_from_js.keys() if pid.isdigit()]
-
-        if not valid_product_ids:
-            order.products = ""
-            order.total_price = 0
-        else:
-            products_res = await session.execute(sa.select(Product).where(Product.id.in_(valid_product_ids)))
-            db_products_map = {p.id: p for p in products_res.scalars().all()}
-
-            total_price = 0
-            product_strings = []
-
-            for pid_str, item_data in items_from_js.items():
-                if not pid_str.isdigit(): continue # Skip non-numeric keys
-                pid = int(pid_str)
-                if product := db_products_map.get(pid):
-                    try:
-                         quantity = int(item_data.get('quantity', 0))
-                    except (ValueError, TypeError):
-                         quantity = 0 # Default to 0 if quantity is invalid
-
-                    if quantity > 0:
-                        total_price += product.price * quantity
-                        product_strings.append(f"{product.name} x {quantity}")
-
-            order.products = ", ".join(product_strings)
-            order.total_price = total_price
-
-    if is_new_order:
-        session.add(order)
-        if not order.status_id:
-            new_status_res = await session.execute(sa.select(OrderStatus.id).where(OrderStatus.name == "Новий").limit(1))
-            new_status_id = new_status_res.scalar_one_or_none() or 1 # Default to 1 if not found
-            order.status_id = new_status_id
-
-
-    await session.commit() # Commit changes for both new and existing orders
-    await session.refresh(order) # Refresh to get ID and updated timestamp
-
-    if is_new_order:
-        try:
-             history_entry = OrderStatusHistory(
-                 order_id=order.id, # Use the generated ID
-                 status_id=order.status_id,
-                 actor_info=actor_info
-             )
-             session.add(history_entry)
-             await session.commit() # Commit history separately
-             logging.info(f"Створено запис історії для нового замовлення #{order.id}")
-        except Exception as e:
-             logging.error(f"Не вдалося створити запис історії для замовлення #{order.id}: {e}")
-             await session.rollback() # Rollback history commit if it fails
-
-
-        admin_bot = dp_admin.get("bot_instance")
-        if admin_bot:
-            await notify_new_order_to_staff(admin_bot, order, session)
-    else:
-         logging.info(f"Замовлення #{order.id} оновлено через веб-панель.")
+    order.is_delivery = is_delivery
+    order.address = data.get("address") if is_delivery else None
+    order.order_type = "delivery" if is_delivery else "pickup"
+
+    # Страви, яких уже немає в каталозі, відкидаються (як і раніше при редагуванні)
+    order_items = await build_order_items(session, lines, allow_inactive=True, skip_unavailable=True)
+    # Оновлює order.items, order.products та order.total_price
+    await replace_order_items(session, order, order_items)
+    await session.commit()
+    logging.info(f"Замовлення #{order.id} оновлено через веб-панель.")
 
 
 @app.post("/api/admin/order/new", response_class=JSONResponse)
@@ -2235,6 +2138,8 @@ async def api_create_order(request: Request, session: AsyncSession = Depends(get
     try:
         await _process_and_save_order(new_order, data, session)
         return JSONResponse(content={"message": "Замовлення створено успішно", "redirect_url": "/admin/orders"})
+    except OrderValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Помилка при створенні замовлення через API: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Не вдалося створити замовлення")
@@ -2246,11 +2151,13 @@ async def api_update_order(order_id: int, request: Request, session: AsyncSessio
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Недійсний JSON")
 
-    order = await session.get(Order, order_id)
+    order = await session.get(Order, order_id, options=[selectinload(Order.items)])
     if not order: raise HTTPException(404, "Замовлення не знайдено")
     try:
         await _process_and_save_order(order, data, session)
         return JSONResponse(content={"message": "Замовлення оновлено успішно", "redirect_url": "/admin/orders"})
+    except OrderValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Помилка при оновленні замовлення #{order_id} через API: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Не вдалося оновити замовлення")
@@ -0,0 +1,128 @@
+# menu_cache.py
+import asyncio
+import json
+import logging
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+# Лічильник версії меню. Збільшується адмін-ендпоінтами після кожного commit,
+# що змінює категорії або страви.
+_menu_version = 0
+_snapshot: Optional["MenuSnapshot"] = None
+_rebuild_lock = asyncio.Lock()
+
+
+class MenuSnapshot:
+    """
+    Незмінний знімок меню в пам'яті процесу.
+    Дані вже розділені за прапорцями видимості категорій:
+    - delivery: show_on_delivery_site (сайт /api/menu та Telegram-бот)
+    - restaurant: show_in_restaurant (QR-меню столика)
+    """
+    def __init__(self, version: int, categories: List[Dict[str, Any]], products: List[Dict[str, Any]]):
+        self.version = version
+        self.categories_by_id = {c["id"]: c for c in categories}
+
+        delivery_categories = [c for c in categories if c["show_on_delivery_site"]]
+        restaurant_categories = [c for c in categories if c["show_in_restaurant"]]
+        delivery_ids = {c["id"] for c in delivery_categories}
+        restaurant_ids = {c["id"] for c in restaurant_categories}
+
+        def _public(p: Dict[str, Any]) -> Dict[str, Any]:
+            return {k: p[k] for k in ("id", "name", "description", "price", "image_url", "category_id")}
+
+        self.delivery = {
+            "categories": [{"id": c["id"], "name": c["name"]} for c in delivery_categories],
+            "products": [_public(p) for p in products if p["category_id"] in delivery_ids],
+        }
+        self.restaurant = {
+            "categories": [{"id": c["id"], "name": c["name"]} for c in restaurant_categories],
+            "products": [_public(p) for p in products if p["category_id"] in restaurant_ids],
+        }
+        # Готові JSON-рядки, щоб не серіалізувати меню на кожен запит
+        self.delivery_json = json.dumps(self.delivery)
+        self.restaurant_json = json.dumps(self.restaurant)
+
+        # Для Telegram-каталогу: активні страви кожної категорії, відсортовані за назвою
+        self.products_by_category: Dict[int, List[Dict[str, Any]]] = {}
+        for p in sorted(products, key=lambda p: p["name"]):
+            self.products_by_category.setdefault(p["category_id"], []).append(p)
+
+    @property
+    def delivery_categories(self) -> List[Dict[str, Any]]:
+        return self.delivery["categories"]
+
+    @property
+    def restaurant_categories(self) -> List[Dict[str, Any]]:
+        return self.restaurant["categories"]
+
+
+def bump_menu_version() -> int:
+    """Позначає знімок меню застарілим. Викликається після commit змін меню."""
+    global _menu_version
+    _menu_version += 1
+    return _menu_version
+
+
+def get_menu_version() -> int:
+    return _menu_version
+
+
+async def _load_snapshot(session: AsyncSession, version: int) -> MenuSnapshot:
+    categories_res = await session.execute(
+        select(Category).order_by(Category.sort_order, Category.name)
+    )
+    products_res = await session.execute(
+        select(Product).where(Product.is_active == True).order_by(Product.id)
+    )
+    categories = [
+        {
+            "id": c.id,
+            "name": c.name,
+            "sort_order": c.sort_order,
+            "show_on_delivery_site": c.show_on_delivery_site,
+            "show_in_restaurant": c.show_in_restaurant,
+        }
+        for c in categories_res.scalars().all()
+    ]
+    products = [
+        {
+            "id": p.id,
+            "name": p.name,
+            "description": p.description,
+            "price": p.price,
+            "image_url": p.image_url,
+            "category_id": p.category_id,
+            "preparation_area": p.preparation_area,
+        }
+        for p in products_res.scalars().all()
+    ]
+    return MenuSnapshot(version, categories, products)
+
+
+async def get_menu_snapshot(session: AsyncSession) -> MenuSnapshot:
+    """
+    Повертає актуальний знімок меню. БД читається лише тоді, коли версія
+    змінилася з моменту останньої побудови знімка.
+    """
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == _menu_version:
+        return snapshot
+
+    async with _rebuild_lock:
+        # Інший запит міг уже перебудувати знімок, поки ми чекали на lock
+        snapshot = _snapshot
+        version = _menu_version
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        snapshot = await _load_snapshot(session, version)
+        _snapshot = snapshot
+        logger.info(f"Знімок меню перебудовано (версія {version}).")
+        return snapshot
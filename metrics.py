@@ -0,0 +1,281 @@
+# metrics.py
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import Order, NotificationOutbox
+from pool_metrics import pool_snapshot
+from reference_cache import all_statuses, final_status_ids
+from db_indexes import open_orders_filter
+from profiling import route_name
+
+logger = logging.getLogger(__name__)
+
+# Метрики в форматі Prometheus text exposition 0.0.4 без зовнішніх залежностей.
+# Запис - це інкремент під локом у пам'яті процесу; важкі значення (кількість
+# активних замовлень, глибина черги) рахуються лише під час scrape і кешуються.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Захист від вибуху кардинальності: нові набори міток понад ліміт зводяться в "other"
+MAX_SERIES_PER_METRIC = int(os.environ.get("METRICS_MAX_SERIES", "500"))
+# Як часто (с) перераховувати значення, що вимагають запитів до БД
+DB_GAUGES_TTL = float(os.environ.get("METRICS_DB_GAUGES_TTL", "10"))
+
+_ORDERS_CREATED_KEY = "metrics_orders_created"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        if key not in self._series and len(self._series) >= MAX_SERIES_PER_METRIC:
+            return tuple("other" for _ in self.label_names)
+        return key
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = list(self._series.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in series]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def replace(self, values: Dict[Tuple[str, ...], float]):
+        """Повністю замінює набір серій (для значень, що перераховуються при scrape)."""
+        with self._lock:
+            self._series = dict(values)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = list(self._series.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in series]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # [лічильники по кошиках (не кумулятивні), сума, кількість]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        lines = self.header()
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Час обробки HTTP-запиту", ("method", "route", "status"))
+bot_handler_duration = Histogram(
+    "bot_handler_duration_seconds", "Час обробки оновлення Telegram за префіксом колбеку", ("bot", "handler"))
+telegram_api_requests = Counter(
+    "telegram_api_requests_total", "Виклики Bot API за методом і результатом", ("method", "outcome"))
+telegram_messages = Counter(
+    "telegram_messages_total", "Розсилка повідомлень персоналу: sent, failed, retry", ("result",))
+orders_created = Counter("orders_created_total", "Створені замовлення за типом", ("order_type",))
+order_replays = Counter(
+    "order_idempotent_replays_total", "Повтори оформлення з тим самим ключем ідемпотентності", ("endpoint", "source"))
+orders_active = Gauge("orders_active", "Активні (не фінальні) замовлення за статусом", ("status",))
+outbox_depth = Gauge("notification_outbox_depth", "Рядки черги сповіщень за станом", ("state",))
+db_pool = Gauge("db_pool_connections", "З'єднання пулу БД за станом", ("state",))
+db_pool_events = Gauge("db_pool_events", "Накопичені події пулу БД (checkouts, waits, timeouts)", ("event",))
+rate_limited = Counter("rate_limited_requests_total", "Публічні запити, відхилені лімітом (429)", ("limit",))
+rate_limit_config = Gauge(
+    "rate_limit_config", "Налаштовані ліміти: capacity - запитів поспіль, period_seconds - повне відновлення", ("limit", "param"))
+coalesced_calls = Counter(
+    "coalesced_table_calls_total", "Повторні виклики зі столика, об'єднані в одне сповіщення", ("action",))
+
+REGISTRY: List[_Metric] = [
+    http_request_duration, bot_handler_duration, telegram_api_requests, telegram_messages,
+    orders_created, order_replays, orders_active, outbox_depth, db_pool, db_pool_events,
+    rate_limited, rate_limit_config, coalesced_calls,
+]
+
+_db_gauges_at = 0.0
+
+
+def callback_prefix(data: Optional[str]) -> str:
+    """Префікс callback_data без id: 'chef_ready_15' -> 'chef_ready_', 'show_category_3_1' -> 'show_category_'."""
+    if not data:
+        return ""
+    return re.sub(r"(?<=_)[-\d_]+$", "", data)
+
+
+class HttpMetricsMiddleware:
+    """ASGI-middleware: гістограма затримок за шаблоном маршруту і статусом."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            method, route = route_name(scope).split(" ", 1)
+            http_request_duration.observe(
+                time.perf_counter() - started, method=method, route=route, status=status["code"]
+            )
+
+
+class HandlerMetricsMiddleware:
+    """aiogram-middleware: затримка обробника за префіксом колбеку (або 'message')."""
+    def __init__(self, bot_label: str):
+        self.bot_label = bot_label
+
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            callback_data = getattr(event, "data", None)
+            name = callback_prefix(callback_data) if callback_data is not None else type(event).__name__.lower()
+            bot_handler_duration.observe(time.perf_counter() - started, bot=self.bot_label, handler=name)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сесії aiogram: лічильник викликів Bot API за методом і результатом (ok або клас помилки)."""
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, "__api_method__", type(method).__name__)
+        try:
+            result = await make_request(bot, method)
+        except Exception as e:
+            telegram_api_requests.inc(method=api_method, outcome=type(e).__name__)
+            raise
+        telegram_api_requests.inc(method=api_method, outcome="ok")
+        return result
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_created_orders(session, flush_context):
+    created = [obj.order_type or "delivery" for obj in session.new if isinstance(obj, Order)]
+    if created:
+        session.info.setdefault(_ORDERS_CREATED_KEY, []).extend(created)
+
+
+@event.listens_for(Session, "after_commit")
+def _count_created_orders(session):
+    for order_type in session.info.pop(_ORDERS_CREATED_KEY, ()):
+        orders_created.inc(order_type=order_type)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_created_orders(session):
+    session.info.pop(_ORDERS_CREATED_KEY, None)
+
+
+async def _refresh_db_gauges(session: AsyncSession, engine):
+    global _db_gauges_at
+    snapshot = pool_snapshot(engine)
+    db_pool.replace({
+        (state,): snapshot[state] for state in ("size", "checkedin", "checkedout", "overflow") if state in snapshot
+    })
+    stats = snapshot["stats"]
+    db_pool_events.replace({(name,): stats[name] for name in ("checkouts", "waits", "timeouts")})
+
+    now = time.monotonic()
+    if now - _db_gauges_at < DB_GAUGES_TTL:
+        return
+    _db_gauges_at = now
+
+    names = {s.id: s.name for s in await all_statuses(session)}
+    finals = await final_status_ids(session)
+    active_res = await session.execute(
+        sa.select(Order.status_id, sa.func.count()).where(open_orders_filter(finals)).group_by(Order.status_id)
+    )
+    counts = {(name,): 0 for status_id, name in names.items() if status_id not in finals}
+    for status_id, count in active_res.all():
+        counts[(names.get(status_id, str(status_id)),)] = count
+    orders_active.replace(counts)
+
+    outbox_res = await session.execute(
+        sa.select(NotificationOutbox.status, sa.func.count()).group_by(NotificationOutbox.status)
+    )
+    outbox_depth.replace({("pending",): 0, **{(state,): count for state, count in outbox_res.all()}})
+
+
+async def render_metrics(session: AsyncSession, engine) -> str:
+    try:
+        await _refresh_db_gauges(session, engine)
+    except Exception as e:
+        # Недоступна БД не повинна ламати віддачу решти метрик
+        logger.error(f"Не вдалося оновити метрики з БД: {e}")
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -5,17 +5,48 @@ from sqlalchemy.orm import sessionmaker, DeclarativeBase, Mapped, mapped_column,
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy import event, text, func, ForeignKey
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, date
 import secrets
 import os
 
+from pool_metrics import InstrumentedAsyncQueuePool, install_pool_metrics
+from profiling import install_query_profiling
+
 # Читання DATABASE_URL з змінних оточення
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if not DATABASE_URL:
     # Ця помилка зупинить запуск, якщо DATABASE_URL не встановлено
     raise ValueError("Помилка: Змінна оточення DATABASE_URL не встановлена.")
 
-engine = create_async_engine(DATABASE_URL)
+
+# --- Налаштування пулу з'єднань (зі змінних оточення) ---
+# Значення за замовчуванням збігаються зі стандартними значеннями SQLAlchemy.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '-1'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'false').lower() in ('1', 'true', 'yes')
+# Кеш prepared statements asyncpg (0 - вимкнено, потрібно для PgBouncer у режимі transaction)
+DB_STATEMENT_CACHE_SIZE = os.environ.get('DB_STATEMENT_CACHE_SIZE')
+
+
+def _engine_options(url: str) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if not url.startswith("sqlite"):
+        options.update(
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    if "asyncpg" in url and DB_STATEMENT_CACHE_SIZE is not None:
+        options["connect_args"] = {"statement_cache_size": int(DB_STATEMENT_CACHE_SIZE)}
+    return options
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+install_pool_metrics(engine)
+install_query_profiling(engine)
 
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
@@ -135,6 +166,14 @@ class OrderStatus(Base):
 
 class Order(Base):
     __tablename__ = 'orders'
+    # Гарячі фільтри (екрани кухні/бару, замовлення клієнта, звіти).
+    # Часткові індекси активних замовлень створює db_indexes.py.
+    __table_args__ = (
+        sa.Index('ix_orders_status_id_id', 'status_id', 'id'),
+        sa.Index('ix_orders_user_id_id', 'user_id', 'id'),
+        sa.Index('ix_orders_created_at', 'created_at'),
+        sa.Index('ix_orders_completed_by_courier_created', 'completed_by_courier_id', 'created_at'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[Optional[int]] = mapped_column(sa.BigInteger, nullable=True)
     username: Mapped[Optional[str]] = mapped_column(sa.String(100), nullable=True)
@@ -153,7 +192,9 @@ class Order(Base):
     completed_by_courier_id: Mapped[Optional[int]] = mapped_column(sa.ForeignKey('employees.id'), nullable=True)
 
     completed_by_courier: Mapped[Optional["Employee"]] = relationship("Employee", foreign_keys="Order.completed_by_courier_id")
-    history: Mapped[list["OrderStatusHistory"]] = relationship("OrderStatusHistory", back_populates="order", cascade="all, delete-orphan", lazy='selectin')
+    # Важкі колекції не вантажаться неявно: кожен запит явно вказує selectinload/joinedload,
+    # звернення без цього - помилка (а не прихований додатковий запит на кожне замовлення)
+    history: Mapped[list["OrderStatusHistory"]] = relationship("OrderStatusHistory", back_populates="order", cascade="all, delete-orphan", lazy='raise')
     
     table_id: Mapped[Optional[int]] = mapped_column(sa.ForeignKey('tables.id'), nullable=True)
     table: Mapped[Optional["Table"]] = relationship("Table", back_populates="orders")
@@ -164,6 +205,24 @@ class Order(Base):
     accepted_by_waiter_id: Mapped[Optional[int]] = mapped_column(sa.ForeignKey('employees.id'), nullable=True)
     accepted_by_waiter: Mapped[Optional["Employee"]] = relationship("Employee", back_populates="accepted_orders", foreign_keys="Order.accepted_by_waiter_id")
 
+    # Структурований склад замовлення (рядок products лишається для відображення)
+    items: Mapped[List["OrderItem"]] = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan", order_by="OrderItem.id", lazy='raise')
+
+
+# Позиції замовлення зі знімком назви, ціни та цеху на момент оформлення
+class OrderItem(Base):
+    __tablename__ = 'order_items'
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(ForeignKey('orders.id', ondelete="CASCADE"), nullable=False, index=True)
+    product_id: Mapped[Optional[int]] = mapped_column(ForeignKey('products.id', ondelete="SET NULL"), nullable=True, index=True)
+    name: Mapped[str] = mapped_column(sa.String(100), nullable=False)
+    price: Mapped[int] = mapped_column(nullable=False)
+    quantity: Mapped[int] = mapped_column(nullable=False, default=1)
+    # 'kitchen' - Кухня, 'bar' - Бар
+    preparation_area: Mapped[str] = mapped_column(sa.String(20), default='kitchen', server_default=text("'kitchen'"), nullable=False)
+
+    order: Mapped["Order"] = relationship("Order", back_populates="items")
+
 
 # Таблиця для історії статусів
 class OrderStatusHistory(Base):
@@ -175,7 +234,38 @@ class OrderStatusHistory(Base):
     timestamp: Mapped[datetime] = mapped_column(sa.DateTime, default=func.now(), server_default=func.now(), nullable=False)
 
     order: Mapped["Order"] = relationship("Order", back_populates="history")
-    status: Mapped["OrderStatus"] = relationship("OrderStatus", back_populates="history_entries", lazy='selectin')
+    # Статус запису береться з identity map або через явний joinedload (admin_clients, admin_order_management)
+    status: Mapped["OrderStatus"] = relationship("OrderStatus", back_populates="history_entries", lazy='raise_on_sql')
+
+
+# Черга сповіщень (transactional outbox): рядок пишеться в тому ж commit, що й замовлення,
+# а фоновий воркер відправляє його в Telegram.
+class NotificationOutbox(Base):
+    __tablename__ = 'notification_outbox'
+    __table_args__ = (sa.Index('ix_notification_outbox_status_next_attempt', 'status', 'next_attempt_at'),)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(sa.String(50), nullable=False)
+    order_id: Mapped[Optional[int]] = mapped_column(ForeignKey('orders.id', ondelete="CASCADE"), nullable=True, index=True)
+    payload: Mapped[Optional[str]] = mapped_column(sa.Text, nullable=True)
+    # 'pending' - очікує відправки, 'dead' - вичерпано спроби
+    status: Mapped[str] = mapped_column(sa.String(20), default='pending', server_default=text("'pending'"), nullable=False)
+    attempts: Mapped[int] = mapped_column(default=0, server_default=text("0"), nullable=False)
+    next_attempt_at: Mapped[datetime] = mapped_column(sa.DateTime, default=datetime.now, nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(sa.Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(sa.DateTime, default=func.now(), server_default=func.now())
+
+    order: Mapped[Optional["Order"]] = relationship("Order")
+
+
+# Ключі ідемпотентності оформлення замовлень (idempotency.py): повтор POST з тим самим
+# ключем повертає вже створене замовлення. Рядок пишеться в тому ж commit, що й замовлення.
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+    key: Mapped[str] = mapped_column(sa.String(100), primary_key=True)
+    order_id: Mapped[Optional[int]] = mapped_column(ForeignKey('orders.id', ondelete="CASCADE"), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(sa.DateTime, default=datetime.now, nullable=False, index=True)
+
+    order: Mapped[Optional["Order"]] = relationship("Order")
 
 
 class Customer(Base):
@@ -185,6 +275,38 @@ class Customer(Base):
     phone_number: Mapped[str] = mapped_column(sa.String(20), nullable=True)
     address: Mapped[str] = mapped_column(sa.String(255), nullable=True)
 
+# Агрегат клієнта за номером телефону (усі канали замовлень).
+# Підтримується customer_stats.py при кожному commit зі зміненими замовленнями.
+class CustomerStats(Base):
+    __tablename__ = 'customer_stats'
+    __table_args__ = (sa.Index('ix_customer_stats_order_count_phone', 'order_count', 'phone_number'),)
+    phone_number: Mapped[str] = mapped_column(sa.String(20), primary_key=True)
+    customer_name: Mapped[Optional[str]] = mapped_column(sa.String(100), nullable=True)
+    address: Mapped[Optional[str]] = mapped_column(sa.String(255), nullable=True)
+    order_count: Mapped[int] = mapped_column(default=0, nullable=False)
+    total_spent: Mapped[int] = mapped_column(sa.BigInteger, default=0, nullable=False)
+    first_order_at: Mapped[Optional[datetime]] = mapped_column(sa.DateTime, nullable=True)
+    last_order_at: Mapped[Optional[datetime]] = mapped_column(sa.DateTime, nullable=True)
+    last_order_id: Mapped[Optional[int]] = mapped_column(nullable=True)
+
+# Денні зведення для звітів. dimension: 'total', 'order_type', 'courier', 'waiter', 'product', 'area';
+# key - значення виміру (id працівника, назва страви тощо, '' для 'total').
+# Враховуються замовлення у виконаному статусі, день - дата створення замовлення.
+class ReportDailyRollup(Base):
+    __tablename__ = 'report_daily_rollups'
+    dimension: Mapped[str] = mapped_column(sa.String(20), primary_key=True)
+    day: Mapped[date] = mapped_column(sa.Date, primary_key=True)
+    key: Mapped[str] = mapped_column(sa.String(100), primary_key=True)
+    orders: Mapped[int] = mapped_column(default=0, nullable=False)
+    quantity: Mapped[int] = mapped_column(default=0, nullable=False)
+    revenue: Mapped[int] = mapped_column(sa.BigInteger, default=0, nullable=False)
+
+# Виконані одноразові міграції даних (create_all не змінює схему, тому маркер - окрема таблиця).
+class DataMigration(Base):
+    __tablename__ = 'data_migrations'
+    name: Mapped[str] = mapped_column(sa.String(100), primary_key=True)
+    applied_at: Mapped[datetime] = mapped_column(sa.DateTime, default=datetime.now, nullable=False)
+
 class CartItem(Base):
     __tablename__ = 'cart_items'
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
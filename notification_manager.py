@@ -5,35 +5,21 @@ from aiogram import Bot, html
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 
-from models import Order, Settings, OrderStatus, Employee, Role, Product
+from models import Order, Employee, Table
+from order_items import ensure_items_loaded, split_items_by_area
+from telegram_dispatcher import OutgoingMessage, DeliveryResult, send_many
+from reference_cache import status_by_flag, role_ids_by_flag, operator_role_ids, get_status
 
 logger = logging.getLogger(__name__)
 
-def _parse_products_str(products_str: str) -> dict:
+async def build_new_order_messages(admin_bot: Bot, order: Order, session: AsyncSession) -> list[OutgoingMessage]:
     """
-    Парсить рядок продуктів у словник {'Назва': кількість}.
-    Формат: 'Назва x 1, Назва 2 x 2'
-    """
-    if not products_str:
-        return {}
-    result = {}
-    for part in products_str.split(", "):
-        try:
-            if " x " in part:
-                name, qty = part.rsplit(" x ", 1)
-                result[name.strip()] = int(qty)
-        except ValueError:
-            continue
-    return result
-
-async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: AsyncSession):
-    """
-    Надсилає сповіщення про НОВЕ замовлення в загальний чат, операторам, поварам та барменам.
+    Готує сповіщення про НОВЕ замовлення в загальний чат, операторам, поварам та барменам.
     Використовується для веб-доставки та замовлень, створених офіціантом.
+    Відправляє їх воркер черги (outbox.py) вже після закриття сесії.
     """
-    admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
-    
     await session.refresh(order, ['status'])
     is_delivery = order.is_delivery # Визначаємо тип замовлення
 
@@ -53,12 +39,9 @@ async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: Async
 
     # --- КЛАВІАТУРА ДЛЯ ОПЕРАТОРА ---
     kb_admin = InlineKeyboardBuilder()
-    statuses_res = await session.execute(
-        select(OrderStatus).where(OrderStatus.visible_to_operator == True).order_by(OrderStatus.id)
-    )
     status_buttons = [
         InlineKeyboardButton(text=s.name, callback_data=f"change_order_status_{order.id}_{s.id}")
-        for s in statuses_res.scalars().all()
+        for s in await status_by_flag(session, "visible_to_operator")
     ]
     for i in range(0, len(status_buttons), 2):
         kb_admin.row(*status_buttons[i:i+2])
@@ -66,106 +49,158 @@ async def notify_new_order_to_staff(admin_bot: Bot, order: Order, session: Async
     kb_admin.row(InlineKeyboardButton(text="✏️ Редагувати замовлення", callback_data=f"edit_order_{order.id}"))
     # --------------------------------------------------------
 
-    # 1. Відправка в загальний адмін-чат та операторам
-    target_chat_ids = set()
+    # 1. Загальний адмін-чат та оператори на зміні
+    target_chat_ids = await _get_operator_chat_ids(session)
+    admin_markup = kb_admin.as_markup()
+    messages = [
+        OutgoingMessage(admin_bot, chat_id, admin_text, reply_markup=admin_markup, label="оператору/адміну")
+        for chat_id in target_chat_ids
+    ]
+
+    # 2. РОЗПОДІЛ НА ВИРОБНИЦТВО (Кухня/Бар)
+    # Перевіряємо налаштування статусу перед відправкою
+    if order.status and order.status.requires_kitchen_notify:
+        messages.extend(await build_production_messages(admin_bot, order, session))
+    else:
+        logger.info(f"Замовлення #{order.id} НЕ відправлено на виробництво (налаштування статусу '{order.status.name}').")
+
+    return messages
+
+
+async def build_in_house_order_messages(admin_bot: Bot, order: Order, session: AsyncSession) -> list[OutgoingMessage]:
+    """
+    Сповіщення про нове замовлення зі столика (QR-меню): офіціантам столика,
+    в адмін-чат та на виробництво.
+    """
+    await session.refresh(order, ['status'])
+    table = await session.get(Table, order.table_id, options=[selectinload(Table.assigned_waiters)]) if order.table_id else None
+    table_name = table.name if table else 'N/A'
+
+    order_details_text = (f"📝 <b>Нове замовлення зі столика: {html.bold(table_name)} (ID: #{order.id})</b>\n\n"
+                          f"<b>Склад:</b>\n- " + html.quote((order.products or '').replace(", ", "\n- ")) +
+                          f"\n\n<b>Сума:</b> {order.total_price} грн")
+
+    kb_waiter = InlineKeyboardBuilder()
+    kb_waiter.row(InlineKeyboardButton(text="✅ Прийняти замовлення", callback_data=f"waiter_accept_order_{order.id}"))
+    kb_admin = InlineKeyboardBuilder()
+    kb_admin.row(InlineKeyboardButton(text="⚙️ Керувати (Адмін)", callback_data=f"waiter_manage_order_{order.id}"))
+
+    admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
+    admin_chat_id = None
     if admin_chat_id_str:
+        try: admin_chat_id = int(admin_chat_id_str)
+        except ValueError: pass
+
+    # 1. Розсилка офіціантам (персонально для цього столика)
+    waiter_chat_ids = []
+    for w in (table.assigned_waiters if table else []):
+        if w.telegram_user_id and w.is_on_shift and w.telegram_user_id not in waiter_chat_ids:
+            waiter_chat_ids.append(w.telegram_user_id)
+
+    messages = []
+    if waiter_chat_ids:
+        waiter_markup = kb_waiter.as_markup()
+        messages.extend(
+            OutgoingMessage(admin_bot, chat_id, order_details_text, reply_markup=waiter_markup, label="офіціанту")
+            for chat_id in waiter_chat_ids
+        )
+        if admin_chat_id and admin_chat_id not in waiter_chat_ids:
+            messages.append(OutgoingMessage(admin_bot, admin_chat_id, "✅ " + order_details_text, reply_markup=kb_admin.as_markup(), label="в адмін-чат"))
+    elif admin_chat_id:
+        messages.append(OutgoingMessage(
+            admin_bot, admin_chat_id,
+            f"❗️ <b>Замовлення з вільного столика {html.bold(table_name)} (ID: #{order.id})!</b>\n\n" + order_details_text,
+            reply_markup=kb_admin.as_markup(), label="в адмін-чат"
+        ))
+
+    # 2. Розподіл на Кухню та Бар, якщо цього вимагає статус
+    if order.status and order.status.requires_kitchen_notify:
+        messages.extend(await build_production_messages(admin_bot, order, session))
+    else:
+        logger.info(f"Замовлення #{order.id} НЕ відправлено на виробництво (налаштування статусу).")
+
+    return messages
+
+
+async def _get_operator_chat_ids(session: AsyncSession, include_admin_chat: bool = True) -> list:
+    """Повертає chat_id загального адмін-чату та операторів на зміні (без дублікатів)."""
+    target_chat_ids = []
+    admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
+    if include_admin_chat and admin_chat_id_str:
         try:
-            target_chat_ids.add(int(admin_chat_id_str))
+            target_chat_ids.append(int(admin_chat_id_str))
         except ValueError:
             logger.warning(f"Некоректний ADMIN_CHAT_ID: {admin_chat_id_str}")
 
-    operator_roles_res = await session.execute(select(Role.id).where(Role.can_manage_orders == True))
-    operator_role_ids = operator_roles_res.scalars().all()
-
     operators_on_shift_res = await session.execute(
-        select(Employee).where(
-            Employee.role_id.in_(operator_role_ids),
+        select(Employee.telegram_user_id).where(
+            Employee.role_id.in_(await operator_role_ids(session)),
             Employee.is_on_shift == True,
             Employee.telegram_user_id.is_not(None)
         )
     )
-    for operator in operators_on_shift_res.scalars().all():
-        if operator.telegram_user_id not in target_chat_ids:
-            target_chat_ids.add(operator.telegram_user_id)
-            
-    for chat_id in target_chat_ids:
-        try:
-            await admin_bot.send_message(chat_id, admin_text, reply_markup=kb_admin.as_markup())
-        except Exception as e:
-            logger.error(f"Не вдалося відправити нове замовлення оператору/адміну {chat_id}: {e}")
-
-    # 2. РОЗПОДІЛ НА ВИРОБНИЦТВО (Кухня/Бар)
-    # Перевіряємо налаштування статусу перед відправкою
-    if order.status and order.status.requires_kitchen_notify:
-        await distribute_order_to_production(admin_bot, order, session)
-    else:
-        logger.info(f"Замовлення #{order.id} НЕ відправлено на виробництво (налаштування статусу '{order.status.name}').")
+    for chat_id in operators_on_shift_res.scalars().all():
+        if chat_id not in target_chat_ids:
+            target_chat_ids.append(chat_id)
+    return target_chat_ids
 
 
-async def distribute_order_to_production(bot: Bot, order: Order, session: AsyncSession):
+async def distribute_order_to_production(bot: Bot, order: Order, session: AsyncSession) -> list[DeliveryResult]:
     """
     Розподіляє товари замовлення між Кухнею та Баром і надсилає відповідним працівникам.
-    Викликається з place_in_house_order та notify_new_order_to_staff.
     """
-    # 1. Парсимо товари
-    products_map = _parse_products_str(order.products)
-    if not products_map:
-        return
-
-    # 2. Отримуємо деталі товарів з БД (щоб знати preparation_area)
-    names = list(products_map.keys())
-    products_res = await session.execute(select(Product).where(Product.name.in_(names)))
-    db_products = products_res.scalars().all()
-
-    kitchen_items = []
-    bar_items = []
-
-    # Словник для швидкого пошуку продукту
-    products_by_name = {p.name: p for p in db_products}
-
-    for name, qty in products_map.items():
-        product = products_by_name.get(name)
-        if product:
-            item_str = f"- {html.quote(name)} x {qty}"
-            if product.preparation_area == 'bar':
-                bar_items.append(item_str)
-            else:
-                # За замовчуванням або якщо kitchen
-                kitchen_items.append(item_str)
-
-    # 3. Відправляємо на Кухню
+    return await send_many(await build_production_messages(bot, order, session))
+
+
+async def build_production_messages(bot: Bot, order: Order, session: AsyncSession) -> list[OutgoingMessage]:
+    """Готує чеки для Кухні та Бару без відправки."""
+    # 1-2. Позиції замовлення вже містять знімок цеху (preparation_area)
+    items = await ensure_items_loaded(session, order)
+    if not items:
+        return []
+
+    by_area = split_items_by_area(items)
+    kitchen_items = [f"- {html.quote(item.name)} x {item.quantity}" for item in by_area['kitchen']]
+    bar_items = [f"- {html.quote(item.name)} x {item.quantity}" for item in by_area['bar']]
+
+    messages = []
+    # 3. Кухня
     if kitchen_items:
-        await send_group_notification(
+        messages.extend(await _build_group_messages(
             bot=bot,
             order=order,
             items=kitchen_items,
-            role_filter=Role.can_receive_kitchen_orders == True,
+            role_flag="can_receive_kitchen_orders",
             title="🧑‍🍳 ЗАМОВЛЕННЯ НА КУХНЮ",
             session=session
-        )
+        ))
 
-    # 4. Відправляємо на Бар
+    # 4. Бар
     if bar_items:
-        await send_group_notification(
+        messages.extend(await _build_group_messages(
             bot=bot,
             order=order,
             items=bar_items,
-            role_filter=Role.can_receive_bar_orders == True,
+            role_flag="can_receive_bar_orders",
             title="🍹 ЗАМОВЛЕННЯ НА БАР",
             session=session
-        )
+        ))
+    return messages
 
 
-async def send_group_notification(bot: Bot, order: Order, items: list, role_filter, title: str, session: AsyncSession):
+async def send_group_notification(bot: Bot, order: Order, items: list, role_flag: str, title: str, session: AsyncSession) -> list[DeliveryResult]:
     """
     Універсальна функція для відправки чека групі співробітників (повари або бармени).
     """
-    # Шукаємо ролі
-    roles_res = await session.execute(select(Role.id).where(role_filter))
-    role_ids = roles_res.scalars().all()
+    return await send_many(await _build_group_messages(bot, order, items, role_flag, title, session))
+
+
+async def _build_group_messages(bot: Bot, order: Order, items: list, role_flag: str, title: str, session: AsyncSession) -> list[OutgoingMessage]:
+    # Ролі з потрібним прапорцем (напр. 'can_receive_kitchen_orders')
+    role_ids = await role_ids_by_flag(session, role_flag)
 
     if not role_ids:
-        return
+        return []
 
     # Шукаємо працівників на зміні
     employees_res = await session.execute(
@@ -177,50 +212,56 @@ async def send_group_notification(bot: Bot, order: Order, items: list, role_filt
     )
     employees = employees_res.scalars().all()
 
-    if employees:
-        is_delivery = order.is_delivery
-        items_formatted = "\n".join(items)
-        
-        table_info = ""
-        if order.order_type == 'in_house' and order.table_id:
-            # Завантажуємо назву столика, якщо вона ще не завантажена
-            if 'table' not in order.__dict__:
-                await session.refresh(order, ['table'])
-            if order.table:
-                table_info = f" (Стіл: {html.quote(order.table.name)})"
-        
-        text = (f"{title}: <b>#{order.id}</b>{table_info}\n"
-                f"<b>Тип:</b> {'Доставка' if is_delivery else 'В закладі / Самовивіз'}\n"
-                f"<b>Час:</b> {html.quote(order.delivery_time)}\n\n"
-                f"<b>СКЛАД:</b>\n{items_formatted}\n\n"
-                f"<i>Натисніть 'Видача', коли буде готове.</i>")
-        
-        kb = InlineKeyboardBuilder()
-        # Callback той самий, оскільки логіка зміни статусу на "Готовий" однакова
-        kb.row(InlineKeyboardButton(text=f"✅ Видача #{order.id}", callback_data=f"chef_ready_{order.id}"))
-        
-        for emp in employees:
-            try:
-                await bot.send_message(emp.telegram_user_id, text, reply_markup=kb.as_markup())
-            except Exception as e:
-                logger.error(f"Не вдалося відправити замовлення працівнику {emp.id}: {e}")
+    if not employees:
+        return []
+
+    is_delivery = order.is_delivery
+    items_formatted = "\n".join(items)
+    
+    table_info = ""
+    if order.order_type == 'in_house' and order.table_id:
+        # Завантажуємо назву столика, якщо вона ще не завантажена
+        if 'table' not in order.__dict__:
+            await session.refresh(order, ['table'])
+        if order.table:
+            table_info = f" (Стіл: {html.quote(order.table.name)})"
+    
+    text = (f"{title}: <b>#{order.id}</b>{table_info}\n"
+            f"<b>Тип:</b> {'Доставка' if is_delivery else 'В закладі / Самовивіз'}\n"
+            f"<b>Час:</b> {html.quote(order.delivery_time)}\n\n"
+            f"<b>СКЛАД:</b>\n{items_formatted}\n\n"
+            f"<i>Натисніть 'Видача', коли буде готове.</i>")
+    
+    kb = InlineKeyboardBuilder()
+    # Callback той самий, оскільки логіка зміни статусу на "Готовий" однакова
+    kb.row(InlineKeyboardButton(text=f"✅ Видача #{order.id}", callback_data=f"chef_ready_{order.id}"))
+    markup = kb.as_markup()
+    
+    return [
+        OutgoingMessage(bot, emp.telegram_user_id, text, reply_markup=markup, label=f"працівнику {emp.id}")
+        for emp in employees
+    ]
 
 
-async def notify_all_parties_on_status_change(
+async def build_status_change_messages(
     order: Order,
     old_status_name: str,
     actor_info: str,
     admin_bot: Bot,
     client_bot: Bot | None,
-    session: AsyncSession
-):
+    session: AsyncSession,
+    new_status_id: int | None = None
+) -> list[OutgoingMessage]:
     """
-    Централізована функція для надсилання всіх сповіщень при зміні статусу.
+    Централізована збірка всіх сповіщень при зміні статусу. Ставиться в чергу
+    переходом статусу (order_transitions.py) і відправляється воркером outbox.py.
+    new_status_id - статус, на який перейшло замовлення (за замовчуванням - поточний).
     """
     await session.refresh(order, ['status', 'courier', 'accepted_by_waiter', 'table'])
     admin_chat_id_str = os.environ.get('ADMIN_CHAT_ID')
     
-    new_status = order.status
+    new_status = (await get_status(session, new_status_id) if new_status_id else None) or order.status
+    messages = []
     
     # 1. Сповіщення в головний АДМІН-ЧАТ (Лог)
     if admin_chat_id_str:
@@ -229,72 +270,51 @@ async def notify_all_parties_on_status_change(
             f"<b>Ким:</b> {html.quote(actor_info)}\n"
             f"<b>Статус:</b> `{html.quote(old_status_name)}` → `{html.quote(new_status.name)}`"
         )
-        try:
-            await admin_bot.send_message(admin_chat_id_str, log_message)
-        except Exception as e:
-            logger.error(f"Не вдалося відправити лог в адмін-чат: {e}")
+        messages.append(OutgoingMessage(admin_bot, admin_chat_id_str, log_message, label="лог в адмін-чат"))
 
     # 2. ЛОГІКА ДЛЯ ВИРОБНИЦТВА (Кухня/Бар)
     # Перевіряємо, чи вимагає новий статус відправки на кухню
     if new_status.requires_kitchen_notify:
-        # Відправляємо розподілене замовлення
-        await distribute_order_to_production(admin_bot, order, session)
+        messages.extend(await build_production_messages(admin_bot, order, session))
 
     # 3. СПОВІЩЕННЯ ПІД ЧАС ВИДАЧІ ("Готовий до видачі")
     if new_status.name == "Готовий до видачі":
         ready_message = f"📢 <b>ЗАМОВЛЕННЯ ГОТОВЕ ДО ВИДАЧІ: #{order.id}</b>! \n"
         
-        target_employees = []
+        target_chat_ids = []
         # Якщо є офіціант (для замовлення в закладі)
         if order.order_type == 'in_house' and order.accepted_by_waiter and order.accepted_by_waiter.is_on_shift:
-            target_employees.append(order.accepted_by_waiter)
+            target_chat_ids.append(order.accepted_by_waiter.telegram_user_id)
             ready_message += f"Стіл: {html.quote(order.table.name if order.table else 'N/A')}. Прийняв: {html.quote(order.accepted_by_waiter.full_name)}"
         
         # Якщо є кур'єр (для доставки)
         if order.is_delivery and order.courier and order.courier.is_on_shift:
-            target_employees.append(order.courier)
+            target_chat_ids.append(order.courier.telegram_user_id)
             ready_message += f"Призначений кур'єр: {html.quote(order.courier.full_name)}"
 
         # Якщо нікого немає, сповіщаємо операторів
-        if not target_employees:
-             operator_roles_res = await session.execute(select(Role.id).where(Role.can_manage_orders == True))
-             operator_role_ids = operator_roles_res.scalars().all()
-             operators_on_shift_res = await session.execute(
-                 select(Employee).where(
-                     Employee.role_id.in_(operator_role_ids),
-                     Employee.is_on_shift == True,
-                     Employee.telegram_user_id.is_not(None)
-                 )
-             )
-             target_employees.extend(operators_on_shift_res.scalars().all())
-             ready_message += f"Тип: {'Самовивіз' if order.order_type == 'pickup' else 'Доставка'}. Потрібна видача."
+        if not target_chat_ids:
+            target_chat_ids = await _get_operator_chat_ids(session, include_admin_chat=False)
+            ready_message += f"Тип: {'Самовивіз' if order.order_type == 'pickup' else 'Доставка'}. Потрібна видача."
              
-        for employee in target_employees:
-            if employee.telegram_user_id:
-                try:
-                    await admin_bot.send_message(employee.telegram_user_id, ready_message)
-                except Exception as e:
-                    logger.error(f"Не вдалося сповістити {employee.telegram_user_id} про готовність: {e}")
+        for chat_id in target_chat_ids:
+            if chat_id:
+                messages.append(OutgoingMessage(admin_bot, chat_id, ready_message, label="про готовність"))
 
     # 4. Сповіщення призначеному КУР'ЄРУ (про інші зміни статусу)
     if order.courier and order.courier.telegram_user_id and "Кур'єр" not in actor_info and new_status.name != "Готовий до видачі":
         if new_status.visible_to_courier: # Тільки якщо статус видимий кур'єру
             courier_text = f"❗️ Статус вашого замовлення #{order.id} змінено на: <b>{new_status.name}</b>"
-            try:
-                await admin_bot.send_message(order.courier.telegram_user_id, courier_text)
-            except Exception: pass
+            messages.append(OutgoingMessage(admin_bot, order.courier.telegram_user_id, courier_text, label="кур'єру"))
 
     # 5. Сповіщення призначеному ОФІЦІАНТУ (про інші зміни статусу)
     if order.order_type != 'delivery' and order.accepted_by_waiter and order.accepted_by_waiter.telegram_user_id and "Офіціант" not in actor_info and new_status.name != "Готовий до видачі":
         waiter_text = f"📢 Замовлення #{order.id} (Стіл: {html.quote(order.table.name if order.table else 'N/A')}) має новий статус: <b>{new_status.name}</b>"
-        try:
-            await admin_bot.send_message(order.accepted_by_waiter.telegram_user_id, waiter_text)
-        except Exception: pass
+        messages.append(OutgoingMessage(admin_bot, order.accepted_by_waiter.telegram_user_id, waiter_text, label="офіціанту"))
 
     # 6. Сповіщення КЛІЄНТУ
     if new_status.notify_customer and order.user_id and client_bot:
         client_text = f"Статус вашого замовлення #{order.id} змінено на: <b>{new_status.name}</b>"
-        try:
-            await client_bot.send_message(order.user_id, client_text)
-        except Exception as e:
-            logger.error(f"Не вдалося сповістити клієнта {order.user_id}: {e}")
\ No newline at end of file
+        messages.append(OutgoingMessage(client_bot, order.user_id, client_text, label="клієнту"))
+
+    return messages
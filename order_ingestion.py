@@ -0,0 +1,209 @@
+# order_ingestion.py
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from models import CartItem, Customer, IdempotencyKey, Order, OrderItem, OrderStatusHistory, Product
+from order_items import (
+    build_products_string, load_products_by_id, make_order_item, order_items_total, parse_products_str,
+)
+from outbox import enqueue_notification, wake_outbox_worker, NEW_ORDER_STAFF
+from reference_cache import status_by_name, STATUS_NEW
+
+logger = logging.getLogger(__name__)
+
+# Верхня межа кількості однієї страви в замовленні (захист від помилок і зловживань)
+ORDER_MAX_LINE_QUANTITY = int(os.environ.get("ORDER_MAX_LINE_QUANTITY", "99"))
+
+
+class OrderValidationError(ValueError):
+    """Замовлення не пройшло перевірку за каталогом; текст придатний для показу клієнту."""
+
+
+@dataclass
+class OrderRequest:
+    """
+    Нове замовлення з будь-якого каналу (бот, сайт, QR-меню, адмінка, офіціант).
+    lines: [{"product_id" або "id", "quantity", ...}] - назва і ціна з рядків ігноруються,
+    вони беруться з каталогу.
+    """
+    lines: List[Dict[str, Any]]
+    actor_info: str
+    customer_name: Optional[str] = None
+    phone_number: Optional[str] = None
+    address: Optional[str] = None
+    is_delivery: bool = True
+    delivery_time: str = "Якнайшвидше"
+    order_type: str = "delivery"
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    table_id: Optional[int] = None
+    accepted_by_waiter_id: Optional[int] = None
+    # Тип сповіщення з outbox.py; None - без сповіщення
+    notification: Optional[str] = NEW_ORDER_STAFF
+    # Адмінка може додавати страви, зняті з продажу
+    allow_inactive: bool = False
+    # Ключ ідемпотентності (idempotency.py) - зберігається в тому ж commit
+    idempotency_key: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class PlacedOrder:
+    """Результат оформлення: все, що потрібно для відповіді клієнту. Сповіщення вже в черзі."""
+    order_id: int
+    status_id: int
+    total_price: int
+    products: str
+    order_type: str
+    table_id: Optional[int] = None
+    items: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def build_order_items(session: AsyncSession, lines: List[Dict[str, Any]], allow_inactive: bool = False,
+                            skip_unavailable: bool = False) -> List[OrderItem]:
+    """
+    Перевіряє рядки за каталогом одним запитом і будує позиції з цінами та назвами з БД.
+    Однакові страви об'єднуються. Недоступні страви - OrderValidationError
+    (або пропускаються з skip_unavailable, як при редагуванні старого замовлення в адмінці).
+    """
+    quantities: Dict[int, int] = {}
+    for line in lines:
+        pid = _to_int(line.get("product_id", line.get("id")))
+        quantity = _to_int(line.get("quantity"))
+        if pid is None or quantity is None:
+            raise OrderValidationError("Невірний формат позиції замовлення.")
+        if quantity <= 0:
+            continue
+        quantities[pid] = quantities.get(pid, 0) + quantity
+
+    products_by_id = await load_products_by_id(session, quantities)
+    unavailable = [
+        pid for pid in quantities
+        if pid not in products_by_id or not (allow_inactive or products_by_id[pid].is_active)
+    ]
+    if unavailable and not skip_unavailable:
+        names = [products_by_id[pid].name for pid in unavailable if pid in products_by_id]
+        detail = f": {', '.join(names)}" if names else ""
+        raise OrderValidationError(f"Деякі страви недоступні{detail}. Оновіть кошик.")
+
+    items = []
+    for pid, quantity in quantities.items():
+        if pid in unavailable:
+            continue
+        if quantity > ORDER_MAX_LINE_QUANTITY:
+            raise OrderValidationError(
+                f"Забагато порцій «{products_by_id[pid].name}» (максимум {ORDER_MAX_LINE_QUANTITY})."
+            )
+        items.append(make_order_item(products_by_id[pid], quantity))
+    return items
+
+
+async def lines_from_products_str(session: AsyncSession, products_str: str) -> List[Dict[str, Any]]:
+    """Рядки замовлення зі старого рядка products (стан FSM, збережений до появи позицій)."""
+    products_map = parse_products_str(products_str)
+    if not products_map:
+        return []
+    products_res = await session.execute(select(Product.id, Product.name).where(Product.name.in_(list(products_map))))
+    return [{"product_id": row.id, "quantity": products_map[row.name]} for row in products_res]
+
+
+def _customer_upsert(dialect_name: str, request: OrderRequest):
+    table = Customer.__table__
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    stmt = insert(table).values(
+        user_id=request.user_id, name=request.customer_name,
+        phone_number=request.phone_number, address=request.address,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={
+            "name": stmt.excluded.name,
+            "phone_number": stmt.excluded.phone_number,
+            # Самовивіз не стирає збережену адресу доставки
+            "address": sa.func.coalesce(stmt.excluded.address, table.c.address),
+        },
+    )
+
+
+async def _save_customer(session: AsyncSession, request: OrderRequest):
+    """Профіль клієнта бота одним upsert; кошик очищається в тій же транзакції."""
+    connection = await session.connection()
+    upsert = _customer_upsert(connection.dialect.name, request)
+    if upsert is not None:
+        await session.execute(upsert)
+    else:
+        customer = await session.get(Customer, request.user_id)
+        if not customer:
+            customer = Customer(user_id=request.user_id)
+            session.add(customer)
+        customer.name, customer.phone_number = request.customer_name, request.phone_number
+        if request.address is not None:
+            customer.address = request.address
+    await session.execute(sa.delete(CartItem).where(CartItem.user_id == request.user_id))
+
+
+async def place_order(session: AsyncSession, request: OrderRequest) -> PlacedOrder:
+    """
+    Єдина точка створення замовлень. Суми рахуються на сервері за цінами каталогу;
+    замовлення, позиції, початковий запис історії, профіль клієнта та сповіщення
+    в outbox фіксуються одним commit (позиції - одним пакетним INSERT).
+    """
+    items = await build_order_items(session, request.lines, allow_inactive=request.allow_inactive)
+    if not items:
+        raise OrderValidationError("Кошик порожній.")
+
+    new_status = await status_by_name(session, STATUS_NEW)
+    status_id = new_status.id if new_status else 1
+
+    order = Order(
+        user_id=request.user_id, username=request.username,
+        customer_name=request.customer_name, phone_number=request.phone_number,
+        address=request.address if request.is_delivery else None,
+        is_delivery=request.is_delivery, delivery_time=request.delivery_time,
+        order_type=request.order_type, table_id=request.table_id,
+        accepted_by_waiter_id=request.accepted_by_waiter_id,
+        status_id=status_id,
+        products=build_products_string(items), total_price=order_items_total(items),
+        items=items,
+        history=[OrderStatusHistory(status_id=status_id, actor_info=request.actor_info)],
+    )
+    session.add(order)
+
+    if request.user_id:
+        await _save_customer(session, request)
+    if request.notification:
+        enqueue_notification(session, request.notification, order=order)
+    if request.idempotency_key:
+        session.add(IdempotencyKey(key=request.idempotency_key, order=order))
+
+    await session.commit()
+    if request.notification:
+        wake_outbox_worker()
+
+    logger.info(f"Замовлення #{order.id} ({order.order_type}) оформлено: {request.actor_info}, {order.total_price} грн")
+    return PlacedOrder(
+        order_id=order.id,
+        status_id=status_id,
+        total_price=order.total_price,
+        products=order.products,
+        order_type=order.order_type,
+        table_id=order.table_id,
+        items=[{"name": item.name, "price": item.price, "quantity": item.quantity} for item in items],
+    )
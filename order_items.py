@@ -0,0 +1,142 @@
+# order_items.py
+import logging
+from typing import Dict, List, Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import DataMigration, Order, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 500
+BACKFILL_MIGRATION = "order_items_backfill"
+
+
+def parse_products_str(products_str: str) -> Dict[str, int]:
+    """
+    Парсить рядок продуктів у словник {'Назва': кількість}.
+    Формат: 'Назва x 1, Назва 2 x 2'. Використовується лише для старих замовлень без позицій.
+    """
+    if not products_str:
+        return {}
+    result = {}
+    for part in products_str.split(", "):
+        try:
+            if " x " in part:
+                name, qty = part.rsplit(" x ", 1)
+                result[name.strip()] = int(qty)
+        except ValueError:
+            continue
+    return result
+
+
+def build_products_string(items: Iterable[OrderItem]) -> str:
+    """Збирає позиції у рядок 'Назва x Кількість, ...' для Order.products."""
+    return ", ".join([f"{item.name} x {item.quantity}" for item in items])
+
+
+def order_items_total(items: Iterable[OrderItem]) -> int:
+    return sum(item.price * item.quantity for item in items)
+
+
+def make_order_item(product: Optional[Product], quantity: int, name: str = None, price: int = None) -> OrderItem:
+    """Створює позицію зі знімком даних товару. Явні name/price мають пріоритет над товаром."""
+    return OrderItem(
+        product_id=product.id if product else None,
+        name=name if name is not None else (product.name if product else ""),
+        price=price if price is not None else (product.price if product else 0),
+        quantity=quantity,
+        preparation_area=product.preparation_area if product else 'kitchen',
+    )
+
+
+async def load_products_by_id(session: AsyncSession, product_ids: Iterable[int]) -> Dict[int, Product]:
+    ids = {pid for pid in product_ids if pid is not None}
+    if not ids:
+        return {}
+    products_res = await session.execute(select(Product).where(Product.id.in_(ids)))
+    return {p.id: p for p in products_res.scalars().all()}
+
+
+async def ensure_items_loaded(session: AsyncSession, order: Order) -> List[OrderItem]:
+    """Довантажує order.items (lazy='raise'), якщо запит не завантажив колекцію явно."""
+    if 'items' not in order.__dict__:
+        if order.id is None:
+            set_committed_value(order, 'items', [])
+        else:
+            items_res = await session.execute(
+                select(OrderItem).where(OrderItem.order_id == order.id).order_by(OrderItem.id)
+            )
+            set_committed_value(order, 'items', list(items_res.scalars().all()))
+    return order.items
+
+
+async def replace_order_items(session: AsyncSession, order: Order, items: List[OrderItem]):
+    """Замінює склад замовлення та синхронізує рядок products і суму."""
+    if order.id is not None:
+        await ensure_items_loaded(session, order)
+    order.items = items
+    order.products = build_products_string(items)
+    order.total_price = order_items_total(items)
+
+
+def split_items_by_area(items: Iterable[OrderItem]) -> Dict[str, List[OrderItem]]:
+    """Розділяє позиції між Кухнею та Баром (все, що не 'bar', йде на кухню)."""
+    result = {'kitchen': [], 'bar': []}
+    for item in items:
+        result['bar' if item.preparation_area == 'bar' else 'kitchen'].append(item)
+    return result
+
+
+async def backfill_order_items(session_maker):
+    """
+    Одноразова міграція: створює позиції для замовлень, у яких їх ще немає,
+    розбираючи рядок products. Після завершення записує маркер у data_migrations -
+    наступні запуски не сканують замовлення (нові замовлення створюються вже з позиціями).
+    """
+    last_id = 0
+    created = 0
+    async with session_maker() as session:
+        if await session.get(DataMigration, BACKFILL_MIGRATION) is not None:
+            return
+        while True:
+            orders_res = await session.execute(
+                select(Order.id, Order.products)
+                .where(Order.id > last_id, ~Order.items.any())
+                .order_by(Order.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            )
+            rows = orders_res.all()
+            if not rows:
+                break
+
+            parsed = {row.id: parse_products_str(row.products) for row in rows}
+            names = {name for products_map in parsed.values() for name in products_map}
+            products_by_name = {}
+            if names:
+                products_res = await session.execute(select(Product).where(Product.name.in_(names)))
+                products_by_name = {p.name: p for p in products_res.scalars().all()}
+
+            for order_id, products_map in parsed.items():
+                for name, qty in products_map.items():
+                    item = make_order_item(products_by_name.get(name), qty, name=name)
+                    item.order_id = order_id
+                    session.add(item)
+                    created += 1
+
+            await session.commit()
+            last_id = rows[-1].id
+
+        # Замовлення з порожнім або нерозбірливим products лишаються без позицій - повторно не скануються
+        session.add(DataMigration(name=BACKFILL_MIGRATION))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Маркер уже записав інший процес, що стартував паралельно
+            await session.rollback()
+
+    if created:
+        logger.info(f"Міграція позицій замовлень: створено {created} позицій.")
@@ -0,0 +1,147 @@
+# order_transitions.py
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update
+
+from models import Order, OrderStatusHistory
+from outbox import enqueue_status_change, wake_outbox_worker
+from reference_cache import get_status, status_by_name, STATUS_READY
+from http_cache import bump_orders_version
+from report_rollups import ROLLUP_FIELDS, capture_order_baselines, record_status_transition
+from kds import record_kds_change, REASON_STATUS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StatusTransition:
+    """Результат переходу. order заповнено лише якщо зміну застосовано."""
+    order_id: int
+    order: Optional[Order] = None
+    old_status_name: str = "Невідомий"
+    new_status_name: str = ""
+    # Статус у БД на момент відмови (None - замовлення не знайдено)
+    current_status_id: Optional[int] = None
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.order is not None
+
+
+async def _status_name(session: AsyncSession, status_id: Optional[int]) -> str:
+    status = await get_status(session, status_id) if status_id is not None else None
+    return status.name if status else "Невідомий"
+
+
+async def transition_order_status(
+    session: AsyncSession,
+    order_id: int,
+    new_status_id: Optional[int],
+    actor_info: str,
+    expected_status_id: Optional[int] = None,
+    values: Dict[str, Any] = None,
+    conditions: Iterable = (),
+    conflict_error: str = "",
+    notify: bool = False,
+) -> StatusTransition:
+    """
+    Атомарний перехід статусу: UPDATE ... WHERE status_id = :expected RETURNING
+    і запис історії в тій же транзакції. Якщо два співробітники натиснули одночасно,
+    застосовується лише перший перехід, другий отримує помилку з актуальним статусом.
+
+    expected_status_id - статус, який бачив співробітник (напр. з форми); без нього
+    береться поточний статус з БД. new_status_id=None - змінюються лише values.
+    conditions - додаткові умови WHERE, при невиконанні яких повертається conflict_error.
+    notify=True - сповіщення про зміну статусу ставиться в outbox тим самим commit.
+    """
+    result = StatusTransition(order_id)
+    if new_status_id is not None:
+        new_status = await get_status(session, new_status_id)
+        if not new_status:
+            result.error = "Статус не знайдено."
+            return result
+        result.new_status_name = new_status.name
+
+    if expected_status_id is None:
+        expected_status_id = await session.scalar(select(Order.status_id).where(Order.id == order_id))
+        if expected_status_id is None:
+            result.error = "Замовлення не знайдено."
+            return result
+
+    if new_status_id == expected_status_id and not values:
+        result.current_status_id = expected_status_id
+        result.error = "Статус вже встановлено."
+        return result
+
+    changes = dict(values or {})
+    if any(name in ROLLUP_FIELDS for name in changes):
+        # UPDATE мине flush ORM: внесок у зведення знімається до зміни виконавців
+        await session.run_sync(lambda s: capture_order_baselines(s, [order_id]))
+    if new_status_id is not None:
+        changes["status_id"] = new_status_id
+    order = await session.scalar(
+        update(Order)
+        .where(Order.id == order_id, Order.status_id == expected_status_id, *conditions)
+        .values(**changes)
+        .returning(Order)
+        .execution_options(populate_existing=True)
+    )
+
+    if order is None:
+        result.current_status_id = await session.scalar(select(Order.status_id).where(Order.id == order_id))
+        if result.current_status_id is None:
+            result.error = "Замовлення не знайдено."
+        elif result.current_status_id != expected_status_id:
+            current_name = await _status_name(session, result.current_status_id)
+            result.error = f"Статус замовлення вже змінено на «{current_name}». Оновіть екран."
+        else:
+            result.error = conflict_error or "Замовлення змінено іншим співробітником."
+        logger.info(f"Перехід статусу замовлення #{order_id} відхилено ({actor_info}): {result.error}")
+        return result
+
+    result.old_status_name = await _status_name(session, expected_status_id)
+    status_changed = new_status_id is not None and new_status_id != expected_status_id
+    if status_changed:
+        session.add(OrderStatusHistory(order_id=order_id, status_id=new_status_id, actor_info=actor_info))
+        # UPDATE пройшов повз flush ORM - передаємо перехід звітам і екранам кухні явно
+        record_status_transition(session, order_id, expected_status_id, new_status_id)
+        record_kds_change(session, order_id, REASON_STATUS)
+        if notify:
+            enqueue_status_change(session, order, new_status_id, result.old_status_name, actor_info)
+    await session.commit()
+    if status_changed and notify:
+        wake_outbox_worker()
+    if not status_changed:
+        # Без запису історії flush не бачить змін замовлення
+        bump_orders_version()
+
+    result.order = order
+    return result
+
+
+async def mark_order_ready(session: AsyncSession, order_id: int, actor_info: str) -> Tuple[Optional[Order], str]:
+    """
+    Сигнал видачі з кухні/бару (кнопка в боті або екран KDS). Переводить замовлення в
+    «Готовий до видачі», якщо воно ще не там, і в будь-якому разі ставить у чергу сповіщення
+    офіціанту/клієнту - друга частина (напр. бар після кухні) теж має дійти. Повертає (замовлення, помилка).
+    """
+    ready_status = await status_by_name(session, STATUS_READY)
+    if not ready_status:
+        return None, "Статус 'Готовий до видачі' не налаштовано."
+
+    transition = await transition_order_status(session, order_id, ready_status.id, actor_info, notify=True)
+    order = transition.order
+    if transition.current_status_id == ready_status.id:
+        # Вже готове (або інший цех щойно позначив) - лише сповіщення про свою частину
+        order = await session.get(Order, order_id)
+        if order:
+            enqueue_status_change(session, order, ready_status.id, ready_status.name, actor_info)
+            await session.commit()
+            wake_outbox_worker()
+    if not order:
+        return None, transition.error
+    return order, ""
@@ -0,0 +1,215 @@
+# outbox.py
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from aiogram import Bot
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete
+
+from models import NotificationOutbox, Order
+from notification_manager import build_new_order_messages, build_in_house_order_messages, build_status_change_messages
+from telegram_dispatcher import OutgoingMessage, send_many
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+# Скільки часу рядок «зарезервований» воркером, поки його обробляють
+OUTBOX_LEASE_SECONDS = 120
+
+# Типи сповіщень
+NEW_ORDER_STAFF = "new_order_staff"
+NEW_IN_HOUSE_ORDER = "new_in_house_order"
+STATUS_CHANGE = "status_change"
+# Довільний текст персоналу без замовлення (виклик офіціанта, запит рахунку)
+STAFF_MESSAGE = "staff_message"
+
+# Ключ payload зі списком чатів, яким ще треба доставити (після часткової невдачі)
+PENDING_CHATS_KEY = "pending_chat_ids"
+
+
+async def _build_new_order(session: AsyncSession, order: Order, payload: dict,
+                           admin_bot: Bot, client_bot: Optional[Bot]) -> List[OutgoingMessage]:
+    return await build_new_order_messages(admin_bot, order, session)
+
+
+async def _build_new_in_house_order(session: AsyncSession, order: Order, payload: dict,
+                                    admin_bot: Bot, client_bot: Optional[Bot]) -> List[OutgoingMessage]:
+    return await build_in_house_order_messages(admin_bot, order, session)
+
+
+async def _build_status_change(session: AsyncSession, order: Order, payload: dict,
+                               admin_bot: Bot, client_bot: Optional[Bot]) -> List[OutgoingMessage]:
+    return await build_status_change_messages(
+        order, payload.get("old_status_name", "Невідомий"), payload.get("actor_info", ""),
+        admin_bot, client_bot, session, new_status_id=payload.get("status_id"),
+    )
+
+
+async def _build_staff_message(session: AsyncSession, order: Optional[Order], payload: dict,
+                               admin_bot: Bot, client_bot: Optional[Bot]) -> List[OutgoingMessage]:
+    label = payload.get("label", "")
+    return [OutgoingMessage(admin_bot, chat_id, payload["text"], label=label) for chat_id in payload["chat_ids"]]
+
+
+# Обробник готує повідомлення в межах сесії; відправка йде вже без з'єднання з БД
+_HANDLERS = {
+    NEW_ORDER_STAFF: _build_new_order,
+    NEW_IN_HOUSE_ORDER: _build_new_in_house_order,
+    STATUS_CHANGE: _build_status_change,
+    STAFF_MESSAGE: _build_staff_message,
+}
+
+_wakeup_event: Optional[asyncio.Event] = None
+
+
+def _get_wakeup_event() -> asyncio.Event:
+    global _wakeup_event
+    if _wakeup_event is None:
+        _wakeup_event = asyncio.Event()
+    return _wakeup_event
+
+
+def enqueue_notification(session: AsyncSession, kind: str, order: Order = None, payload: dict = None) -> NotificationOutbox:
+    """
+    Додає сповіщення в чергу. НЕ робить commit: рядок зберігається разом
+    із замовленням у commit викликаючого коду.
+    """
+    if kind not in _HANDLERS:
+        raise ValueError(f"Невідомий тип сповіщення: {kind}")
+    entry = NotificationOutbox(kind=kind, order=order, payload=json.dumps(payload) if payload else None)
+    session.add(entry)
+    return entry
+
+
+def enqueue_status_change(session: AsyncSession, order: Order, status_id: int,
+                          old_status_name: str, actor_info: str) -> NotificationOutbox:
+    """Ставить у чергу сповіщення про зміну статусу (без commit, як enqueue_notification)."""
+    return enqueue_notification(session, STATUS_CHANGE, order=order, payload={
+        "status_id": status_id, "old_status_name": old_status_name, "actor_info": actor_info,
+    })
+
+
+def wake_outbox_worker():
+    """Будить воркер одразу після commit, щоб не чекати наступного опитування."""
+    _get_wakeup_event().set()
+
+
+def _backoff_seconds(attempts: int) -> int:
+    return min(5 * (2 ** (attempts - 1)), 600)
+
+
+async def _claim_batch(session_maker) -> list:
+    """Резервує пакет готових до відправки рядків (SKIP LOCKED для кількох процесів)."""
+    now = datetime.now()
+    async with session_maker() as session:
+        res = await session.execute(
+            select(NotificationOutbox)
+            .where(NotificationOutbox.status == 'pending', NotificationOutbox.next_attempt_at <= now)
+            .order_by(NotificationOutbox.id)
+            .limit(OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        entries = res.scalars().all()
+        for entry in entries:
+            entry.next_attempt_at = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        await session.commit()
+        return [(entry.id, entry.kind, entry.order_id, entry.attempts, entry.payload) for entry in entries]
+
+
+async def _build_messages(session_maker, entry_id: int, kind: str, order_id: Optional[int], payload: dict,
+                          admin_bot: Bot, client_bot: Optional[Bot]) -> List[OutgoingMessage]:
+    """Читає замовлення і готує повідомлення. Сесія закривається до початку відправки."""
+    async with session_maker() as session:
+        order = await session.get(Order, order_id) if order_id else None
+        if order_id and not order:
+            # Замовлення видалене - надсилати нічого
+            logger.warning(f"Outbox #{entry_id}: замовлення #{order_id} не знайдено, сповіщення пропущено.")
+            return []
+        messages = await _HANDLERS[kind](session, order, payload, admin_bot, client_bot)
+
+    pending = payload.get(PENDING_CHATS_KEY)
+    if pending is not None:
+        # Повторна спроба - лише тим, кому минулого разу не дійшло
+        pending = {str(chat_id) for chat_id in pending}
+        messages = [m for m in messages if str(m.chat_id) in pending]
+    return messages
+
+
+async def _process_entry(session_maker, entry_id: int, kind: str, order_id: Optional[int], attempts: int,
+                         raw_payload: Optional[str], admin_bot: Bot, client_bot: Optional[Bot]):
+    payload = json.loads(raw_payload) if raw_payload else {}
+    error = None
+    failed_chat_ids = None
+    try:
+        messages = await _build_messages(session_maker, entry_id, kind, order_id, payload, admin_bot, client_bot)
+        failed = [r for r in await send_many(messages) if not r.ok]
+        if failed:
+            error = "; ".join(f"{r.chat_id}: {r.error}" for r in failed)
+            failed_chat_ids = list(dict.fromkeys(r.chat_id for r in failed))
+    except Exception as e:
+        logger.error(f"Outbox #{entry_id} ({kind}): помилка обробки: {e}", exc_info=True)
+        error = str(e)
+
+    # Коротка сесія лише для позначки результату
+    async with session_maker() as session:
+        if error is None:
+            await session.execute(delete(NotificationOutbox).where(NotificationOutbox.id == entry_id))
+        else:
+            entry = await session.get(NotificationOutbox, entry_id)
+            if entry:
+                entry.attempts = attempts + 1
+                entry.last_error = error[:2000]
+                if failed_chat_ids is not None:
+                    payload[PENDING_CHATS_KEY] = failed_chat_ids
+                    entry.payload = json.dumps(payload)
+                if entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    entry.status = 'dead'
+                    logger.error(f"Outbox #{entry_id} ({kind}) переміщено в dead-letter після {entry.attempts} спроб.")
+                else:
+                    entry.next_attempt_at = datetime.now() + timedelta(seconds=_backoff_seconds(entry.attempts))
+        await session.commit()
+
+
+async def process_outbox_batch(session_maker, bot_provider: Callable[[], Tuple[Optional[Bot], Optional[Bot]]]) -> int:
+    """Обробляє один пакет черги. Повертає кількість оброблених рядків."""
+    admin_bot, client_bot = bot_provider()
+    if not admin_bot:
+        return 0
+    batch = await _claim_batch(session_maker)
+    if batch:
+        await asyncio.gather(*(
+            _process_entry(session_maker, entry_id, kind, order_id, attempts, raw_payload, admin_bot, client_bot)
+            for entry_id, kind, order_id, attempts, raw_payload in batch
+        ))
+    return len(batch)
+
+
+async def run_outbox_worker(session_maker, bot_provider: Callable[[], Tuple[Optional[Bot], Optional[Bot]]]):
+    """
+    Фоновий воркер черги сповіщень. Запускається з lifespan у main.py.
+    bot_provider повертає (admin_bot, client_bot); поки ботів немає, черга накопичується.
+    """
+    logger.info("Воркер черги сповіщень запущено.")
+    wakeup = _get_wakeup_event()
+    while True:
+        try:
+            processed = await process_outbox_batch(session_maker, bot_provider)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Помилка воркера черги сповіщень: {e}", exc_info=True)
+            processed = 0
+
+        if processed >= OUTBOX_BATCH_SIZE:
+            continue
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
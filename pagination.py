@@ -0,0 +1,142 @@
+# pagination.py
+import base64
+import binascii
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Скільки секунд вважати приблизну кількість рядків актуальною
+COUNT_CACHE_TTL = 60
+
+_count_cache: Dict[str, Tuple[float, int]] = {}
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(list(values), separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[tuple]:
+    """Розбирає курсор; зіпсований або чужий курсор просто відкриває першу сторінку."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return tuple(values)
+
+
+def _keys_compare(keys: Sequence[Any], values: tuple, older: bool):
+    if len(keys) == 1:
+        return keys[0] < values[0] if older else keys[0] > values[0]
+    row = sa.tuple_(*keys)
+    return row < sa.tuple_(*values) if older else row > sa.tuple_(*values)
+
+
+@dataclass
+class KeysetPage:
+    rows: List[Any]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+    @property
+    def has_pages(self) -> bool:
+        return bool(self.next_cursor or self.prev_cursor)
+
+
+class Keyset:
+    """
+    Keyset-пагінація за спаданням ключів (нові записи першими).
+    after - курсор «старіші за», before - курсор «новіші за».
+    Вартість сторінки не залежить від її глибини (без OFFSET).
+    """
+    def __init__(self, keys: Sequence[Any], key_of: Callable[[Any], Sequence[Any]], per_page: int,
+                 after: Optional[str] = None, before: Optional[str] = None):
+        self.keys = list(keys)
+        self.key_of = key_of
+        self.per_page = per_page
+        self.after = decode_cursor(after, len(self.keys))
+        self.before = None if self.after is not None else decode_cursor(before, len(self.keys))
+
+    def apply(self, query):
+        """Додає умову курсора, сортування та LIMIT до запиту (без order_by)."""
+        cursor = self.after if self.after is not None else self.before
+        if cursor is not None:
+            query = query.where(_keys_compare(self.keys, cursor, older=self.before is None))
+        if self.before is not None:
+            query = query.order_by(*[k.asc() for k in self.keys])
+        else:
+            query = query.order_by(*[k.desc() for k in self.keys])
+        return query.limit(self.per_page + 1)
+
+    def page(self, rows: Sequence[Any]) -> KeysetPage:
+        rows = list(rows)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if self.before is not None:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        first, last = encode_cursor(self.key_of(rows[0])), encode_cursor(self.key_of(rows[-1]))
+        if self.before is not None:
+            return KeysetPage(rows, next_cursor=last, prev_cursor=first if has_more else None)
+        return KeysetPage(
+            rows,
+            next_cursor=last if has_more else None,
+            prev_cursor=first if self.after is not None else None,
+        )
+
+
+def render_pagination(path: str, page: KeysetPage, total_label: str = "", **params) -> str:
+    """Посилання «новіші/старіші» у стилі існуючого блоку .pagination."""
+    if not page.has_pages and not total_label:
+        return ""
+    params = {k: v for k, v in params.items() if v}
+    links = []
+    if page.prev_cursor:
+        links.append(f'<a href="{path}?{urlencode({**params, "before": page.prev_cursor})}">← Попередня</a>')
+    if page.next_cursor:
+        links.append(f'<a href="{path}?{urlencode({**params, "after": page.next_cursor})}">Наступна →</a>')
+    if total_label:
+        links.append(f'<span>{total_label}</span>')
+    return f"<div class='pagination'>{' '.join(links)}</div>"
+
+
+async def _cached(cache_key: str, loader) -> int:
+    cached = _count_cache.get(cache_key)
+    now = time.monotonic()
+    if cached and now - cached[0] < COUNT_CACHE_TTL:
+        return cached[1]
+    value = int(await loader() or 0)
+    _count_cache[cache_key] = (now, value)
+    return value
+
+
+async def approximate_row_count(session: AsyncSession, model) -> int:
+    """
+    Приблизна кількість рядків таблиці: pg_class.reltuples для PostgreSQL
+    (без повного сканування), count(*) для інших БД. Кешується на COUNT_CACHE_TTL.
+    """
+    table = model.__table__
+
+    async def _load():
+        if session.bind.dialect.name == "postgresql":
+            estimate = await session.scalar(
+                sa.text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)"),
+                {"name": table.name},
+            )
+            # -1 означає, що таблицю ще не аналізували (ANALYZE/autovacuum)
+            if estimate is not None and estimate >= 0:
+                return estimate
+        return await session.scalar(sa.select(sa.func.count()).select_from(table))
+
+    return await _cached(f"table:{table.name}", _load)
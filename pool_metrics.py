@@ -0,0 +1,121 @@
+# pool_metrics.py
+import heapq
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy import event, exc as sa_exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Скільки найповільніших очікувань/утримань зберігати
+SLOWEST_KEEP = 20
+# Очікування коротше за цей поріг не вважається «чеканням» на вільне з'єднання
+WAIT_THRESHOLD_SECONDS = 0.001
+
+
+class PoolStats:
+    """Накопичувальна статистика пулу з'єднань (з моменту старту процесу)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started_at = datetime.now()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_hold = 0.0
+        self.max_hold = 0.0
+        self._slowest_waits: List[tuple] = []
+        self._slowest_holds: List[tuple] = []
+
+    @staticmethod
+    def _push(heap: List[tuple], duration: float):
+        entry = (duration, datetime.now().isoformat(timespec="seconds"))
+        if len(heap) < SLOWEST_KEEP:
+            heapq.heappush(heap, entry)
+        elif duration > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+    def record_wait(self, duration: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            if timed_out:
+                self.timeouts += 1
+            if duration >= WAIT_THRESHOLD_SECONDS:
+                self.waits += 1
+                self.total_wait += duration
+                self.max_wait = max(self.max_wait, duration)
+                self._push(self._slowest_waits, duration)
+
+    def record_hold(self, duration: float):
+        with self._lock:
+            self.total_hold += duration
+            self.max_hold = max(self.max_hold, duration)
+            self._push(self._slowest_holds, duration)
+
+    def as_dict(self) -> Dict[str, Any]:
+        def _top(heap):
+            return [{"seconds": round(d, 4), "at": at} for d, at in sorted(heap, reverse=True)]
+        with self._lock:
+            return {
+                "since": self.started_at.isoformat(timespec="seconds"),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "avg_wait_seconds": round(self.total_wait / self.waits, 4) if self.waits else 0.0,
+                "max_wait_seconds": round(self.max_wait, 4),
+                "max_hold_seconds": round(self.max_hold, 4),
+                "slowest_waits": _top(self._slowest_waits),
+                "slowest_holds": _top(self._slowest_holds),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool, що вимірює час очікування на вільне з'єднання."""
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start, timed_out)
+
+
+def install_pool_metrics(engine):
+    """Підключає облік часу утримання з'єднань (checkout -> checkin)."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checkout_at"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("checkout_at", None)
+        if started is not None:
+            pool_stats.record_hold(time.perf_counter() - started)
+
+
+def pool_snapshot(engine) -> Dict[str, Any]:
+    """Поточний стан пулу + накопичена статистика."""
+    pool = engine.sync_engine.pool
+    snapshot: Dict[str, Any] = {"pool_class": type(pool).__name__, "status": pool.status()}
+    # Лічильники є лише у QueuePool-подібних пулах (не у SQLite StaticPool/NullPool)
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            snapshot[name] = method()
+    snapshot["timeout"] = getattr(pool, "_timeout", None)
+    snapshot["max_overflow"] = getattr(pool, "_max_overflow", None)
+    snapshot["stats"] = pool_stats.as_dict()
+    return snapshot
@@ -0,0 +1,75 @@
+# production_board.py
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from models import Order, OrderItem, Table
+from reference_cache import status_ids_by_flag
+from db_indexes import BOARD_STATUS_FLAGS, board_orders_filter
+
+AREAS = ("kitchen", "bar")
+# Прапорець статусу, з яким замовлення видно відповідному цеху
+AREA_STATUS_FLAGS = {"kitchen": "visible_to_chef", "bar": "visible_to_bartender"}
+
+
+@dataclass
+class ProductionTicket:
+    """Замовлення на екрані цеху: лише позиції цього цеху."""
+    order_id: int
+    created_at: Optional[datetime]
+    table_info: str
+    status_id: int
+    items: List[Tuple[str, int]] = field(default_factory=list)
+
+
+def item_area(preparation_area: Optional[str]) -> str:
+    # Все, що не 'bar', готує кухня (як у split_items_by_area)
+    return "bar" if preparation_area == "bar" else "kitchen"
+
+
+async def load_production_board(session: AsyncSession, areas: Iterable[str] = AREAS,
+                                order_ids: Iterable[int] = None) -> Dict[str, List[ProductionTicket]]:
+    """
+    Активні замовлення кухні/бару одним запитом: замовлення + позиції + столик,
+    розкладені по цехах за один прохід. Замовлення без позицій цеху на його екран не потрапляють.
+    order_ids обмежує вибірку конкретними замовленнями (напр. для оновлення одного квитка).
+    """
+    areas = tuple(areas)
+    area_statuses = {area: set(await status_ids_by_flag(session, AREA_STATUS_FLAGS[area])) for area in areas}
+    board: Dict[str, Dict[int, ProductionTicket]] = {area: {} for area in areas}
+    if not any(area_statuses.values()):
+        return {area: [] for area in areas}
+    # Фільтр - статуси всіх цехів, як у предикаті ix_orders_board_*; цех відбирається нижче
+    board_ids = set()
+    for flag in BOARD_STATUS_FLAGS:
+        board_ids.update(await status_ids_by_flag(session, flag))
+
+    query = (
+        select(
+            Order.id, Order.created_at, Order.is_delivery, Order.status_id, Table.name.label("table_name"),
+            OrderItem.name, OrderItem.quantity, OrderItem.preparation_area,
+        )
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .outerjoin(Table, Table.id == Order.table_id)
+        .where(board_orders_filter(board_ids))
+        .order_by(Order.id.asc(), OrderItem.id.asc())
+    )
+    if order_ids is not None:
+        query = query.where(Order.id.in_(list(order_ids)))
+    rows = await session.execute(query)
+
+    for row in rows:
+        area = item_area(row.preparation_area)
+        if area not in board or row.status_id not in area_statuses[area]:
+            continue
+        ticket = board[area].get(row.id)
+        if ticket is None:
+            table_info = row.table_name or ('Доставка' if row.is_delivery else 'Самовивіз')
+            ticket = board[area][row.id] = ProductionTicket(row.id, row.created_at, table_info, row.status_id)
+        ticket.items.append((row.name, row.quantity))
+
+    return {area: list(tickets.values()) for area, tickets in board.items()}
+
@@ -0,0 +1,301 @@
+# profiling.py
+import contextvars
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Запит/оновлення довше за поріг логуються разом зі списком SQL
+SLOW_REQUEST_MS = float(os.environ.get("PROFILE_SLOW_REQUEST_MS", "500"))
+# Окремий SQL-запит довше за поріг логується завжди (також поза запитами, напр. у воркерах)
+SLOW_QUERY_MS = float(os.environ.get("PROFILE_SLOW_QUERY_MS", "100"))
+# Скільки однакових SQL в одному запиті вважати ознакою N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("PROFILE_N_PLUS_ONE_THRESHOLD", "5"))
+SLOWEST_KEEP = 20
+# Обмеження пам'яті на один профіль (решта SQL лише рахується)
+MAX_STATEMENTS_PER_PROFILE = 200
+STATEMENT_PREVIEW_CHARS = 300
+
+_IN_LIST_RE = re.compile(r"\bIN \([^)]*\)", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_statement(statement: str) -> str:
+    """Текст SQL без літералів і довжини IN-списків - однакові запити з різними id збігаються."""
+    statement = _SPACE_RE.sub(" ", statement).strip()
+    statement = _IN_LIST_RE.sub("IN (...)", statement)
+    return _NUMBER_RE.sub("?", statement)
+
+
+class Profile:
+    """Вимірювання одного HTTP-запиту або одного оновлення Telegram."""
+    __slots__ = ("name", "started", "elapsed", "sql_count", "sql_time", "tg_count", "tg_time", "statements", "_shapes")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.tg_count = 0
+        self.tg_time = 0.0
+        self.statements: List[tuple] = []
+        self._shapes: Counter = Counter()
+
+    def add_statement(self, statement: str, seconds: float):
+        self.sql_count += 1
+        self.sql_time += seconds
+        self._shapes[normalize_statement(statement)] += 1
+        if len(self.statements) < MAX_STATEMENTS_PER_PROFILE:
+            self.statements.append((statement, seconds))
+
+    def add_telegram(self, method: str, seconds: float):
+        self.tg_count += 1
+        self.tg_time += seconds
+
+    def repeated_statements(self) -> List[tuple]:
+        """(нормалізований SQL, кількість) для запитів, повторених щонайменше N_PLUS_ONE_THRESHOLD разів."""
+        return [(sql, n) for sql, n in self._shapes.most_common() if n >= N_PLUS_ONE_THRESHOLD]
+
+
+_current_profile: contextvars.ContextVar[Optional[Profile]] = contextvars.ContextVar("current_profile", default=None)
+
+
+class HandlerStats:
+    __slots__ = ("count", "total", "max", "sql_count", "max_sql_count", "sql_time", "tg_count", "tg_time",
+                 "n_plus_one", "worst_repeat")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sql_count = 0
+        self.max_sql_count = 0
+        self.sql_time = 0.0
+        self.tg_count = 0
+        self.tg_time = 0.0
+        self.n_plus_one = 0
+        self.worst_repeat = ("", 0)
+
+
+class ProfileStats:
+    """Накопичувальна статистика обробників (з моменту старту процесу або останнього скидання)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now()
+            self._handlers: Dict[str, HandlerStats] = {}
+            self._slowest: List[tuple] = []
+            self._seq = 0
+
+    def record(self, profile: Profile):
+        repeated = profile.repeated_statements()
+        with self._lock:
+            stats = self._handlers.get(profile.name)
+            if stats is None:
+                stats = self._handlers[profile.name] = HandlerStats()
+            stats.count += 1
+            stats.total += profile.elapsed
+            stats.max = max(stats.max, profile.elapsed)
+            stats.sql_count += profile.sql_count
+            stats.max_sql_count = max(stats.max_sql_count, profile.sql_count)
+            stats.sql_time += profile.sql_time
+            stats.tg_count += profile.tg_count
+            stats.tg_time += profile.tg_time
+            if repeated:
+                stats.n_plus_one += 1
+                if repeated[0][1] > stats.worst_repeat[1]:
+                    stats.worst_repeat = repeated[0]
+
+            # Зразок зі списком SQL будується лише для тих, хто потрапляє в топ найповільніших;
+            # seq розрізняє однакові тривалості, щоб heapq не порівнював словники
+            if len(self._slowest) < SLOWEST_KEEP or profile.elapsed > self._slowest[0][0]:
+                self._seq += 1
+                entry = (profile.elapsed, self._seq, _profile_sample(profile))
+                if len(self._slowest) < SLOWEST_KEEP:
+                    heapq.heappush(self._slowest, entry)
+                else:
+                    heapq.heapreplace(self._slowest, entry)
+
+    def as_dict(self, top: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            handlers = [
+                {
+                    "name": name,
+                    "count": s.count,
+                    "avg_ms": round(s.total / s.count * 1000, 2),
+                    "max_ms": round(s.max * 1000, 2),
+                    "total_ms": round(s.total * 1000, 1),
+                    "avg_sql_count": round(s.sql_count / s.count, 1),
+                    "max_sql_count": s.max_sql_count,
+                    "avg_sql_ms": round(s.sql_time / s.count * 1000, 2),
+                    "avg_telegram_count": round(s.tg_count / s.count, 1),
+                    "avg_telegram_ms": round(s.tg_time / s.count * 1000, 2),
+                    "n_plus_one_requests": s.n_plus_one,
+                    "worst_repeat": {"statement": s.worst_repeat[0], "count": s.worst_repeat[1]},
+                }
+                for name, s in self._handlers.items()
+            ]
+            slowest = [sample for _, _, sample in sorted(self._slowest, reverse=True)]
+            started_at = self.started_at
+        return {
+            "since": started_at.isoformat(timespec="seconds"),
+            "slow_request_ms": SLOW_REQUEST_MS,
+            "n_plus_one_threshold": N_PLUS_ONE_THRESHOLD,
+            "handlers": sorted(handlers, key=lambda h: h["total_ms"], reverse=True)[:top],
+            "n_plus_one": sorted(
+                (h for h in handlers if h["n_plus_one_requests"]), key=lambda h: h["worst_repeat"]["count"], reverse=True
+            )[:top],
+            "slowest": slowest[:top],
+        }
+
+
+profile_stats = ProfileStats()
+
+
+def _profile_sample(profile: Profile) -> Dict[str, Any]:
+    return {
+        "name": profile.name,
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "ms": round(profile.elapsed * 1000, 2),
+        "sql_count": profile.sql_count,
+        "sql_ms": round(profile.sql_time * 1000, 2),
+        "telegram_count": profile.tg_count,
+        "telegram_ms": round(profile.tg_time * 1000, 2),
+        "statements": [
+            {"ms": round(seconds * 1000, 2), "sql": _preview(statement)} for statement, seconds in profile.statements
+        ],
+    }
+
+
+def _preview(statement: str) -> str:
+    statement = _SPACE_RE.sub(" ", statement).strip()
+    return statement if len(statement) <= STATEMENT_PREVIEW_CHARS else statement[:STATEMENT_PREVIEW_CHARS] + "..."
+
+
+def _log_slow(profile: Profile):
+    lines = [f"  {seconds * 1000:8.2f} мс  {_preview(statement)}" for statement, seconds in profile.statements]
+    if profile.sql_count > len(profile.statements):
+        lines.append(f"  ... ще {profile.sql_count - len(profile.statements)} SQL")
+    logger.warning(
+        f"Повільний обробник {profile.name}: {profile.elapsed * 1000:.1f} мс; "
+        f"SQL: {profile.sql_count} ({profile.sql_time * 1000:.1f} мс); "
+        f"Telegram: {profile.tg_count} ({profile.tg_time * 1000:.1f} мс)"
+        + ("\n" + "\n".join(lines) if lines else "")
+    )
+
+
+@asynccontextmanager
+async def profile_scope(name: str):
+    """Профілює блок коду; ім'я можна уточнити через profile.name до виходу з блоку."""
+    profile = Profile(name)
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+        profile.elapsed = time.perf_counter() - profile.started
+        profile_stats.record(profile)
+        if profile.elapsed * 1000 >= SLOW_REQUEST_MS:
+            _log_slow(profile)
+
+
+def install_query_profiling(engine):
+    """Підключає облік кількості та часу SQL-запитів до поточного профілю (події рушія SQLAlchemy)."""
+    if not PROFILING_ENABLED:
+        return
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("profile_query_start")
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.add_statement(statement, seconds)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            logger.warning(f"Повільний SQL ({seconds * 1000:.1f} мс): {_preview(statement)}")
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _on_error(exception_context):
+        # Запит з помилкою не дійде до after_cursor_execute - прибираємо його мітку часу
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("profile_query_start"):
+            conn.info["profile_query_start"].pop()
+
+
+def route_name(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        endpoint = scope.get("endpoint")
+        path = getattr(endpoint, "__name__", None) or "<unmatched>"
+    return f"{scope.get('method', '')} {path}"
+
+
+class RequestProfilingMiddleware:
+    """ASGI-middleware: час запиту, кількість і час SQL, час викликів Telegram у межах запиту."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILING_ENABLED:
+            return await self.app(scope, receive, send)
+        async with profile_scope(f"{scope.get('method', '')} {scope.get('path', '')}") as profile:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # Маршрут відомий лише після роутингу: шаблон шляху замість конкретних id
+                profile.name = route_name(scope)
+
+
+class UpdateProfilingMiddleware:
+    """aiogram-middleware (поруч з DbSessionMiddleware): профіль на кожне оновлення, ім'я - функція-обробник."""
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        if not PROFILING_ENABLED:
+            return await handler(event, data)
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        name = getattr(callback, "__name__", type(event).__name__)
+        async with profile_scope(f"tg {name}"):
+            return await handler(event, data)
+
+
+def record_telegram_call(method: str, seconds: float):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add_telegram(method, seconds)
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сесії aiogram: час викликів Bot API обліковується окремо від SQL."""
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            record_telegram_call(getattr(method, "__api_method__", type(method).__name__), time.perf_counter() - started)
@@ -0,0 +1,112 @@
+# qr_cache.py
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import qrcode
+
+logger = logging.getLogger(__name__)
+
+QR_DIR = os.path.join("static", "qr")
+# Скільки PNG тримати в пам'яті (LRU); на диску файл живе, доки існує столик
+QR_MEMORY_CACHE_SIZE = int(os.environ.get("QR_MEMORY_CACHE_SIZE", "256"))
+QR_WORKERS = int(os.environ.get("QR_WORKERS", "2"))
+
+# qrcode + PNG-кодування - чиста робота CPU, тому вона не виконується в event loop
+_executor = ThreadPoolExecutor(max_workers=QR_WORKERS, thread_name_prefix="qr")
+_memory: "OrderedDict[str, bytes]" = OrderedDict()
+_in_flight: Dict[str, asyncio.Future] = {}
+
+
+def table_menu_url(base_url: str, access_token: str) -> str:
+    return f"{base_url.rstrip('/')}/menu/table/{access_token}"
+
+
+def _table_dir(access_token: str) -> str:
+    return f"{QR_DIR}/{hashlib.sha1(access_token.encode()).hexdigest()[:20]}"
+
+
+def qr_file_path(access_token: str, base_url: str) -> str:
+    """Шлях до PNG для пари (access_token, base_url); коди столика лежать в окремій теці."""
+    digest = hashlib.sha1(f"{base_url.rstrip('/')}|{access_token}".encode()).hexdigest()[:20]
+    return f"{_table_dir(access_token)}/{digest}.png"
+
+
+def _render_png(url: str) -> bytes:
+    img = qrcode.make(url)
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def _read_file(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _remember(path: str, data: bytes):
+    _memory[path] = data
+    _memory.move_to_end(path)
+    while len(_memory) > QR_MEMORY_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+async def _load_or_generate(path: str, url: str) -> bytes:
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(_executor, _read_file, path)
+    if data is None:
+        data = await loop.run_in_executor(_executor, _render_png, url)
+        await loop.run_in_executor(_executor, _write_file, path, data)
+        logger.info(f"Згенеровано QR-код {path}")
+    return data
+
+
+async def get_qr_png(access_token: str, base_url: str) -> bytes:
+    """
+    PNG QR-коду столика: пам'ять (LRU) -> файл у static/qr -> генерація в пулі потоків.
+    Паралельні запити на той самий код чекають одну генерацію.
+    """
+    path = qr_file_path(access_token, base_url)
+    data = _memory.get(path)
+    if data is not None:
+        _memory.move_to_end(path)
+        return data
+
+    future = _in_flight.get(path)
+    if future is None:
+        future = asyncio.ensure_future(_load_or_generate(path, table_menu_url(base_url, access_token)))
+        _in_flight[path] = future
+        future.add_done_callback(lambda _: _in_flight.pop(path, None))
+    data = await asyncio.shield(future)
+    _remember(path, data)
+    return data
+
+
+def discard_table_qr(access_token: str):
+    """Видаляє всі файли QR столика (для кожної адреси сайту, з якої його відкривали)."""
+    table_dir = _table_dir(access_token)
+    for path in [p for p in _memory if p.startswith(f"{table_dir}/")]:
+        _memory.pop(path, None)
+    try:
+        shutil.rmtree(table_dir)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не вдалося видалити файли QR {table_dir}: {e}")
@@ -0,0 +1,150 @@
+# rate_limit.py
+import asyncio
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, Set, Tuple
+
+from fastapi import HTTPException, Request
+
+from metrics import rate_limited, rate_limit_config, coalesced_calls
+
+logger = logging.getLogger(__name__)
+
+# Формат лімітів: "N/S" - N запитів поспіль, далі N запитів за S секунд
+RATE_LIMIT_SPECS = {
+    # Виклик офіціанта та запит рахунку з одного столика
+    "table_call": os.environ.get("RATE_LIMIT_TABLE_CALL", "10/60"),
+    # Замовлення з одного столика
+    "table_order": os.environ.get("RATE_LIMIT_TABLE_ORDER", "5/60"),
+    # Усі публічні POST з однієї IP-адреси
+    "ip": os.environ.get("RATE_LIMIT_IP", "60/60"),
+    # Запити зі столиків з однієї IP-адреси: гостьовий Wi-Fi - одна адреса на весь зал,
+    # тому бюджет більший, а окремий столик обмежують table_call/table_order
+    "table_ip": os.environ.get("RATE_LIMIT_TABLE_IP", "300/60"),
+}
+# Вікно, за яке повторні виклики зі столика зводяться в одне сповіщення
+CALL_COALESCE_WINDOW = float(os.environ.get("CALL_COALESCE_WINDOW", "60"))
+# За reverse proxy (nginx, Render) адреса клієнта - перший запис X-Forwarded-For
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get("RATE_LIMIT_TRUST_FORWARDED", "").lower() in ("1", "true", "yes")
+
+_PRUNE_THRESHOLD = 10000
+
+
+def _parse_spec(name: str, spec: str) -> Tuple[int, float]:
+    try:
+        capacity, period = spec.split("/", 1)
+        capacity, period = int(capacity), float(period)
+        if capacity > 0 and period > 0:
+            return capacity, period
+    except ValueError:
+        pass
+    raise ValueError(f"Некоректний ліміт {name}: '{spec}' (очікується N/секунд, напр. 10/60)")
+
+
+class TokenBucketLimiter:
+    """Token bucket на ключ: capacity запитів поспіль, далі токени відновлюються рівномірно за period секунд."""
+    def __init__(self, name: str, capacity: int, period: float):
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+        self._buckets: Dict[Hashable, Tuple[float, float]] = {}
+
+    def hit(self, key: Hashable) -> float:
+        """Забирає токен. Повертає 0, якщо запит дозволено, інакше - скільки секунд чекати."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        if key not in self._buckets and len(self._buckets) > _PRUNE_THRESHOLD:
+            self._prune(now)
+        self._buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def _prune(self, now: float):
+        # Повні відра нічим не відрізняються від відсутніх
+        self._buckets = {k: v for k, v in self._buckets.items() if v[0] + (now - v[1]) * self.rate < self.capacity}
+
+
+def _build_limiters() -> Dict[str, TokenBucketLimiter]:
+    result = {}
+    for name, spec in RATE_LIMIT_SPECS.items():
+        capacity, period = _parse_spec(name, spec)
+        result[name] = TokenBucketLimiter(name, capacity, period)
+        rate_limit_config.set(capacity, limit=name, param="capacity")
+        rate_limit_config.set(period, limit=name, param="period_seconds")
+    return result
+
+
+limiters = _build_limiters()
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def check_rate_limits(*checks: Tuple[str, Hashable]):
+    """Перевіряє ліміти [(назва, ключ), ...] до будь-якої роботи з БД; при перевищенні - 429 з Retry-After."""
+    for name, key in checks:
+        retry_after = limiters[name].hit(key)
+        if retry_after:
+            rate_limited.inc(limit=name)
+            logger.warning(f"Ліміт {name} перевищено для {key}")
+            raise HTTPException(
+                status_code=429,
+                detail="Забагато запитів. Будь ласка, зачекайте трохи.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+@dataclass
+class _CallWindow:
+    on_repeat: Callable[[int], Awaitable]
+    count: int = 1
+
+
+class CallCoalescer:
+    """
+    Перший виклик зі столика сповіщається одразу, повторні за вікно лише рахуються;
+    після закриття вікна, якщо повтори були, надсилається одне сповіщення з лічильником.
+    """
+    def __init__(self, window: float):
+        self.window = window
+        self._windows: Dict[Tuple[str, Hashable], _CallWindow] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def hit(self, action: str, key: Hashable, on_repeat: Callable[[int], Awaitable]) -> bool:
+        """True - перший виклик у вікні (надсилати зараз); False - повтор, врахований у лічильнику."""
+        window = self._windows.get((action, key))
+        if window is not None:
+            window.count += 1
+            coalesced_calls.inc(action=action)
+            return False
+        self._windows[(action, key)] = _CallWindow(on_repeat)
+        asyncio.get_running_loop().call_later(self.window, self._close, action, key)
+        return True
+
+    def _close(self, action: str, key: Hashable):
+        window = self._windows.pop((action, key), None)
+        if window and window.count > 1:
+            task = asyncio.get_running_loop().create_task(self._send_repeat(action, key, window))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send_repeat(self, action: str, key: Hashable, window: _CallWindow):
+        try:
+            await window.on_repeat(window.count)
+        except Exception as e:
+            logger.error(f"Не вдалося надіслати зведене сповіщення {action} ({key}): {e}", exc_info=True)
+
+
+call_coalescer = CallCoalescer(CALL_COALESCE_WINDOW)
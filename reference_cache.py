@@ -0,0 +1,166 @@
+# reference_cache.py
+import asyncio
+import logging
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from models import OrderStatus, Role, Settings
+
+logger = logging.getLogger(__name__)
+
+# Лічильник версії довідників (статуси, ролі, налаштування).
+# Збільшується адмін-ендпоінтами після commit змін.
+_reference_version = 0
+_reference: Optional["ReferenceData"] = None
+_rebuild_lock = asyncio.Lock()
+
+STATUS_NEW = "Новий"
+STATUS_PROCESSING = "В обробці"
+STATUS_READY = "Готовий до видачі"
+
+
+@dataclass(frozen=True)
+class StatusRef:
+    id: int
+    name: str
+    notify_customer: bool
+    visible_to_operator: bool
+    visible_to_courier: bool
+    visible_to_waiter: bool
+    visible_to_chef: bool
+    visible_to_bartender: bool
+    requires_kitchen_notify: bool
+    is_completed_status: bool
+    is_cancelled_status: bool
+
+    @property
+    def is_final(self) -> bool:
+        return self.is_completed_status or self.is_cancelled_status
+
+
+@dataclass(frozen=True)
+class RoleRef:
+    id: int
+    name: str
+    can_manage_orders: bool
+    can_be_assigned: bool
+    can_serve_tables: bool
+    can_receive_kitchen_orders: bool
+    can_receive_bar_orders: bool
+
+
+@dataclass(frozen=True)
+class SettingsRef:
+    """Незмінна копія рядка Settings (id=1). Для змін використовуйте ORM-об'єкт Settings."""
+    id: int = 1
+    logo_url: Optional[str] = None
+    site_title: Optional[str] = None
+    seo_description: Optional[str] = None
+    seo_keywords: Optional[str] = None
+    primary_color: Optional[str] = None
+    secondary_color: Optional[str] = None
+    background_color: Optional[str] = None
+    font_family_sans: Optional[str] = None
+    font_family_serif: Optional[str] = None
+    telegram_welcome_message: Optional[str] = None
+
+
+def _copy_columns(ref_cls, obj):
+    return ref_cls(**{f.name: getattr(obj, f.name) for f in fields(ref_cls)})
+
+
+class ReferenceData:
+    """Знімок довідників у пам'яті процесу (статуси за id, ролі за id, налаштування)."""
+    def __init__(self, version: int, statuses: List[StatusRef], roles: List[RoleRef], settings: SettingsRef):
+        self.version = version
+        self.statuses = statuses
+        self.statuses_by_id: Dict[int, StatusRef] = {s.id: s for s in statuses}
+        self.statuses_by_name: Dict[str, StatusRef] = {}
+        for s in statuses:
+            # Як і .limit(1) у запитах за назвою - перший статус з такою назвою
+            self.statuses_by_name.setdefault(s.name, s)
+        self.final_status_ids = [s.id for s in statuses if s.is_final]
+        self.roles = roles
+        self.settings = settings
+
+
+def invalidate_reference_cache() -> int:
+    """Позначає довідники застарілими. Викликається після commit змін статусів/ролей/налаштувань."""
+    global _reference_version
+    _reference_version += 1
+    return _reference_version
+
+
+def get_reference_version() -> int:
+    return _reference_version
+
+
+async def _load_reference(session: AsyncSession, version: int) -> ReferenceData:
+    statuses_res = await session.execute(select(OrderStatus).order_by(OrderStatus.id))
+    roles_res = await session.execute(select(Role).order_by(Role.id))
+    settings_obj = await session.get(Settings, 1)
+    return ReferenceData(
+        version,
+        [_copy_columns(StatusRef, s) for s in statuses_res.scalars().all()],
+        [_copy_columns(RoleRef, r) for r in roles_res.scalars().all()],
+        _copy_columns(SettingsRef, settings_obj) if settings_obj else SettingsRef(),
+    )
+
+
+async def get_reference_data(session: AsyncSession) -> ReferenceData:
+    global _reference
+    reference = _reference
+    if reference is not None and reference.version == _reference_version:
+        return reference
+
+    async with _rebuild_lock:
+        reference = _reference
+        version = _reference_version
+        if reference is not None and reference.version == version:
+            return reference
+        reference = await _load_reference(session, version)
+        _reference = reference
+        logger.info(f"Довідники перезавантажено (версія {version}).")
+        return reference
+
+
+async def final_status_ids(session: AsyncSession) -> List[int]:
+    """Id статусів, що завершують замовлення (успіх або скасування)."""
+    return (await get_reference_data(session)).final_status_ids
+
+
+async def status_by_flag(session: AsyncSession, flag: str) -> List[StatusRef]:
+    """Статуси з увімкненим прапорцем (напр. 'visible_to_courier'), впорядковані за id."""
+    return [s for s in (await get_reference_data(session)).statuses if getattr(s, flag)]
+
+
+async def status_ids_by_flag(session: AsyncSession, flag: str) -> List[int]:
+    return [s.id for s in await status_by_flag(session, flag)]
+
+
+async def status_by_name(session: AsyncSession, name: str) -> Optional[StatusRef]:
+    return (await get_reference_data(session)).statuses_by_name.get(name)
+
+
+async def get_status(session: AsyncSession, status_id: int) -> Optional[StatusRef]:
+    return (await get_reference_data(session)).statuses_by_id.get(status_id)
+
+
+async def all_statuses(session: AsyncSession) -> List[StatusRef]:
+    return (await get_reference_data(session)).statuses
+
+
+async def role_ids_by_flag(session: AsyncSession, flag: str) -> List[int]:
+    """Id ролей з увімкненим прапорцем (напр. 'can_serve_tables')."""
+    return [r.id for r in (await get_reference_data(session)).roles if getattr(r, flag)]
+
+
+async def operator_role_ids(session: AsyncSession) -> List[int]:
+    return await role_ids_by_flag(session, "can_manage_orders")
+
+
+async def get_cached_settings(session: AsyncSession) -> SettingsRef:
+    return (await get_reference_data(session)).settings
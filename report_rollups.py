@@ -0,0 +1,331 @@
+# report_rollups.py
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy import event, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import Order, OrderItem, OrderStatus, ReportDailyRollup
+
+logger = logging.getLogger(__name__)
+
+DIM_TOTAL = "total"
+DIM_ORDER_TYPE = "order_type"
+DIM_COURIER = "courier"
+DIM_WAITER = "waiter"
+DIM_PRODUCT = "product"
+DIM_AREA = "area"
+
+_TRANSITIONS_KEY = "report_status_transitions"
+_BASELINE_IDS_KEY = "report_baseline_order_ids"
+_BASELINE_DELTAS_KEY = "report_baseline_deltas"
+# Поля замовлення, що входять у внесок до зведень (склад - через OrderItem і колекцію items)
+ROLLUP_FIELDS = ("created_at", "total_price", "order_type", "completed_by_courier_id", "accepted_by_waiter_id", "items")
+# Ключ advisory-замка PostgreSQL: перебудова виключає паралельне застосування приростів
+_REBUILD_LOCK_KEY = "report_rollups"
+
+# (dimension, day, key) -> [orders, quantity, revenue]
+Deltas = Dict[Tuple[str, date, str], List[int]]
+
+
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _contributions(connection, order_ids: Iterable[int], sign: int, deltas: Deltas = None) -> Deltas:
+    """Внесок замовлень у денні зведення (з поточного стану в БД), помножений на sign."""
+    deltas = deltas if deltas is not None else defaultdict(lambda: [0, 0, 0])
+    order_ids = list(order_ids)
+    if not order_ids:
+        return deltas
+
+    items_by_order = defaultdict(list)
+    items_res = connection.execute(
+        select(OrderItem.order_id, OrderItem.name, OrderItem.preparation_area, OrderItem.quantity, OrderItem.price)
+        .where(OrderItem.order_id.in_(order_ids))
+    )
+    for item in items_res:
+        items_by_order[item.order_id].append(item)
+
+    orders_res = connection.execute(
+        select(
+            Order.id, Order.created_at, Order.total_price, Order.order_type,
+            Order.completed_by_courier_id, Order.accepted_by_waiter_id,
+        ).where(Order.id.in_(order_ids))
+    )
+    for order in orders_res:
+        if order.created_at is None:
+            continue
+        day = _as_date(order.created_at)
+        items = items_by_order.get(order.id, [])
+        quantity = sum(i.quantity for i in items)
+
+        def add(dimension, key, orders, qty, revenue):
+            bucket = deltas[(dimension, day, str(key))]
+            bucket[0] += sign * orders
+            bucket[1] += sign * qty
+            bucket[2] += sign * revenue
+
+        add(DIM_TOTAL, "", 1, quantity, order.total_price or 0)
+        add(DIM_ORDER_TYPE, order.order_type or "delivery", 1, quantity, order.total_price or 0)
+        if order.completed_by_courier_id:
+            add(DIM_COURIER, order.completed_by_courier_id, 1, quantity, order.total_price or 0)
+        if order.accepted_by_waiter_id:
+            add(DIM_WAITER, order.accepted_by_waiter_id, 1, quantity, order.total_price or 0)
+
+        by_product = defaultdict(lambda: [0, 0])
+        by_area = defaultdict(lambda: [0, 0])
+        for item in items:
+            for bucket in (by_product[item.name], by_area[item.preparation_area or "kitchen"]):
+                bucket[0] += item.quantity
+                bucket[1] += item.quantity * item.price
+        for name, (qty, revenue) in by_product.items():
+            add(DIM_PRODUCT, name, 1, qty, revenue)
+        for area, (qty, revenue) in by_area.items():
+            add(DIM_AREA, area, 1, qty, revenue)
+    return deltas
+
+
+def _completed_status_ids(connection) -> set:
+    res = connection.execute(select(OrderStatus.id).where(OrderStatus.is_completed_status == True))
+    return {row[0] for row in res}
+
+
+def _apply_deltas(connection, deltas: Deltas):
+    table = ReportDailyRollup.__table__
+    rows = [
+        {"dimension": dim, "day": day, "key": key, "orders": v[0], "quantity": v[1], "revenue": v[2]}
+        for (dim, day, key), v in deltas.items() if any(v)
+    ]
+    if not rows:
+        return
+    dialect_name = connection.dialect.name
+    if dialect_name == "postgresql":
+        # Спільний замок: транзакції з приростами не чекають одна одну, лише перебудову
+        connection.execute(sa.text("SELECT pg_advisory_xact_lock_shared(hashtext(:key))"), {"key": _REBUILD_LOCK_KEY})
+    if dialect_name in ("postgresql", "sqlite"):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.dimension, table.c.day, table.c.key],
+            set_={col: table.c[col] + stmt.excluded[col] for col in ("orders", "quantity", "revenue")},
+        )
+        # Фіксований порядок ключів - паралельні транзакції блокують рядки в тому ж порядку
+        connection.execute(stmt, sorted(rows, key=lambda r: (r["dimension"], r["day"], r["key"])))
+        return
+    for row in rows:
+        updated = connection.execute(
+            sa.update(table)
+            .where(table.c.dimension == row["dimension"], table.c.day == row["day"], table.c.key == row["key"])
+            .values(**{col: table.c[col] + row[col] for col in ("orders", "quantity", "revenue")})
+        )
+        if updated.rowcount == 0:
+            connection.execute(sa.insert(table).values(**row))
+
+
+def capture_order_baselines(session, order_ids: Iterable[int]):
+    """
+    Знімає внесок замовлень у зведення до їх зміни - раз на транзакцію для кожного.
+    Новий внесок додається при commit, якщо замовлення тоді виконане.
+    Для UPDATE поза flush ORM викликається явно до UPDATE (order_transitions.py).
+    """
+    captured = session.info.setdefault(_BASELINE_IDS_KEY, set())
+    order_ids = [oid for oid in set(order_ids) if oid is not None and oid not in captured]
+    if not order_ids:
+        return
+    captured.update(order_ids)
+    connection = session.connection()
+    completed = _completed_status_ids(connection)
+    transitions = session.info.get(_TRANSITIONS_KEY, {})
+    rows = connection.execute(select(Order.id, Order.status_id).where(Order.id.in_(order_ids)))
+    # Перехід, записаний раніше в цій транзакції, вже змінив статус у БД - беремо початковий
+    was_completed = [oid for oid, status_id in rows if transitions.get(oid, (status_id,))[0] in completed]
+    if was_completed:
+        deltas = session.info.setdefault(_BASELINE_DELTAS_KEY, defaultdict(lambda: [0, 0, 0]))
+        _contributions(connection, was_completed, -1, deltas)
+
+
+@event.listens_for(Session, "before_flush")
+def _capture_changed_orders(session, flush_context, instances):
+    # Редагування (склад, сума, виконавці) або видалення замовлення: старий внесок
+    # знімається, доки рядки в БД ще старі
+    order_ids = set()
+    for obj in (*session.dirty, *session.deleted):
+        if not isinstance(obj, Order) or obj.id is None:
+            continue
+        attrs = sa.inspect(obj).attrs
+        if obj in session.deleted or any(attrs[name].history.has_changes() for name in ROLLUP_FIELDS):
+            order_ids.add(obj.id)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, OrderItem):
+            continue
+        order_ids.add(obj.order_id)
+        order_ids.update(sa.inspect(obj).attrs.order_id.history.deleted or ())
+        if obj.__dict__.get("order") is not None:
+            order_ids.add(obj.order.id)
+    order_ids.discard(None)
+    if order_ids:
+        capture_order_baselines(session, order_ids)
+
+
+def record_status_transition(session, order_id: int, old_status_id: Optional[int], new_status_id: int):
+    """Запам'ятовує перехід до commit; також для UPDATE поза flush ORM (order_transitions.py)."""
+    transitions = session.info.setdefault(_TRANSITIONS_KEY, {})
+    # Перший відомий старий статус у межах транзакції + останній новий
+    first_old = transitions.get(order_id, (old_status_id, None))[0]
+    transitions[order_id] = (first_old, new_status_id)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_status_transitions(session, flush_context):
+    for obj in (*session.new, *session.dirty):
+        if not isinstance(obj, Order):
+            continue
+        history = sa.inspect(obj).attrs.status_id.history
+        if obj in session.new:
+            old_status = None
+        elif history.deleted:
+            old_status = history.deleted[0]
+        else:
+            continue
+        record_status_transition(session, obj.id, old_status, obj.status_id)
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_rollups(session):
+    session.flush()
+    transitions = session.info.pop(_TRANSITIONS_KEY, None) or {}
+    baseline_ids = session.info.pop(_BASELINE_IDS_KEY, None) or set()
+    deltas = session.info.pop(_BASELINE_DELTAS_KEY, None) or defaultdict(lambda: [0, 0, 0])
+    if transitions or baseline_ids:
+        connection = session.connection()
+        completed = _completed_status_ids(connection)
+        # Для замовлень зі знятим старим внеском перехід уже врахований: додається лише новий внесок
+        entered = [
+            oid for oid, (old, new) in transitions.items()
+            if oid not in baseline_ids and new in completed and old not in completed
+        ]
+        left = [
+            oid for oid, (old, new) in transitions.items()
+            if oid not in baseline_ids and old in completed and new not in completed
+        ]
+        if baseline_ids:
+            entered += connection.execute(
+                select(Order.id).where(Order.id.in_(baseline_ids), Order.status_id.in_(completed or [-1]))
+            ).scalars().all()
+        _contributions(connection, entered, 1, deltas)
+        _contributions(connection, left, -1, deltas)
+    if deltas:
+        _apply_deltas(session.connection(), deltas)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rollup_changes(session):
+    session.info.pop(_TRANSITIONS_KEY, None)
+    session.info.pop(_BASELINE_IDS_KEY, None)
+    session.info.pop(_BASELINE_DELTAS_KEY, None)
+
+
+async def rebuild_report_rollups(session_maker, only_if_empty: bool = False):
+    """Перебудовує зведення з усіх виконаних замовлень (міграція або після ручних змін у БД)."""
+    async with session_maker() as session:
+        if only_if_empty:
+            has_rollups = await session.scalar(select(ReportDailyRollup.day).limit(1))
+            if has_rollups is not None:
+                return
+        if session.bind.dialect.name == "postgresql":
+            # Транзакції з незафіксованими приростами завершуються до перерахунку, нові - чекають його
+            await session.execute(sa.text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": _REBUILD_LOCK_KEY})
+        completed = await session.scalars(select(OrderStatus.id).where(OrderStatus.is_completed_status == True))
+        completed_ids = list(completed)
+        await session.execute(sa.delete(ReportDailyRollup.__table__))
+        if completed_ids:
+            last_id = 0
+            while True:
+                ids = list(await session.scalars(
+                    select(Order.id)
+                    .where(Order.id > last_id, Order.status_id.in_(completed_ids))
+                    .order_by(Order.id)
+                    .limit(1000)
+                ))
+                if not ids:
+                    break
+                last_id = ids[-1]
+                deltas = await session.run_sync(lambda s: _contributions(s.connection(), ids, 1))
+                await session.run_sync(lambda s: _apply_deltas(s.connection(), deltas))
+        await session.commit()
+        logger.info("Денні зведення звітів перебудовано.")
+
+
+_rebuild_task: Optional[asyncio.Task] = None
+_rebuild_pending = False
+
+
+async def _run_scheduled_rebuilds(session_maker):
+    global _rebuild_pending
+    while _rebuild_pending:
+        _rebuild_pending = False
+        try:
+            await rebuild_report_rollups(session_maker)
+        except Exception as e:
+            logger.error(f"Помилка перебудови зведень звітів: {e}", exc_info=True)
+
+
+def schedule_rollup_rebuild(session_maker):
+    """
+    Перебудова зведень у фоні, не в обробнику запиту. Запити, що прийшли під час
+    перебудови, зливаються в одну наступну - вона побачить усі їхні зміни.
+    """
+    global _rebuild_task, _rebuild_pending
+    _rebuild_pending = True
+    if _rebuild_task is None or _rebuild_task.done():
+        _rebuild_task = asyncio.create_task(_run_scheduled_rebuilds(session_maker))
+    return _rebuild_task
+
+
+async def rollup_totals(session: AsyncSession, dimension: str, date_from: date, date_to: date):
+    """Суми за період по ключах виміру (orders, quantity, revenue), за спаданням виручки."""
+    res = await session.execute(
+        select(
+            ReportDailyRollup.key,
+            func.sum(ReportDailyRollup.orders).label("orders"),
+            func.sum(ReportDailyRollup.quantity).label("quantity"),
+            func.sum(ReportDailyRollup.revenue).label("revenue"),
+        )
+        .where(
+            ReportDailyRollup.dimension == dimension,
+            ReportDailyRollup.day >= date_from,
+            ReportDailyRollup.day <= date_to,
+        )
+        .group_by(ReportDailyRollup.key)
+        .having(func.sum(ReportDailyRollup.orders) > 0)
+        .order_by(func.sum(ReportDailyRollup.revenue).desc())
+    )
+    return res.all()
+
+
+async def rollup_by_day(session: AsyncSession, dimension: str, date_from: date, date_to: date, key: str = ""):
+    """Денний ряд одного ключа виміру (за замовчуванням - загальні підсумки)."""
+    res = await session.execute(
+        select(ReportDailyRollup.day, ReportDailyRollup.orders, ReportDailyRollup.quantity, ReportDailyRollup.revenue)
+        .where(
+            ReportDailyRollup.dimension == dimension,
+            ReportDailyRollup.key == key,
+            ReportDailyRollup.day >= date_from,
+            ReportDailyRollup.day <= date_to,
+        )
+        .order_by(ReportDailyRollup.day)
+    )
+    return res.all()
@@ -0,0 +1,138 @@
+# search.py
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Order, Product, CustomerStats
+
+logger = logging.getLogger(__name__)
+
+# Пошук повертає найрелевантніші збіги без пагінації
+SEARCH_LIMIT = 100
+# Значущі цифри номера (UA: 9 цифр після коду країни/0) - «+380 50 123 45 67» == «050-123-45-67»
+PHONE_SIGNIFICANT_DIGITS = 9
+# pg_trgm не використовує індекс для шаблонів коротших за 3 символи
+MIN_PHONE_DIGITS = 3
+
+_LIKE_ESCAPE = "\\"
+
+# GIN-індекси pg_trgm; вирази мають точно збігатися з виразами в запитах нижче
+_POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_orders_customer_name_trgm ON orders USING gin (lower(customer_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_phone_digits_trgm ON orders USING gin ((regexp_replace(phone_number, '\\D', '', 'g')) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_customer_stats_name_trgm ON customer_stats USING gin (lower(customer_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_customer_stats_phone_digits_trgm ON customer_stats USING gin ((regexp_replace(phone_number, '\\D', '', 'g')) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (lower(name) gin_trgm_ops)",
+]
+
+
+async def ensure_search_indexes(engine):
+    """Створює індекси пошуку (лише PostgreSQL). На SQLite пошук працює повним скануванням."""
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        async with engine.begin() as conn:
+            for statement in _POSTGRES_SEARCH_DDL:
+                await conn.execute(sa.text(statement))
+    except Exception as e:
+        # Напр., немає прав на CREATE EXTENSION - пошук працюватиме без індексів
+        logger.warning(f"Не вдалося створити індекси пошуку pg_trgm: {e}")
+
+
+def normalize_phone(value: Optional[str]) -> str:
+    """Лише цифри номера; довгі номери обрізаються до значущої частини."""
+    digits = re.sub(r"\D", "", value or "")
+    return digits[-PHONE_SIGNIFICANT_DIGITS:]
+
+
+def _like_pattern(value: str) -> str:
+    escaped = value.replace(_LIKE_ESCAPE, _LIKE_ESCAPE * 2).replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _is_postgres(session: AsyncSession) -> bool:
+    return session.bind.dialect.name == "postgresql"
+
+
+def _phone_digits(column, postgres: bool):
+    if postgres:
+        # Константи інлайняться, інакше вираз не збігатиметься з виразом індексу
+        return sa.func.regexp_replace(
+            column, sa.literal_column(r"'\D'"), sa.literal_column("''"), sa.literal_column("'g'")
+        )
+    # SQLite: прибираємо типові роздільники
+    expr = column
+    for char in ("+", " ", "-", "(", ")"):
+        expr = sa.func.replace(expr, char, "")
+    return expr
+
+
+@dataclass
+class SearchClause:
+    condition: Any
+    # Вираз релевантності (PostgreSQL); None - сортування за замовчуванням
+    rank: Optional[Any] = None
+
+
+def _name_phone_search(session: AsyncSession, q: str, name_column, phone_column, id_column=None) -> SearchClause:
+    postgres = _is_postgres(session)
+    term = q.strip().lower()
+    name_col = sa.func.lower(name_column)
+    conditions = [name_col.like(_like_pattern(term), escape=_LIKE_ESCAPE)]
+    ranks = [sa.func.word_similarity(term, name_col)] if postgres else []
+
+    phone = normalize_phone(term)
+    if len(phone) >= MIN_PHONE_DIGITS:
+        phone_col = _phone_digits(phone_column, postgres)
+        conditions.append(phone_col.like(_like_pattern(phone), escape=_LIKE_ESCAPE))
+        if postgres:
+            ranks.append(sa.func.word_similarity(phone, phone_col))
+
+    record_id = term.lstrip("#")
+    if id_column is not None and record_id.isdigit() and len(record_id) < 10:
+        conditions.append(id_column == int(record_id))
+        if postgres:
+            ranks.append(sa.case((id_column == int(record_id), 2.0), else_=0.0))
+
+    rank = None
+    if ranks:
+        rank = ranks[0] if len(ranks) == 1 else sa.func.greatest(*ranks)
+    return SearchClause(sa.or_(*conditions), rank)
+
+
+def order_search(session: AsyncSession, q: str) -> SearchClause:
+    """Пошук замовлень за #id, іменем клієнта або номером телефону (у будь-якому форматі)."""
+    return _name_phone_search(session, q, Order.customer_name, Order.phone_number, Order.id)
+
+
+def customer_search(session: AsyncSession, q: str) -> SearchClause:
+    """Пошук клієнтів (customer_stats) за останнім іменем або номером телефону."""
+    return _name_phone_search(session, q, CustomerStats.customer_name, CustomerStats.phone_number)
+
+
+def product_search(session: AsyncSession, q: str) -> SearchClause:
+    term = q.strip().lower()
+    name_col = sa.func.lower(Product.name)
+    condition = name_col.like(_like_pattern(term), escape=_LIKE_ESCAPE)
+    rank = sa.func.similarity(term, name_col) if _is_postgres(session) else None
+    return SearchClause(condition, rank)
+
+
+def ranked(query, clause: SearchClause, *tiebreakers):
+    """Застосовує пошук: фільтр, сортування за релевантністю, обмеження SEARCH_LIMIT."""
+    query = query.where(clause.condition)
+    order_by = list(tiebreakers)
+    if clause.rank is not None:
+        order_by.insert(0, clause.rank.desc())
+    return query.order_by(*order_by).limit(SEARCH_LIMIT)
+
+
+def results_label(count: int) -> str:
+    if count >= SEARCH_LIMIT:
+        return f"Показано {SEARCH_LIMIT} найрелевантніших результатів - уточніть запит"
+    return f"Знайдено: {count}"
@@ -0,0 +1,159 @@
+# seed_data.py
+"""
+Синтетичні дані для аудиту запитів і бенчмарків: категорії, страви, столики,
+працівники та N історичних замовлень з позиціями. Генерація детермінована (seed).
+"""
+import random
+import secrets
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import sqlalchemy as sa
+
+from models import (
+    Category, Product, Table, Employee, Role, OrderStatus, Order, OrderItem,
+    create_db_tables, waiter_table_association,
+)
+from customer_stats import rebuild_customer_stats
+from report_rollups import rebuild_report_rollups
+
+BATCH_SIZE = 1000
+
+
+@dataclass
+class SeedInfo:
+    product_ids: List[int] = field(default_factory=list)
+    category_ids: List[int] = field(default_factory=list)
+    table_ids: List[int] = field(default_factory=list)
+    table_tokens: Dict[int, str] = field(default_factory=dict)
+    # роль -> [(employee_id, telegram_user_id)]
+    employees: Dict[str, List[tuple]] = field(default_factory=dict)
+    customer_user_ids: List[int] = field(default_factory=list)
+    phones: List[str] = field(default_factory=list)
+    status_ids: Dict[str, int] = field(default_factory=dict)
+
+
+async def seed_database(session_maker, orders: int = 10000, seed: int = 42, customers: int = 2000,
+                        tables: int = 30, products: int = 40) -> SeedInfo:
+    """Заповнює порожню БД і повертає ідентифікатори для сценаріїв навантаження."""
+    rng = random.Random(seed)
+    info = SeedInfo()
+    await create_db_tables()
+
+    async with session_maker() as session:
+        statuses = (await session.execute(sa.select(OrderStatus))).scalars().all()
+        info.status_ids = {s.name: s.id for s in statuses}
+        roles = {r.name: r.id for r in (await session.execute(sa.select(Role))).scalars().all()}
+
+        categories = [Category(name=f"Категорія {i}", sort_order=i) for i in range(1, 6)]
+        session.add_all(categories)
+        await session.flush()
+        info.category_ids = [c.id for c in categories]
+
+        product_objs = [
+            Product(
+                name=f"Страва {i}", description="Синтетична страва", price=rng.randint(50, 400),
+                category_id=rng.choice(info.category_ids), preparation_area="bar" if i % 3 == 0 else "kitchen",
+            )
+            for i in range(1, products + 1)
+        ]
+        session.add_all(product_objs)
+
+        table_objs = [Table(name=f"Стіл {secrets.token_hex(3)}-{i}") for i in range(1, tables + 1)]
+        session.add_all(table_objs)
+
+        staff = {"Кур'єр": 6, "Офіціант": 8, "Повар": 2, "Бармен": 2, "Оператор": 2}
+        employee_objs = []
+        for role_name, count in staff.items():
+            for i in range(count):
+                employee_objs.append(Employee(
+                    full_name=f"{role_name} {i + 1}", role_id=roles[role_name], is_on_shift=True,
+                    telegram_user_id=rng.randint(10 ** 9, 2 * 10 ** 9),
+                ))
+        session.add_all(employee_objs)
+        await session.flush()
+
+        info.product_ids = [p.id for p in product_objs]
+        info.table_ids = [t.id for t in table_objs]
+        info.table_tokens = {t.id: t.access_token for t in table_objs}
+        role_names = {v: k for k, v in roles.items()}
+        for e in employee_objs:
+            info.employees.setdefault(role_names[e.role_id], []).append((e.id, e.telegram_user_id))
+
+        waiters = [e_id for e_id, _ in info.employees["Офіціант"]]
+        await session.execute(waiter_table_association.insert(), [
+            {"employee_id": waiters[i % len(waiters)], "table_id": t_id} for i, t_id in enumerate(info.table_ids)
+        ])
+
+        info.customer_user_ids = [rng.randint(10 ** 8, 9 * 10 ** 8) for _ in range(customers // 4)]
+        info.phones = [f"+38050{rng.randint(0, 9999999):07d}" for _ in range(customers)]
+        products_by_id = {p.id: p for p in product_objs}
+        await session.commit()
+
+        await _seed_orders(session, rng, info, products_by_id, orders)
+
+    # Core-вставки оминають хуки сесії - агрегати перебудовуються повністю
+    await rebuild_customer_stats(session_maker)
+    await rebuild_report_rollups(session_maker)
+    return info
+
+
+async def _seed_orders(session, rng: random.Random, info: SeedInfo, products_by_id: dict, count: int):
+    s = info.status_ids
+    # Реалістичний розподіл: більшість замовлень давно закриті
+    status_weights = [
+        (s["Доставлений"], 55), (s["Оплачено"], 25), (s["Скасований"], 10),
+        (s["Новий"], 4), (s["В обробці"], 3), (s["Готовий до видачі"], 3),
+    ]
+    status_choices, weights = zip(*status_weights)
+    couriers = [e_id for e_id, _ in info.employees["Кур'єр"]]
+    waiters = [e_id for e_id, _ in info.employees["Офіціант"]]
+    now = datetime.now()
+
+    start_id = (await session.scalar(sa.select(sa.func.max(Order.id)))) or 0
+    order_rows, item_rows = [], []
+    for n in range(1, count + 1):
+        order_id = start_id + n
+        order_type = rng.choices(["delivery", "pickup", "in_house"], [5, 2, 3])[0]
+        status_id = rng.choices(status_choices, weights)[0]
+        picked = rng.sample(info.product_ids, rng.randint(1, 4))
+        quantities = {pid: rng.randint(1, 3) for pid in picked}
+        total = sum(products_by_id[pid].price * q for pid, q in quantities.items())
+        phone = rng.choice(info.phones) if order_type != "in_house" else None
+        courier_id = rng.choice(couriers) if order_type == "delivery" else None
+        order_rows.append({
+            "id": order_id,
+            "user_id": rng.choice(info.customer_user_ids) if order_type != "in_house" and rng.random() < 0.5 else None,
+            "products": ", ".join(f"{products_by_id[pid].name} x {q}" for pid, q in quantities.items()),
+            "total_price": total,
+            "customer_name": f"Клієнт {phone[-4:]}" if phone else None,
+            "phone_number": phone,
+            "address": "вул. Синтетична, 1" if order_type == "delivery" else None,
+            "status_id": status_id,
+            "is_delivery": order_type == "delivery",
+            "delivery_time": "Якнайшвидше",
+            "courier_id": courier_id,
+            "completed_by_courier_id": courier_id if status_id == s["Доставлений"] else None,
+            "table_id": rng.choice(info.table_ids) if order_type == "in_house" else None,
+            "accepted_by_waiter_id": rng.choice(waiters) if order_type == "in_house" else None,
+            "order_type": order_type,
+            "created_at": now - timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+        })
+        for pid, q in quantities.items():
+            product = products_by_id[pid]
+            item_rows.append({
+                "order_id": order_id, "product_id": pid, "name": product.name, "price": product.price,
+                "quantity": q, "preparation_area": product.preparation_area,
+            })
+
+        if len(order_rows) >= BATCH_SIZE or n == count:
+            await session.execute(sa.insert(Order.__table__), order_rows)
+            await session.execute(sa.insert(OrderItem.__table__), item_rows)
+            await session.commit()
+            order_rows, item_rows = [], []
+
+    if session.bind.dialect.name == "postgresql":
+        # Явні id - послідовність треба зсунути вручну
+        await session.execute(sa.text("SELECT setval(pg_get_serial_sequence('orders', 'id'), (SELECT max(id) FROM orders))"))
+        await session.commit()
@@ -0,0 +1,174 @@
+# telegram_dispatcher.py
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+from metrics import telegram_messages
+
+logger = logging.getLogger(__name__)
+
+# Ліміти Telegram Bot API: ~30 повідомлень/с на бота та ~1 повідомлення/с в один чат.
+# Значення за замовчуванням трохи нижчі, щоб лишався запас.
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("TELEGRAM_FANOUT_CONCURRENCY", "10"))
+DEFAULT_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "25"))
+DEFAULT_PER_CHAT_INTERVAL = float(os.environ.get("TELEGRAM_PER_CHAT_INTERVAL", "1.0"))
+# Telegram допускає короткі сплески в один чат: перші N повідомлень ідуть без очікування
+DEFAULT_PER_CHAT_BURST = int(os.environ.get("TELEGRAM_PER_CHAT_BURST", "3"))
+DEFAULT_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", "3"))
+
+_PER_CHAT_PRUNE_THRESHOLD = 10000
+
+
+@dataclass
+class OutgoingMessage:
+    """Одне повідомлення для розсилки. label використовується лише для логів."""
+    bot: Bot
+    chat_id: Union[int, str]
+    text: str
+    reply_markup: Any = None
+    label: str = ""
+
+
+@dataclass
+class DeliveryResult:
+    """Результат доставки для одного отримувача."""
+    chat_id: Union[int, str]
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+    message_id: Optional[int] = None
+    label: str = ""
+
+
+class _SlotLimiter:
+    """
+    Рівномірно розподіляє відправки: не частіше одного слоту на interval секунд,
+    але після простою до burst слотів видаються одразу.
+    """
+    def __init__(self, interval: float, burst: int = 1):
+        self.interval = interval
+        self.burst = max(1, burst)
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            slot = max(now - (self.burst - 1) * self.interval, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Зсуває наступний слот (використовується при RetryAfter)."""
+        loop = asyncio.get_running_loop()
+        self._next_slot = max(self._next_slot, loop.time() + seconds)
+
+
+class TelegramDispatcher:
+    """
+    Конкурентна розсилка повідомлень з обмеженням паралельності,
+    глобальним лімітом на бота, лімітом на чат та повторами при RetryAfter.
+    Очікування лімітів відбувається до зайняття слоту паралельності, тому сплеск
+    в один чат не блокує відправку в інші чати.
+    """
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+        per_chat_interval: float = DEFAULT_PER_CHAT_INTERVAL,
+        per_chat_burst: int = DEFAULT_PER_CHAT_BURST,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self.per_chat_interval = per_chat_interval
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._bot_limiters: Dict[str, _SlotLimiter] = {}
+        self._chat_limiters: Dict[tuple, _SlotLimiter] = {}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _bot_limiter(self, bot: Bot) -> _SlotLimiter:
+        key = bot.token
+        limiter = self._bot_limiters.get(key)
+        if limiter is None:
+            limiter = self._bot_limiters[key] = _SlotLimiter(self.global_interval)
+        return limiter
+
+    def _chat_limiter(self, bot: Bot, chat_id: Union[int, str]) -> _SlotLimiter:
+        key = (bot.token, str(chat_id))
+        limiter = self._chat_limiters.get(key)
+        if limiter is None:
+            if len(self._chat_limiters) > _PER_CHAT_PRUNE_THRESHOLD:
+                self._prune_chat_limiters()
+            limiter = self._chat_limiters[key] = _SlotLimiter(self.per_chat_interval, self.per_chat_burst)
+        return limiter
+
+    def _prune_chat_limiters(self):
+        now = asyncio.get_running_loop().time()
+        self._chat_limiters = {k: v for k, v in self._chat_limiters.items() if v._next_slot > now}
+
+    async def _deliver(self, message: OutgoingMessage) -> DeliveryResult:
+        bot_limiter = self._bot_limiter(message.bot)
+        chat_limiter = self._chat_limiter(message.bot, message.chat_id)
+        attempts = 0
+        last_error = None
+
+        while attempts <= self.max_retries:
+            attempts += 1
+            if attempts > 1:
+                telegram_messages.inc(result="retry")
+            # Спершу чекаємо свій слот, і лише потім займаємо місце в семафорі
+            await chat_limiter.acquire()
+            await bot_limiter.acquire()
+            try:
+                async with self._get_semaphore():
+                    sent = await message.bot.send_message(message.chat_id, message.text, reply_markup=message.reply_markup)
+                telegram_messages.inc(result="sent")
+                return DeliveryResult(
+                    chat_id=message.chat_id, ok=True, attempts=attempts,
+                    message_id=getattr(sent, "message_id", None), label=message.label
+                )
+            except TelegramRetryAfter as e:
+                last_error = str(e)
+                # Telegram просить зачекати - пригальмовуємо всього бота
+                bot_limiter.pause(e.retry_after)
+                chat_limiter.pause(e.retry_after)
+                logger.warning(f"Telegram RetryAfter {e.retry_after}с для чату {message.chat_id}")
+            except (TelegramNetworkError, TelegramServerError) as e:
+                last_error = str(e)
+                await asyncio.sleep(0.5 * (2 ** (attempts - 1)))
+            except Exception as e:
+                last_error = str(e)
+                break
+
+        telegram_messages.inc(result="failed")
+        logger.error(f"Не вдалося відправити повідомлення {message.label or ''} в чат {message.chat_id}: {last_error}")
+        return DeliveryResult(chat_id=message.chat_id, ok=False, attempts=attempts, error=last_error, label=message.label)
+
+    async def send_many(self, messages: List[OutgoingMessage]) -> List[DeliveryResult]:
+        """Відправляє всі повідомлення конкурентно. Порядок результатів відповідає порядку вхідних."""
+        if not messages:
+            return []
+        return list(await asyncio.gather(*(self._deliver(m) for m in messages)))
+
+
+# Спільний екземпляр для всього процесу (ліміти мають бути спільними для всіх роутерів)
+dispatcher = TelegramDispatcher()
+
+
+async def send_many(messages: List[OutgoingMessage]) -> List[DeliveryResult]:
+    return await dispatcher.send_many(messages)
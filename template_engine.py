@@ -0,0 +1,85 @@
+# template_engine.py
+import string
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import templates
+
+_formatter = string.Formatter()
+
+
+class CompiledTemplate:
+    """
+    Шаблон у форматі str.format (з подвоєними дужками), розібраний один раз:
+    статичні фрагменти + позиції слотів. render() дає той самий результат,
+    що й source.format(**values), але без повторного розбору рядка.
+    """
+    __slots__ = ("name", "field_names", "_parts", "_slots")
+
+    def __init__(self, source: str, name: str = ""):
+        self.name = name
+        parts: List[Any] = []
+        slots: List[Tuple[int, str, str, str]] = []
+        for literal, field_name, format_spec, conversion in _formatter.parse(source):
+            if literal:
+                parts.append(literal)
+            if field_name is not None:
+                if not field_name.isidentifier():
+                    raise ValueError(f"Шаблон {name}: підтримуються лише прості імена полів, отримано '{field_name}'")
+                slots.append((len(parts), field_name, format_spec or "", conversion or ""))
+                parts.append(None)
+        self._parts = parts
+        self._slots = slots
+        self.field_names = frozenset(s[1] for s in slots)
+
+    @staticmethod
+    def _format_value(value: Any, format_spec: str, conversion: str) -> str:
+        if conversion:
+            value = _formatter.convert_field(value, conversion)
+        if format_spec:
+            return format(value, format_spec)
+        return value if type(value) is str else format(value)
+
+    def render(self, **values: Any) -> str:
+        parts = self._parts[:]
+        for index, field_name, format_spec, conversion in self._slots:
+            parts[index] = self._format_value(values[field_name], format_spec, conversion)
+        return "".join(parts)
+
+    def iter_render(self, **values: Any) -> Iterator[str]:
+        """
+        Потоковий рендер для StreamingResponse. Значення слота може бути
+        ітерованим (генератор рядків таблиці, вкладений iter_render) - його
+        частини віддаються по мірі генерації.
+        """
+        slot_by_index = {s[0]: s for s in self._slots}
+        for index, part in enumerate(self._parts):
+            if part is not None:
+                yield part
+                continue
+            _, field_name, format_spec, conversion = slot_by_index[index]
+            value = values[field_name]
+            if isinstance(value, str) or format_spec or conversion or not isinstance(value, Iterable):
+                yield self._format_value(value, format_spec, conversion)
+            else:
+                for chunk in value:
+                    yield chunk
+
+
+def compile_templates(module) -> Dict[str, CompiledTemplate]:
+    """Компілює всі рядкові константи модуля, які є коректними str.format-шаблонами."""
+    compiled = {}
+    for attr, value in vars(module).items():
+        if not attr.isupper() or not isinstance(value, str):
+            continue
+        try:
+            compiled[attr] = CompiledTemplate(value, attr)
+        except ValueError:
+            # Не шаблон (напр. ADMIN_ORDER_FORM_BODY вставляється як є)
+            continue
+    return compiled
+
+
+# Усі шаблони з templates.py компілюються один раз при імпорті.
+COMPILED_TEMPLATES = compile_templates(templates)
+tpl = SimpleNamespace(**COMPILED_TEMPLATES)
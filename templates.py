@@ -259,6 +259,8 @@ ADMIN_HTML_TEMPLATE = """
             <a href="/admin/employees" class="{employees_active}"><i class="fa-solid fa-users"></i> Співробітники</a>
             <a href="/admin/statuses" class="{statuses_active}"><i class="fa-solid fa-clipboard-list"></i> Статуси</a>
             <a href="/admin/reports" class="{reports_active}"><i class="fa-solid fa-chart-pie"></i> Звіти</a>
+            <a href="/admin/kds/kitchen" target="_blank"><i class="fa-solid fa-fire-burner"></i> Екран кухні</a>
+            <a href="/admin/kds/bar" target="_blank"><i class="fa-solid fa-martini-glass"></i> Екран бару</a>
             <a href="/admin/design_settings" class="{design_active}"><i class="fa-solid fa-palette"></i> Дизайн та SEO</a>
             <a href="/admin/settings" class="{settings_active}"><i class="fa-solid fa-gear"></i> Налаштування</a>
         </nav>
@@ -1530,6 +1532,11 @@ WEB_ORDER_HTML = """
             }});
             closeModalBtn.addEventListener('click', closeModal);
 
+            const newIdempotencyKey = () => (window.crypto && crypto.randomUUID)
+                ? crypto.randomUUID()
+                : Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+            let orderAttemptKey = null;
+
             checkoutForm.addEventListener('submit', async e => {{
                 e.preventDefault();
                 const deliveryType = document.querySelector('input[name="delivery_type"]:checked').value;
@@ -1546,11 +1553,15 @@ WEB_ORDER_HTML = """
                     delivery_time: deliveryTime,
                     items: Object.values(cart)
                 }};
+                // Ключ живе до успішної відповіді: повторне надсилання після обриву зв'язку не створить друге замовлення
+                orderAttemptKey = orderAttemptKey || newIdempotencyKey();
                 const response = await fetch('/api/place_order', {{
                     method: 'POST',
-                    headers: {{ 'Content-Type': 'application/json' }},
+                    headers: {{ 'Content-Type': 'application/json', 'Idempotency-Key': orderAttemptKey }},
                     body: JSON.stringify(orderData)
                 }});
+                // Відповідь отримано - ключ більше не потрібен (помилки перевірки не зберігаються сервером)
+                orderAttemptKey = null;
                 if (response.ok) {{
                     alert('Дякуємо! Ваше замовлення прийнято.');
                     cart = {{}};
@@ -1684,7 +1695,7 @@ ADMIN_ROLES_BODY = """
 ADMIN_REPORTS_BODY = """
 <div class="card">
     <h2>Фільтр звіту</h2>
-    <form action="/admin/reports/couriers" method="get" class="search-form">
+    <form action="{report_url}" method="get" class="search-form">
         <label for="date_from">Дата з:</label>
         <input type="date" id="date_from" name="date_from" value="{date_from}">
         <label for="date_to">Дата по:</label>
@@ -1693,13 +1704,11 @@ ADMIN_REPORTS_BODY = """
     </form>
 </div>
 <div class="card">
-    <h2>Результати звіту за період з {date_from_formatted} по {date_to_formatted}</h2>
+    <h2>{report_title}: з {date_from_formatted} по {date_to_formatted}</h2>
+    {summary}
     <table>
         <thead>
-            <tr>
-                <th>Ім'я кур'єра</th>
-                <th>Кількість виконаних замовлень</th>
-            </tr>
+            <tr>{header_cells}</tr>
         </thead>
         <tbody>
             {report_rows}
@@ -1876,6 +1885,7 @@ ADMIN_ORDER_MANAGE_BODY = """
         <div class="card">
             <h2>Керування статусом</h2>
             <form action="/admin/order/manage/{order_id}/set_status" method="post">
+                <input type="hidden" name="expected_status_id" value="{current_status_id}">
                 <label for="status_id">Новий статус:</label>
                 <select name="status_id" id="status_id" required>
                     {status_options}
@@ -1927,6 +1937,46 @@ ADMIN_CLIENTS_LIST_BODY = """
 </div>
 """
 
+ADMIN_CLIENT_ROW = """
+    <tr>
+        <td><a href="/admin/client/{phone_link}">{customer_name}</a></td>
+        <td>{phone_number}</td>
+        <td>{order_count}</td>
+        <td>{total_spent} грн</td>
+        <td class="actions">
+            <a href="/admin/client/{phone_link}" class="button-sm">Дивитись</a>
+        </td>
+    </tr>"""
+
+ADMIN_ORDERS_BODY = """
+    <div class="card">
+        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 1.5rem;">
+            <h2>📋 Список замовлень</h2>
+            <a href="/admin/order/new" class="button"><i class="fa-solid fa-plus"></i> Створити замовлення</a>
+        </div>
+        <form action="/admin/orders" method="get" class="search-form">
+            <input type="text" name="search" placeholder="Пошук за ID, іменем, телефоном..." value="{search_query}">
+            <button type="submit">🔍 Знайти</button>
+        </form>
+        <table><thead><tr><th>ID</th><th>Клієнт</th><th>Телефон</th><th>Сума</th><th>Статус</th><th>Склад</th><th>Дії</th></tr></thead><tbody>
+        {rows}
+        </tbody></table>{pagination}
+    </div>"""
+
+ADMIN_ORDER_ROW = """
+    <tr>
+        <td><a href="/admin/order/manage/{order_id}" title="Керувати замовленням">#{order_id}</a></td>
+        <td>{customer_name}</td>
+        <td>{phone_number}</td>
+        <td>{total_price} грн</td>
+        <td><span class='status'>{status_name}</span></td>
+        <td>{products}</td>
+        <td class='actions'>
+            <a href='/admin/order/manage/{order_id}' class='button-sm' title="Керувати статусом та кур'єром">⚙️ Керувати</a>
+            <a href='/admin/order/edit/{order_id}' class='button-sm' title="Редагувати склад замовлення">✏️ Редагувати</a>
+        </td>
+    </tr>"""
+
 ADMIN_CLIENT_DETAIL_BODY = """
 <style>
     .client-info-grid {{
@@ -2596,7 +2646,8 @@ IN_HOUSE_MENU_HTML_TEMPLATE = """
                 try {{
                     const response = await fetch(apiUrl, {{ method: 'POST' }});
                     const result = await response.json();
-                    showToast(result.message);
+                    // Помилки (напр. 429 - забагато натискань) приходять у полі detail
+                    showToast(result.message || result.detail);
                 }} catch (error) {{
                     showToast('Сталася помилка. Спробуйте ще раз.');
                 }} finally {{
@@ -2613,6 +2664,11 @@ IN_HOUSE_MENU_HTML_TEMPLATE = """
                 handleApiButtonClick(e.currentTarget, `/api/menu/table/${{TABLE_ID}}/request_bill`);
             }});
 
+            const newIdempotencyKey = () => (window.crypto && crypto.randomUUID)
+                ? crypto.randomUUID()
+                : Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+            let orderAttemptKey = null;
+
             placeOrderBtn.addEventListener('click', async (e) => {{
                 const button = e.currentTarget;
                 const items = Object.values(cart);
@@ -2621,18 +2677,24 @@ IN_HOUSE_MENU_HTML_TEMPLATE = """
                 button.disabled = true;
                 button.classList.add('working');
 
+                // Ключ живе до отримання відповіді: повтор після обриву зв'язку не створить друге замовлення
+                orderAttemptKey = orderAttemptKey || newIdempotencyKey();
                 try {{
                     const response = await fetch(`/api/menu/table/${{TABLE_ID}}/place_order`, {{
                         method: 'POST',
-                        headers: {{ 'Content-Type': 'application/json' }},
+                        headers: {{ 'Content-Type': 'application/json', 'Idempotency-Key': orderAttemptKey }},
                         body: JSON.stringify(items)
                     }});
+                    orderAttemptKey = null;
                     const result = await response.json();
-                    showToast(result.message);
+                    showToast(result.message || result.detail);
                     if (response.ok) {{
                         cart = {{}};
                         // Перезавантажуємо сторінку, щоб оновити історію замовлень і загальний рахунок
                         setTimeout(() => window.location.reload(), 1500);
+                    }} else {{
+                        button.disabled = false;
+                        button.classList.remove('working');
                     }}
                 }} catch (error) {{
                     showToast('Помилка при відправці замовлення.');
@@ -2709,4 +2771,114 @@ ADMIN_DESIGN_SETTINGS_BODY = """
         </div>
     </form>
 </div>
-"""
\ No newline at end of file
+"""
+# Повноекранний екран кухні/бару (KDS); події приходять по WebSocket
+KDS_PAGE_HTML = """
+<!DOCTYPE html>
+<html lang="uk">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title} - {site_title}</title>
+    <style>
+        body {{ margin: 0; font-family: sans-serif; background: #1e1e1e; color: #f5f5f5; }}
+        header {{ display: flex; justify-content: space-between; align-items: center; padding: 10px 20px; background: #2d2d2d; }}
+        header h1 {{ margin: 0; font-size: 1.5em; }}
+        #status {{ font-size: 0.9em; padding: 4px 10px; border-radius: 12px; background: #b71c1c; }}
+        #status.online {{ background: #2e7d32; }}
+        #board {{ display: grid; grid-template-columns: repeat(auto-fill, minmax(260px, 1fr)); gap: 12px; padding: 12px; }}
+        .ticket {{ background: #fff8e1; color: #222; border-radius: 8px; padding: 12px; display: flex; flex-direction: column; }}
+        .ticket.fresh {{ animation: flash 2s ease-out; }}
+        @keyframes flash {{ from {{ background: #ffe082; }} to {{ background: #fff8e1; }} }}
+        .ticket h2 {{ margin: 0 0 4px 0; font-size: 1.3em; display: flex; justify-content: space-between; }}
+        .ticket .meta {{ color: #666; font-size: 0.9em; margin-bottom: 8px; }}
+        .ticket ul {{ margin: 0 0 12px 0; padding-left: 18px; flex-grow: 1; font-size: 1.1em; }}
+        .ticket button {{ padding: 12px; font-size: 1.1em; border: none; border-radius: 6px; background: #2e7d32; color: #fff; cursor: pointer; }}
+        .ticket button:disabled {{ background: #999; }}
+        .empty {{ padding: 40px; text-align: center; color: #aaa; grid-column: 1 / -1; }}
+    </style>
+</head>
+<body>
+    <header>
+        <h1>{title}</h1>
+        <span id="status">Немає з'єднання</span>
+    </header>
+    <div id="board"><div class="empty">Завантаження...</div></div>
+<script>
+(function () {{
+    const wsPath = "{ws_path}";
+    const board = document.getElementById("board");
+    const statusEl = document.getElementById("status");
+    const tickets = new Map();
+    let socket = null;
+    let retryDelay = 1000;
+
+    function escapeHtml(text) {{
+        const div = document.createElement("div");
+        div.textContent = text == null ? "" : String(text);
+        return div.innerHTML;
+    }}
+
+    function minutesSince(iso) {{
+        if (!iso) return "";
+        const minutes = Math.floor((Date.now() - new Date(iso).getTime()) / 60000);
+        return minutes < 1 ? "щойно" : minutes + " хв тому";
+    }}
+
+    function render() {{
+        if (tickets.size === 0) {{
+            board.innerHTML = '<div class="empty">Активних замовлень немає</div>';
+            return;
+        }}
+        const ordered = Array.from(tickets.values()).sort((a, b) => a.order_id - b.order_id);
+        board.innerHTML = ordered.map(t => `
+            <div class="ticket${{t.fresh ? " fresh" : ""}}" data-id="${{t.order_id}}">
+                <h2><span>№${{t.order_id}}</span><span>${{escapeHtml(t.table)}}</span></h2>
+                <div class="meta">${{minutesSince(t.created_at)}}</div>
+                <ul>${{t.items.map(i => `<li>${{escapeHtml(i.name)}} x ${{i.quantity}}</li>`).join("")}}</ul>
+                <button data-ready="${{t.order_id}}">✅ Готово</button>
+            </div>`).join("");
+        ordered.forEach(t => {{ t.fresh = false; }});
+    }}
+
+    function handle(message) {{
+        if (message.type === "snapshot") {{
+            tickets.clear();
+            message.tickets.forEach(t => tickets.set(t.order_id, t));
+        }} else if (message.type === "update") {{
+            message.removed.forEach(id => tickets.delete(id));
+            message.tickets.forEach(t => {{ t.fresh = t.reason === "new"; tickets.set(t.order_id, t); }});
+        }} else if (message.type === "ready_ok") {{
+            tickets.delete(message.order_id);
+        }} else if (message.type === "error") {{
+            alert(message.detail);
+        }}
+        render();
+    }}
+
+    function connect() {{
+        const scheme = location.protocol === "https:" ? "wss://" : "ws://";
+        socket = new WebSocket(scheme + location.host + wsPath);
+        socket.onopen = () => {{ statusEl.textContent = "Онлайн"; statusEl.className = "online"; retryDelay = 1000; }};
+        socket.onmessage = event => handle(JSON.parse(event.data));
+        socket.onclose = () => {{
+            statusEl.textContent = "Немає з'єднання"; statusEl.className = "";
+            setTimeout(connect, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        }};
+    }}
+
+    board.addEventListener("click", event => {{
+        const id = event.target.getAttribute("data-ready");
+        if (!id || !socket || socket.readyState !== WebSocket.OPEN) return;
+        event.target.disabled = true;
+        socket.send(JSON.stringify({{ action: "ready", order_id: Number(id) }}));
+    }});
+
+    setInterval(render, 60000);
+    connect();
+}})();
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,23 @@
+# tests/conftest.py
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# models.py читає DATABASE_URL при імпорті - тести працюють з окремим SQLite-файлом
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(prefix='tests_'), 'test.db')}"
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ADMIN_USER", "admin")
+os.environ.setdefault("ADMIN_PASS", "test")
+
+
+@pytest.fixture(scope="session")
+def scenario_queries():
+    """SQL кожного сценарію на малому і великому наборі замовлень (див. query_counting.py)."""
+    from query_counting import measure_queries
+
+    return asyncio.run(measure_queries())
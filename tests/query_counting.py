@@ -0,0 +1,266 @@
+# tests/query_counting.py
+"""
+Кількість SQL-запитів списків, екранів цехів і звітів на двох обсягах даних:
+SMALL_ORDERS і в 10 разів більше (разом із замовленнями в 10 разів ростуть столики,
+страви, категорії, співробітники й статуси). Обробник без N+1 виконує однакову
+кількість запитів незалежно від обсягу.
+"""
+import base64
+import os
+import time
+import warnings
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Tuple
+from urllib.parse import quote
+
+import httpx
+import sqlalchemy as sa
+from aiogram.types import Update
+from sqlalchemy import event
+
+from telegram_stub import stub_bot
+
+SMALL_ORDERS = 12
+LARGE_ORDERS = SMALL_ORDERS * 10
+SEED = 7
+# Звіти за весь період синтетичних даних (seed_data розкидає замовлення на рік назад)
+REPORT_PERIOD = "date_from=2000-01-01&date_to=2100-01-01"
+
+PRODUCTION_SCENARIOS = ("bot kitchen screen", "bot bar screen", "kds snapshot")
+REPORT_SCENARIOS = (
+    "GET /admin/reports/revenue", "GET /admin/reports/products",
+    "GET /admin/reports/couriers", "GET /admin/reports/waiters",
+)
+LIST_SCENARIOS = (
+    "GET /admin/orders", "GET /admin/clients", "GET /admin/client/{phone}",
+    "bot courier orders", "bot waiter tables", "bot waiter table orders", "bot customer order history",
+    "GET /admin/products", "GET /admin/tables", "GET /admin/employees", "GET /admin/statuses", "GET /admin/categories",
+)
+
+_bots = None
+
+
+@dataclass
+class Dataset:
+    """Обрані записи, на які припадає фіксована частка всіх замовлень."""
+    courier_tg: int
+    waiter_tg: int
+    cook_tg: int
+    bartender_tg: int
+    table_id: int
+    customer_user_id: int
+    phone: str
+
+
+class StatementLog:
+    """Записує SQL, виконані рушієм, поки журнал увімкнено."""
+    def __init__(self, engine):
+        self.statements: List[str] = []
+        self._active = False
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, *args):
+        if self._active:
+            self.statements.append(statement)
+
+    async def measure(self, call: Callable[[], Awaitable]) -> List[str]:
+        self.statements = []
+        self._active = True
+        try:
+            await call()
+        finally:
+            self._active = False
+        return self.statements
+
+
+def _setup_bots():
+    """Диспетчери main.py реєструються один раз на процес, боти відповідають із заглушки."""
+    global _bots
+    if _bots is None:
+        import bot_instances
+        import main as app_main
+
+        bot_instances.bot = stub_bot("1000001:TEST-CLIENT")
+        bot_instances.admin_bot = stub_bot("1000002:TEST-ADMIN")
+        client_bot, admin_bot = bot_instances.init_bots()
+        app_main.setup_dispatchers(app_main.dp, app_main.dp_admin, client_bot, admin_bot)
+        _bots = (client_bot, admin_bot)
+    return _bots
+
+
+async def _seed(orders: int) -> Dataset:
+    from models import Base, Category, Employee, Order, OrderStatus, OrderStatusHistory, Role, engine, async_session_maker
+    from seed_data import seed_database
+    from customer_stats import rebuild_customer_stats
+    from report_rollups import rebuild_report_rollups
+    from reference_cache import invalidate_reference_cache
+
+    with warnings.catch_warnings():
+        # Цикл FK employees <-> orders: SQLite видаляє таблиці і без сортування
+        warnings.simplefilter("ignore", sa.exc.SAWarning)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+    scale = orders // SMALL_ORDERS
+    info = await seed_database(
+        async_session_maker, orders=orders, seed=SEED, customers=40, tables=5 * scale, products=12 * scale,
+    )
+    data = Dataset(
+        courier_tg=info.employees["Кур'єр"][0][1],
+        waiter_tg=info.employees["Офіціант"][0][1],
+        cook_tg=info.employees["Повар"][0][1],
+        bartender_tg=info.employees["Бармен"][0][1],
+        # seed_data закріплює перший столик за першим офіціантом
+        table_id=info.table_ids[0],
+        customer_user_id=info.customer_user_ids[0],
+        phone=info.phones[0],
+    )
+    courier_id = info.employees["Кур'єр"][0][0]
+
+    # Третина замовлень активна, а обрані кур'єр, столик і клієнт отримують сталу частку
+    # всіх замовлень - розмір кожного списку росте разом з кількістю замовлень
+    async with async_session_maker() as session:
+        await session.execute(sa.update(Order).where(Order.id % 3 == 0).values(status_id=info.status_ids["Новий"]))
+        await session.execute(sa.update(Order).where(Order.is_delivery == True).values(courier_id=courier_id))
+        await session.execute(sa.update(Order).where(Order.order_type == "in_house").values(table_id=data.table_id))
+        await session.execute(
+            sa.update(Order).where(Order.order_type != "in_house", Order.id % 2 == 0)
+            .values(user_id=data.customer_user_id, phone_number=data.phone)
+        )
+        await session.execute(sa.insert(OrderStatusHistory).from_select(
+            ["order_id", "status_id", "actor_info"], sa.select(Order.id, Order.status_id, sa.literal("seed"))
+        ))
+        # Довідники адмінки теж ростуть з обсягом (seed_data створює їх фіксовану кількість)
+        role_ids = list(await session.scalars(sa.select(Role.id).order_by(Role.id)))
+        session.add_all(Category(name=f"Додаткова {i}", sort_order=100 + i) for i in range(2 * scale))
+        session.add_all(
+            Employee(full_name=f"Співробітник {i}", role_id=role_ids[i % len(role_ids)], is_on_shift=False)
+            for i in range(3 * scale)
+        )
+        session.add_all(OrderStatus(name=f"Статус {i}", visible_to_operator=False) for i in range(scale))
+        await session.commit()
+    invalidate_reference_cache()
+    await rebuild_customer_stats(async_session_maker)
+    await rebuild_report_rollups(async_session_maker)
+    return data
+
+
+def _message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+def _callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id, "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"}, "text": "test",
+            },
+        },
+    }
+
+
+def _scenarios(client: httpx.AsyncClient, data: Dataset) -> Dict[str, Callable[[], Awaitable]]:
+    import main as app_main
+    from models import async_session_maker
+    from production_board import load_production_board
+
+    client_bot, admin_bot = _setup_bots()
+    auth = "Basic " + base64.b64encode(
+        f"{os.environ['ADMIN_USER']}:{os.environ['ADMIN_PASS']}".encode()
+    ).decode()
+    update_ids = iter(range(1, 10 ** 9))
+
+    def page(path: str):
+        async def call():
+            response = await client.get(path, headers={"Authorization": auth})
+            assert response.status_code == 200, f"{path} -> {response.status_code}"
+        return call
+
+    def staff_text(user_id: int, text: str):
+        async def call():
+            update = Update.model_validate(_message_update(next(update_ids), user_id, text), context={"bot": admin_bot})
+            await app_main.dp_admin.feed_update(admin_bot, update)
+        return call
+
+    def staff_callback(user_id: int, callback_data: str):
+        async def call():
+            update = Update.model_validate(
+                _callback_update(next(update_ids), user_id, callback_data), context={"bot": admin_bot}
+            )
+            await app_main.dp_admin.feed_update(admin_bot, update)
+        return call
+
+    async def customer_history():
+        update = Update.model_validate(
+            _message_update(next(update_ids), data.customer_user_id, "📋 Мої замовлення"), context={"bot": client_bot}
+        )
+        await app_main.dp.feed_update(client_bot, update)
+
+    async def kds_snapshot():
+        async with async_session_maker() as session:
+            await load_production_board(session)
+
+    return {
+        "bot kitchen screen": staff_text(data.cook_tg, "🔪 Кухня"),
+        "bot bar screen": staff_text(data.bartender_tg, "🍹 Бар"),
+        "kds snapshot": kds_snapshot,
+        "GET /admin/reports/revenue": page(f"/admin/reports/revenue?{REPORT_PERIOD}"),
+        "GET /admin/reports/products": page(f"/admin/reports/products?{REPORT_PERIOD}"),
+        "GET /admin/reports/couriers": page(f"/admin/reports/couriers?{REPORT_PERIOD}"),
+        "GET /admin/reports/waiters": page(f"/admin/reports/waiters?{REPORT_PERIOD}"),
+        "GET /admin/orders": page("/admin/orders"),
+        "GET /admin/clients": page("/admin/clients"),
+        "GET /admin/client/{phone}": page(f"/admin/client/{quote(data.phone, safe='')}"),
+        "GET /admin/products": page("/admin/products"),
+        "GET /admin/tables": page("/admin/tables"),
+        "GET /admin/employees": page("/admin/employees"),
+        "GET /admin/statuses": page("/admin/statuses"),
+        "GET /admin/categories": page("/admin/categories"),
+        "bot courier orders": staff_text(data.courier_tg, "📦 Мої замовлення"),
+        "bot waiter tables": staff_text(data.waiter_tg, "🍽 Мої столики"),
+        "bot waiter table orders": staff_callback(data.waiter_tg, f"waiter_view_table_{data.table_id}"),
+        "bot customer order history": customer_history,
+    }
+
+
+async def _measure(orders: int) -> Dict[str, List[str]]:
+    import main as app_main
+    from models import engine
+
+    data = await _seed(orders)
+    log = StatementLog(engine)
+    statements = {}
+    transport = httpx.ASGITransport(app=app_main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for name, call in _scenarios(client, data).items():
+            # Перший виклик заповнює кеші довідників і меню
+            await call()
+            statements[name] = await log.measure(call)
+    event.remove(engine.sync_engine, "before_cursor_execute", log._on_execute)
+    return statements
+
+
+async def measure_queries() -> Dict[str, Tuple[List[str], List[str]]]:
+    """{сценарій: (SQL на SMALL_ORDERS, SQL на LARGE_ORDERS)}."""
+    from models import engine
+
+    try:
+        small = await _measure(SMALL_ORDERS)
+        large = await _measure(LARGE_ORDERS)
+    finally:
+        await engine.dispose()
+    return {name: (small[name], large[name]) for name in small}
+
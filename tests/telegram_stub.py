@@ -0,0 +1,60 @@
+# tests/telegram_stub.py
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter, TelegramServerError
+from aiogram.types import Chat, Message
+
+
+class StubSession(BaseSession):
+    """
+    Фейкова сесія Bot API без мережі. Методи send*/edit* повертають Message, решта - True.
+    script - chat_id -> список відповідей по черзі ('ok', 'retry_after', 'server_error', 'bad_request').
+    """
+    def __init__(self, script=None, retry_after: int = 1):
+        super().__init__()
+        self.script = {chat_id: list(steps) for chat_id, steps in (script or {}).items()}
+        self.retry_after = retry_after
+        self.calls = []  # (назва методу, chat_id, loop.time())
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = getattr(method, "chat_id", None)
+        self.calls.append((type(method).__name__, chat_id, asyncio.get_running_loop().time()))
+        steps = self.script.get(chat_id)
+        step = steps.pop(0) if steps else "ok"
+        if step == "retry_after":
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+        if step == "server_error":
+            raise TelegramServerError(method=method, message="Bad Gateway")
+        if step == "bad_request":
+            raise TelegramBadRequest(method=method, message="chat not found")
+
+        name = type(method).__name__
+        if not (name.startswith("Send") or name.startswith("Edit")):
+            return True
+        self._message_id += 1
+        return Message(
+            message_id=self._message_id, date=datetime.now(),
+            chat=Chat(id=chat_id or 1, type="private"), text=getattr(method, "text", None),
+        )
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def times(self, chat_id):
+        return [at for _, called_chat, at in self.calls if called_chat == chat_id]
+
+
+def stub_bot(token: str = "42:TEST", session: StubSession = None) -> Bot:
+    return Bot(
+        token=token, session=session or StubSession(),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
@@ -0,0 +1,48 @@
+# tests/test_idempotent_orders.py
+import asyncio
+import warnings
+
+import httpx
+import sqlalchemy as sa
+
+from rate_limit import RATE_LIMIT_SPECS
+
+
+async def _retry_burst(retries: int):
+    """Перше замовлення столика і серія повторів з тим самим Idempotency-Key."""
+    import main as app_main
+    from models import Base, Order, engine, async_session_maker
+    from seed_data import seed_database
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", sa.exc.SAWarning)
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+        info = await seed_database(async_session_maker, orders=0, seed=5, customers=4, tables=1, products=3)
+        table_id = info.table_ids[0]
+        transport = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = [
+                await client.post(
+                    f"/api/menu/table/{table_id}/place_order",
+                    json=[{"id": info.product_ids[0], "quantity": 1}],
+                    headers={"Idempotency-Key": "retry-burst-0001"},
+                )
+                for _ in range(retries + 1)
+            ]
+        async with async_session_maker() as session:
+            orders = await session.scalar(sa.select(sa.func.count(Order.id)).where(Order.table_id == table_id))
+        return responses, orders
+    finally:
+        await engine.dispose()
+
+
+def test_replays_are_not_rate_limited():
+    capacity = int(RATE_LIMIT_SPECS["table_order"].split("/")[0])
+    responses, orders = asyncio.run(_retry_burst(capacity * 2))
+
+    assert [r.status_code for r in responses] == [200] * len(responses)
+    assert len({r.json()["order_id"] for r in responses}) == 1
+    assert all(r.headers.get("Idempotent-Replayed") == "true" for r in responses[1:])
+    assert orders == 1
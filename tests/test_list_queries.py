@@ -0,0 +1,27 @@
+# tests/test_list_queries.py
+import pytest
+
+from query_counting import LIST_SCENARIOS, SMALL_ORDERS, LARGE_ORDERS
+
+# Історію статусів показує лише картка клієнта
+HISTORY_SCENARIOS = {"GET /admin/client/{phone}"}
+
+
+@pytest.mark.parametrize("scenario", LIST_SCENARIOS)
+def test_list_query_count_does_not_grow_with_orders(scenario_queries, scenario):
+    small, large = map(len, scenario_queries[scenario])
+    assert small == large, (
+        f"{scenario}: {small} SQL на {SMALL_ORDERS} замовлень, {large} SQL на {LARGE_ORDERS}"
+    )
+
+
+@pytest.mark.parametrize("scenario", sorted(set(LIST_SCENARIOS) - HISTORY_SCENARIOS))
+def test_lists_do_not_load_status_history(scenario_queries, scenario):
+    _, large = scenario_queries[scenario]
+    assert not [sql for sql in large if "order_status_history" in sql]
+
+
+@pytest.mark.parametrize("scenario", LIST_SCENARIOS)
+def test_lists_do_not_load_order_items(scenario_queries, scenario):
+    _, large = scenario_queries[scenario]
+    assert not [sql for sql in large if "FROM order_items" in sql]
@@ -0,0 +1,12 @@
+# tests/test_production_queries.py
+import pytest
+
+from query_counting import PRODUCTION_SCENARIOS, REPORT_SCENARIOS, SMALL_ORDERS, LARGE_ORDERS
+
+
+@pytest.mark.parametrize("scenario", PRODUCTION_SCENARIOS + REPORT_SCENARIOS)
+def test_query_count_does_not_grow_with_orders(scenario_queries, scenario):
+    small, large = map(len, scenario_queries[scenario])
+    assert small == large, (
+        f"{scenario}: {small} SQL на {SMALL_ORDERS} замовлень, {large} SQL на {LARGE_ORDERS}"
+    )
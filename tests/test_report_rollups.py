@@ -0,0 +1,68 @@
+# tests/test_report_rollups.py
+import asyncio
+import warnings
+
+import sqlalchemy as sa
+from sqlalchemy.orm import selectinload
+
+
+async def _rollup_rows(session_maker):
+    from models import ReportDailyRollup
+
+    async with session_maker() as session:
+        res = await session.execute(
+            sa.select(ReportDailyRollup.dimension, ReportDailyRollup.day, ReportDailyRollup.key,
+                      ReportDailyRollup.orders, ReportDailyRollup.quantity, ReportDailyRollup.revenue)
+            .where(sa.or_(ReportDailyRollup.orders != 0, ReportDailyRollup.revenue != 0))
+            .order_by(ReportDailyRollup.dimension, ReportDailyRollup.day, ReportDailyRollup.key)
+        )
+        return [tuple(row) for row in res]
+
+
+async def _edit_completed_orders():
+    """Зведення після редагувань і видалення виконаних замовлень проти перебудови з нуля."""
+    from models import Base, Employee, Order, engine, async_session_maker
+    from order_items import replace_order_items, make_order_item
+    from order_transitions import transition_order_status
+    from report_rollups import rebuild_report_rollups
+    from seed_data import seed_database
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", sa.exc.SAWarning)
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+        info = await seed_database(async_session_maker, orders=40, seed=11, customers=8, tables=3, products=6)
+        completed = [info.status_ids["Доставлений"], info.status_ids["Оплачено"]]
+
+        async with async_session_maker() as session:
+            orders = (await session.scalars(
+                sa.select(Order).options(selectinload(Order.items))
+                .where(Order.status_id.in_(completed)).order_by(Order.id).limit(4)
+            )).all()
+            edited, repriced, reassigned, removed = orders
+            # Склад і сума
+            await replace_order_items(session, edited, [make_order_item(None, 5, name="Нова позиція", price=70)])
+            await session.commit()
+            # Лише сума
+            repriced.total_price += 1000
+            await session.commit()
+            # Виконавець через UPDATE поза ORM
+            waiter_id = info.employees["Офіціант"][-1][0]
+            transition = await transition_order_status(
+                session, reassigned.id, reassigned.status_id, "test", values={"accepted_by_waiter_id": waiter_id},
+            )
+            assert transition.ok
+            await session.delete(removed)
+            await session.commit()
+
+        incremental = await _rollup_rows(async_session_maker)
+        await rebuild_report_rollups(async_session_maker)
+        return incremental, await _rollup_rows(async_session_maker)
+    finally:
+        await engine.dispose()
+
+
+def test_rollups_follow_edits_of_completed_orders():
+    incremental, rebuilt = asyncio.run(_edit_completed_orders())
+    assert incremental == rebuilt
@@ -0,0 +1,99 @@
+# tests/test_telegram_dispatcher.py
+import asyncio
+
+from telegram_dispatcher import OutgoingMessage, TelegramDispatcher
+from telegram_stub import StubSession, stub_bot
+
+
+def _dispatcher(**kwargs) -> TelegramDispatcher:
+    options = dict(max_concurrency=10, global_rate=0, per_chat_interval=0, per_chat_burst=1, max_retries=3)
+    options.update(kwargs)
+    return TelegramDispatcher(**options)
+
+
+async def _timed_send(dispatcher: TelegramDispatcher, messages):
+    started = asyncio.get_running_loop().time()
+    return started, await dispatcher.send_many(messages)
+
+
+def test_retry_after_pauses_chat_and_retries():
+    session = StubSession({1: ["retry_after", "ok"]}, retry_after=1)
+    bot = stub_bot(session=session)
+
+    results = asyncio.run(_dispatcher().send_many([OutgoingMessage(bot, 1, "hi")]))
+
+    assert results[0].ok and results[0].attempts == 2
+    first, second = session.times(1)
+    assert second - first >= 0.95
+
+
+def test_per_chat_spacing():
+    session = StubSession()
+    bot = stub_bot(session=session)
+    dispatcher = _dispatcher(per_chat_interval=0.05)
+
+    started, results = asyncio.run(_timed_send(dispatcher, [OutgoingMessage(bot, 1, f"m{i}") for i in range(4)]))
+
+    assert all(r.ok for r in results)
+    times = session.times(1)
+    assert len(times) == 4
+    # Слоти рахуються від першої відправки; допуск - на ранні пробудження циклу подій
+    assert all(at - started >= n * 0.05 - 0.005 for n, at in enumerate(times))
+
+
+def test_per_chat_burst_is_sent_without_waiting():
+    session = StubSession()
+    bot = stub_bot(session=session)
+    dispatcher = _dispatcher(per_chat_interval=0.2, per_chat_burst=3)
+
+    started, _ = asyncio.run(_timed_send(dispatcher, [OutgoingMessage(bot, 1, f"m{i}") for i in range(4)]))
+
+    times = session.times(1)
+    assert times[2] - started < 0.1
+    assert times[3] - started >= 0.195
+
+
+def test_busy_chat_does_not_block_other_chats():
+    session = StubSession()
+    bot = stub_bot(session=session)
+    # Один слот паралельності: повідомлення, що чекають ліміту чату, не мають його займати
+    dispatcher = _dispatcher(max_concurrency=1, per_chat_interval=0.2)
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        messages = [OutgoingMessage(bot, 1, f"m{i}") for i in range(5)] + [OutgoingMessage(bot, 2, "other")]
+        await dispatcher.send_many(messages)
+        return started
+
+    started = asyncio.run(run())
+    assert session.times(2)[0] - started < 0.1
+
+
+def test_send_many_reports_partial_failures_in_order():
+    session = StubSession({2: ["bad_request"], 3: ["server_error", "ok"]})
+    bot = stub_bot(session=session)
+
+    results = asyncio.run(_dispatcher().send_many([
+        OutgoingMessage(bot, 1, "a", label="first"),
+        OutgoingMessage(bot, 2, "b", label="second"),
+        OutgoingMessage(bot, 3, "c", label="third"),
+    ]))
+
+    assert [r.chat_id for r in results] == [1, 2, 3]
+    assert [r.ok for r in results] == [True, False, True]
+    # Постійна помилка не повторюється, тимчасова - повторюється
+    assert results[1].attempts == 1 and "chat not found" in results[1].error
+    assert results[1].label == "second"
+    assert results[2].attempts == 2
+    assert results[0].message_id is not None
+
+
+def test_send_many_gives_up_after_max_retries():
+    session = StubSession({1: ["retry_after"] * 5}, retry_after=0)
+    bot = stub_bot(session=session)
+
+    results = asyncio.run(_dispatcher(max_retries=2).send_many([OutgoingMessage(bot, 1, "x")]))
+
+    assert not results[0].ok
+    assert results[0].attempts == 3
+    assert len(session.calls) == 3